@@ -0,0 +1,39 @@
+"""
+    The cHW coupling samples in Data/. Each sample is named by its coupling,
+    with z for zero and p for the decimal point, so that vh_chw_zp005.dat holds
+    the events at cHW = 0.005 and vh_chw_zpz1.dat those at cHW = 0.01, while
+    the SM sample is vh_chw_zero_100k.dat. The cross sections (in pb) are those
+    the LLR scripts use, and are only known for some of the samples.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+SM_NAME = 'zero'
+
+CROSS_SECTIONS = {'zero': 0.014009,
+                  'zp005': 0.017125}
+
+def coupling_value(name):
+    """
+    The value of cHW of the sample with the given name, such as 'zp005' or 'zero'.
+    """
+    if name == SM_NAME:
+        return 0.0
+    return float(name.replace('z', '0').replace('p', '.'))
+
+def coupling_file(name, data_dir='Data/'):
+    """
+    The .dat file of the sample with the given name.
+    """
+    if name == SM_NAME:
+        return data_dir + 'vh_chw_zero_100k.dat'
+    return data_dir + 'vh_chw_' + name + '.dat'
+
+def cross_sections(names, given=None):
+    """
+    The cross section (in pb) of each sample, from given (a list in the order of names,
+    with 0 for any not given) or else from CROSS_SECTIONS, or None if it is not known.
+    """
+    given = given if given else [0]*len(names)
+    if len(given) != len(names):
+        raise ValueError("Give one cross section per coupling")
+    return [given[i] if given[i] > 0 else CROSS_SECTIONS.get(name) for i, name in enumerate(names)]
@@ -0,0 +1,106 @@
+"""
+    Cached ingestion of the whitespace separated .dat event files in Data/.
+    Each file is parsed once, in chunks, into a float32 .npy file stored
+    column by column (Fortran order) in a cache directory next to it, and
+    every later read memory maps the cache instead of parsing the text again.
+    The cache of a file is rebuilt when the file changes, which is noticed
+    from its size and modification time and confirmed with a hash of its
+    contents, so that a file that is only touched or copied is not parsed
+    again.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+def file_hash(path, chunk_size=2**20):
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def cache_paths(path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), 'cache')
+    name = os.path.join(cache_dir, os.path.basename(path))
+    return name + '.npy', name + '.json'
+
+def cache_is_valid(path, array_path, meta_path):
+    """
+    Whether the cache of path is up to date, updating its recorded size and
+    modification time if only those changed and not the contents.
+    """
+    if not (os.path.exists(array_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    stat = os.stat(path)
+    if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    if meta['size'] != stat.st_size or meta['sha1'] != file_hash(path):
+        return False
+    meta['mtime_ns'] = stat.st_mtime_ns
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return True
+
+def count_lines(path, chunk_size=2**24):
+    n_lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            n_lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # A last line without a newline
+    return n_lines + (last != b'\n')
+
+def parse_events(path, array_path, chunk_size=1000000):
+    """
+    Parse path chunk_size lines at a time straight into a float32 Fortran ordered
+    .npy file at array_path, so that files larger than memory can be cached.
+    """
+    n_rows = count_lines(path)
+    events = None
+    n_parsed = 0
+    for chunk in pd.read_csv(path, sep=r"\s+", header=None, dtype=np.float32, chunksize=chunk_size):
+        if events is None:
+            events = np.lib.format.open_memmap(array_path, mode='w+', dtype=np.float32, shape=(n_rows, chunk.shape[1]), fortran_order=True)
+        events[n_parsed:n_parsed+len(chunk)] = chunk.to_numpy()
+        n_parsed += len(chunk)
+    if events is None:
+        raise ValueError("No events in " + path)
+    events.flush()
+    if n_parsed < n_rows:
+        # Blank lines were counted but skipped, so copy the parsed rows to a file of the right size a column at a time
+        trimmed_path = array_path[:-4] + '.trim.npy'
+        trimmed = np.lib.format.open_memmap(trimmed_path, mode='w+', dtype=np.float32, shape=(n_parsed, events.shape[1]), fortran_order=True)
+        for column in range(events.shape[1]):
+            trimmed[:,column] = events[:n_parsed,column]
+        trimmed.flush()
+        del events, trimmed
+        os.replace(trimmed_path, array_path)
+
+def load_events(path, cache_dir=None):
+    """
+    All the columns of a .dat file as a float32 read-only memory map of shape
+    (n_events, n_columns), parsing the file and caching it first if there is no
+    up to date cache of it.
+    """
+    array_path, meta_path = cache_paths(path, cache_dir)
+    if not cache_is_valid(path, array_path, meta_path):
+        print("Parsing " + path + " into cache " + array_path)
+        os.makedirs(os.path.dirname(array_path), exist_ok=True)
+        stat = os.stat(path)
+        # Written under temporary names and then renamed, so another run never reads a half written cache
+        tmp_array_path = array_path[:-4] + '.tmp' + str(os.getpid()) + '.npy'
+        parse_events(path, tmp_array_path)
+        os.replace(tmp_array_path, array_path)
+        tmp_meta_path = meta_path + '.tmp' + str(os.getpid())
+        with open(tmp_meta_path, 'w') as meta_file:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_hash(path)}, meta_file)
+        os.replace(tmp_meta_path, meta_path)
+    return np.load(array_path, mmap_mode='r')
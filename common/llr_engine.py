@@ -0,0 +1,256 @@
+"""
+    Vectorised binned LLR tests. The toy experiments of a test are held as one
+    (n_toys, n_bins) matrix of the counts of events in each bin of the
+    reference pdfs, and the LLR of every toy is a single matrix product of the
+    counts with the log pdfs, in place of the per-toy, per-event loops of the
+    LLR scripts. The statistic is the one of run_toys_luminosity in the LLR
+    scripts: -2 times the log of the Poisson likelihood ratio of the number of
+    events plus -2 times the log likelihood ratio of the pdf bins of the events,
+    with bins where a pdf is zero left out of its sum. The generalised test of
+    eft_vae_llr_general.py, and the profile likelihood test with the number of
+    signal events fitted, are built from the same bin probabilities.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+from scipy.stats import norm, chi2
+
+def bin_probabilities(pdf, bins):
+    """
+    The probability of an event falling in each bin of a pdf (a density over the given bin edges).
+    """
+    probabilities = np.asarray(pdf, dtype=np.float64)*np.diff(bins)
+    return probabilities/np.sum(probabilities)
+
+def log_pdf(pdf):
+    """
+    -2 log of a pdf in each bin, with empty bins giving 0 as they are left out of the LLR sums.
+    """
+    pdf = np.asarray(pdf, dtype=np.float64)
+    return np.where(pdf > 0, -2*np.log(np.where(pdf > 0, pdf, 1.0)), 0.0)
+
+def toy_counts(probabilities, mean_n_events, n_toys, rng):
+    """
+    The (n_toys, n_bins) counts of n_toys toy experiments, each with a Poisson number of
+    events of mean mean_n_events drawn from the bin probabilities. The count of each bin is
+    drawn as an independent Poisson number, which is the same as drawing the number of events
+    and then the bin of each event.
+    """
+    return rng.poisson(mean_n_events*np.asarray(probabilities), size=(n_toys, len(probabilities)))
+
+def poisson_llr(n_events, mu_b, mu_s):
+    """
+    -2 log of the ratio of the Poisson likelihoods of n_events under the background and signal hypotheses.
+    """
+    return -2*(np.asarray(n_events)*np.log(mu_b/mu_s) + (mu_s - mu_b))
+
+def binned_llr(counts, log_pdf_b, log_pdf_s, mu_b, mu_s):
+    """
+    The LLR of each toy of counts (n_toys, n_bins), with log_pdf_b and log_pdf_s from
+    log_pdf() for the background and signal pdfs and mu_b and mu_s their expected numbers
+    of events.
+    """
+    return poisson_llr(np.sum(counts, axis=-1), mu_b, mu_s) + counts @ (log_pdf_b - log_pdf_s)
+
+def alpha_equal(llr_b, llr_s, weights_s=None):
+    """
+    The significance level alpha of the LLR test at the cut where it equals the probability
+    beta of background-like signal toys, found from the toys themselves as get_alpha_exact
+    in the LLR scripts does from their histograms. The background toys lie to the left of
+    the signal toys. If no toys overlap alpha is given as half a toy, so the significance
+    is then a lower bound. The signal toys may be weighted by weights_s, when they are
+    reweighted from toys of another hypothesis.
+    """
+    llr_b = np.sort(llr_b)
+    order = np.argsort(llr_s)
+    llr_s = np.asarray(llr_s)[order]
+    weights_s = np.ones(len(llr_s)) if weights_s is None else np.asarray(weights_s)[order]
+    cumulative_s = np.concatenate(([0.0], np.cumsum(weights_s)))/np.sum(weights_s)
+    cuts = np.concatenate((llr_b, llr_s))
+    # The fraction of background toys above each cut and of signal toys at or below it
+    alpha = 1.0 - np.searchsorted(llr_b, cuts, side='right')/len(llr_b)
+    beta = cumulative_s[np.searchsorted(llr_s, cuts, side='right')]
+    alpha = alpha[np.argmin(np.abs(alpha - beta))]
+    return max(min(alpha, 1.0 - alpha), 0.5/len(llr_b))
+
+def nstdevs(alpha):
+    """
+    The number of standard deviations n with alpha = (1/sqrt(2 pi)) int_n^inf exp(-x^2/2) dx, as get_nstdevs in the LLR scripts.
+    """
+    return norm.isf(alpha)
+
+def luminosity_test(probabilities_b, probabilities_s, log_pdf_b, log_pdf_s, mu_b, mu_s, n_toys, rng, counts_b=None):
+    """
+    alpha and the number of standard deviations of the test of background against signal
+    with mu_b and mu_s expected events, from n_toys toys of each. The background toys,
+    which do not depend on the signal, can be passed in as counts_b to be reused between
+    tests of different signals. Returns alpha, nstdevs and the LLRs of the toys.
+    """
+    if counts_b is None:
+        counts_b = toy_counts(probabilities_b, mu_b, n_toys, rng)
+    counts_s = toy_counts(probabilities_s, mu_s, n_toys, rng)
+    llr_b = binned_llr(counts_b, log_pdf_b, log_pdf_s, mu_b, mu_s)
+    llr_s = binned_llr(counts_s, log_pdf_b, log_pdf_s, mu_b, mu_s)
+    alpha = alpha_equal(llr_b, llr_s)
+    return alpha, nstdevs(alpha), llr_b, llr_s
+
+def mixture_pdfs(pdf_b, pdf_s, mu_b, mu_signal):
+    """
+    The pdfs (len(mu_signal), n_bins) and expected numbers of events of the background, with
+    mu_b expected events, mixed with each expected number of signal events mu_signal.
+    """
+    mu_signal = np.asarray(mu_signal, dtype=np.float64)
+    fractions = mu_signal/(mu_b + mu_signal)
+    pdfs = (1.0 - fractions)[:,None]*np.asarray(pdf_b)[None,:] + fractions[:,None]*np.asarray(pdf_s)[None,:]
+    return pdfs, mu_b + mu_signal
+
+def rate_scan(pdf_b, pdfs_s, mu_b, mu_s, bins, n_toys, rng):
+    """
+    alpha and the number of standard deviations of the tests of the background, with pdf pdf_b
+    and mu_b expected events, against each of K alternatives with pdfs_s (K, n_bins) and mu_s
+    expected events, such as the background mixed with different amounts of signal. One set of
+    background toys and one set of alternative toys are drawn, the latter shared out equally
+    between the alternatives, and every alternative toy is reweighted to each alternative by the
+    ratio of its Poisson likelihood under that alternative to its average likelihood under all of
+    them, so the weights are never more than K. The LLRs of every alternative are one matrix
+    product of the counts with the (n_bins, K) matrix of log pdf columns. Returns alpha, nstdevs
+    and the effective number of toys of each alternative.
+    """
+    mu_s = np.asarray(mu_s, dtype=np.float64)
+    probabilities_b = bin_probabilities(pdf_b, bins)
+    expected_s = mu_s[:,None]*np.stack([bin_probabilities(pdf, bins) for pdf in pdfs_s])
+    log_pdf_columns = (log_pdf(pdf_b)[None,:] - log_pdf(pdfs_s)).T
+    counts_b = toy_counts(probabilities_b, mu_b, n_toys, rng)
+    counts_s = rng.poisson(expected_s[np.arange(n_toys) % len(mu_s)])
+    # The Poisson log likelihoods (n_toys, K) of the alternative toys under every alternative
+    empty = expected_s <= 0
+    log_likelihoods = counts_s @ np.log(np.where(empty, 1.0, expected_s)).T - mu_s
+    log_likelihoods[((counts_s > 0).astype(np.float64) @ empty.T) > 0] = -np.inf
+    log_likelihoods -= np.max(log_likelihoods, axis=1, keepdims=True)
+    weights = np.exp(log_likelihoods)/np.mean(np.exp(log_likelihoods), axis=1, keepdims=True)
+    llr_b = poisson_llr(np.sum(counts_b, axis=1)[:,None], mu_b, mu_s[None,:]) + counts_b @ log_pdf_columns
+    llr_s = poisson_llr(np.sum(counts_s, axis=1)[:,None], mu_b, mu_s[None,:]) + counts_s @ log_pdf_columns
+    alpha = np.array([alpha_equal(llr_b[:,k], llr_s[:,k], weights[:,k]) for k in range(len(mu_s))])
+    effective_n_toys = np.sum(weights, axis=0)**2/np.sum(weights**2, axis=0)
+    return alpha, nstdevs(alpha), effective_n_toys
+
+def multi_hypothesis_test(pdf_b, pdfs_s, mu_b, mu_s, bins, n_toys, rng):
+    """
+    alpha and the number of standard deviations of the tests of the background, with pdf pdf_b
+    and mu_b expected events, against each of K alternatives with pdfs_s (K, n_bins) and mu_s
+    expected events. The background toys are drawn once for all the alternatives and their
+    (n_toys, K) matrix of LLRs is one matrix product of their counts with the (n_bins, K) matrix
+    of log pdf columns, while the toys of each alternative are drawn one alternative at a time
+    (to keep to one (n_toys, n_bins) matrix in memory) and only need their own column. Returns
+    alpha, nstdevs and the (n_toys, K) LLRs of the background and alternative toys.
+    """
+    mu_s = np.asarray(mu_s, dtype=np.float64)
+    log_pdf_b = log_pdf(pdf_b)
+    log_pdf_columns = (log_pdf_b[None,:] - log_pdf(pdfs_s)).T
+    counts_b = toy_counts(bin_probabilities(pdf_b, bins), mu_b, n_toys, rng)
+    llr_b = poisson_llr(np.sum(counts_b, axis=1)[:,None], mu_b, mu_s[None,:]) + counts_b @ log_pdf_columns
+    llr_s = np.zeros_like(llr_b)
+    for k, pdf_s in enumerate(pdfs_s):
+        counts_s = toy_counts(bin_probabilities(pdf_s, bins), mu_s[k], n_toys, rng)
+        llr_s[:,k] = poisson_llr(np.sum(counts_s, axis=1), mu_b, mu_s[k]) + counts_s @ log_pdf_columns[:,k]
+    alpha = np.array([alpha_equal(llr_b[:,k], llr_s[:,k]) for k in range(len(mu_s))])
+    return alpha, nstdevs(alpha), llr_b, llr_s
+
+def expected_pdf_term(probabilities_s, log_pdf_b, log_pdf_s, n_events):
+    """
+    The expectation of the pdf term of the LLR, counts @ (log_pdf_b - log_pdf_s), over toys of
+    n_events events drawn from the bin probabilities_s: n_events times its average over one event.
+    """
+    return n_events*np.dot(probabilities_s, log_pdf_b - log_pdf_s)
+
+def general_test(probabilities_s, log_pdf_b, log_pdf_s, mu_b, mu_s, n_toys, rng):
+    """
+    alpha and the number of standard deviations of the generalised test of eft_vae_llr_general.py,
+    for mu_s expected events against mu_b. The LLR is the Poisson term of the expected numbers of
+    events less the average of the pdf term over toys of mu_s events (rounded down, as there), and
+    alpha is its p-value under the half chi-square distribution of one degree of freedom. With
+    n_toys 0 the average is found exactly rather than from toys.
+    """
+    if n_toys > 0:
+        counts = rng.multinomial(int(mu_s), probabilities_s, size=n_toys)
+        pdf_term = np.mean(counts @ (log_pdf_b - log_pdf_s))
+    else:
+        pdf_term = expected_pdf_term(probabilities_s, log_pdf_b, log_pdf_s, int(mu_s))
+    llr = poisson_llr(mu_s, mu_b, mu_s) - pdf_term
+    alpha = 0.5*chi2.sf(llr, 1) if llr > 0 else 0.5
+    return alpha, nstdevs(alpha)
+
+def poisson_log_likelihood(counts, expected):
+    """
+    The Poisson log likelihood (without the constant log n! terms) of counts given the expected counts of each bin, summed over the last axis.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sum(np.where(counts > 0, counts*np.log(expected), 0.0), axis=-1) - np.sum(expected, axis=-1)
+
+def profile_derivatives(counts, expected, signal):
+    """
+    The first and minus the second derivatives in mu of the log likelihood of counts given expected = background + mu*signal.
+    Bins without events only contribute through the sum of the expected counts.
+    """
+    ratio = np.divide(counts, expected, out=np.zeros_like(counts), where=counts > 0)
+    return ratio @ signal - np.sum(signal), np.divide(ratio, expected, out=np.zeros_like(counts), where=counts > 0) @ signal**2
+
+def profile_fit(counts, background, signal, n_iterations=100, tolerance=1e-8):
+    """
+    The maximum likelihood fit of the number of signal events mu of each toy of counts
+    (n_toys, n_bins), for expected counts background + mu*signal, with background the expected
+    background counts and signal the probability of a signal event in each bin (which may be
+    negative where the signal interferes destructively). mu is found for all the toys at once by
+    Newton's method on the derivative of the log likelihood, bisecting instead whenever a step
+    would leave the bracket of the root, which starts as the range of mu where every bin has a
+    positive expected count (and no more than the number of events of the toy). Returns the
+    profile LLR -2 log(L(0)/L(mu_hat)) of the test against no signal (0 where mu_hat < 0), mu_hat,
+    its uncertainty from the curvature of the log likelihood and the asymptotic p-value.
+    """
+    counts = np.atleast_2d(np.asarray(counts, dtype=np.float64))
+    background = np.asarray(background, dtype=np.float64)
+    signal = np.asarray(signal, dtype=np.float64)
+    rising, falling = signal > 0, signal < 0
+    lower = np.max(-background[rising]/signal[rising])
+    upper = np.min(-background[falling]/signal[falling]) if np.any(falling) else np.inf
+    n_events = np.sum(counts, axis=1)
+    low = np.full(len(counts), lower)
+    high = np.minimum(upper, np.maximum(n_events, 1.0)/np.sum(signal))
+    # Start from the number of events above the background
+    mu = n_events - np.sum(background)
+    mu = np.where((mu > low) & (mu < high), mu, (low + high)/2)
+    for i in range(n_iterations):
+        score, curvature = profile_derivatives(counts, background + mu[:,None]*signal, signal)
+        # The log likelihood is concave, so the root is above mu where the score is positive
+        low = np.where(score > 0, mu, low)
+        high = np.where(score > 0, high, mu)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = mu + score/curvature
+        new_mu = np.where((step > low) & (step < high), step, (low + high)/2)
+        converged = np.all(np.abs(new_mu - mu) <= tolerance*(1.0 + np.abs(mu)))
+        mu = new_mu
+        if converged:
+            break
+    expected = background + mu[:,None]*signal
+    mu_error = 1.0/np.sqrt(profile_derivatives(counts, expected, signal)[1])
+    llr = np.where(mu > 0, 2*(poisson_log_likelihood(counts, expected) - poisson_log_likelihood(counts, background)), 0.0)
+    llr = np.maximum(llr, 0.0)
+    return llr, mu, mu_error, 0.5*chi2.sf(llr, 1)
+
+def profile_test(probabilities_b, probabilities_s, mu_b, mu_s, n_toys, rng):
+    """
+    alpha and the number of standard deviations of the profile likelihood test of no signal,
+    with the number of signal events fitted, for mu_s expected events with bin probabilities_s
+    against mu_b with probabilities_b. alpha is the asymptotic p-value of the median profile LLR
+    of n_toys toys, or with n_toys 0 of the Asimov dataset of the expected counts. Also returns
+    the fitted numbers of signal events and their uncertainties.
+    """
+    background = mu_b*np.asarray(probabilities_b)
+    signal = (mu_s*np.asarray(probabilities_s) - background)/(mu_s - mu_b)
+    if n_toys > 0:
+        counts = toy_counts(probabilities_s, mu_s, n_toys, rng)
+    else:
+        counts = mu_s*np.asarray(probabilities_s)[None,:]
+    llr, mu_hat, mu_error, _ = profile_fit(counts, background, signal)
+    alpha = 0.5*chi2.sf(np.median(llr), 1)
+    return alpha, nstdevs(alpha), mu_hat, mu_error
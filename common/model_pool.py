@@ -0,0 +1,116 @@
+"""
+    A model that is built and compiled once and handed out freshly initialised
+    for every bootstrap iteration, instead of building, compiling and tracing a
+    new model each time. Between iterations every weight is redrawn from its
+    layer's initialiser and the optimiser is put back to its state before any
+    training, so each iteration still trains an independent model from scratch.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import time
+import numpy as np
+
+import keras
+
+def optimizer_variables(optimizer):
+    # A method in the keras 2.4 optimisers and a property in later ones
+    return optimizer.variables() if callable(optimizer.variables) else optimizer.variables
+
+def build_optimizer(optimizer, variables):
+    """
+    Create the optimiser's slot variables (its moments) now rather than at the first training step.
+    """
+    if hasattr(optimizer, 'build'):
+        optimizer.build(variables)
+    else:
+        optimizer._create_all_weights(variables)
+
+def fresh_initializer(initializer):
+    """
+    A copy of a random initialiser with a new seed drawn from numpy's global random
+    state, since in later keras versions an initialiser gives the same values on
+    every call.
+    """
+    config = initializer.get_config()
+    if 'seed' in config:
+        config['seed'] = np.random.randint(2**31)
+    return initializer.__class__.from_config(config)
+
+class ModelPool:
+    """
+    Holds one compiled model from create_model and reinitialises it in place on each get().
+    """
+    def __init__(self, create_model):
+        start = time.time()
+        self.model = create_model()
+        build_optimizer(self.model.optimizer, self.model.trainable_weights)
+        # The optimiser state before any training: zero moments and iterations and the initial hyperparameters
+        self.optimizer_state = [np.array(v) for v in optimizer_variables(self.model.optimizer)]
+        self.first_get = True
+        self.setup_time = time.time() - start
+
+    def reinitialise_weights(self):
+        for layer in self.model.layers:
+            for weight_name, initializer_name in [('kernel', 'kernel_initializer'), ('bias', 'bias_initializer')]:
+                weight = getattr(layer, weight_name, None)
+                initializer = getattr(layer, initializer_name, None)
+                if weight is not None and initializer is not None:
+                    weight.assign(fresh_initializer(initializer)(tuple(weight.shape), dtype=weight.dtype))
+
+    def reset_optimizer(self):
+        for variable, value in zip(optimizer_variables(self.model.optimizer), self.optimizer_state):
+            variable.assign(value)
+
+    def get(self):
+        """
+        The model with freshly drawn weights and a reset optimiser. setup_time is the
+        time taken to build it the first time and to reset it after that.
+        """
+        start = time.time()
+        if self.first_get:
+            # Freshly built, nothing to reset
+            self.first_get = False
+            return self.model
+        self.reinitialise_weights()
+        self.reset_optimizer()
+        self.setup_time = time.time() - start
+        return self.model
+
+class EpochTimer(keras.callbacks.Callback):
+    """
+    Records the duration of each epoch. The first epoch of a freshly built model also
+    includes tracing the training graph, so the excess of the first epoch over the
+    later ones estimates that overhead.
+    """
+    def on_train_begin(self, logs=None):
+        self.epoch_times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.time() - self.epoch_start)
+
+    def first_epoch_overhead(self):
+        if len(self.epoch_times) < 2:
+            return 0.0
+        return max(0.0, self.epoch_times[0] - np.median(self.epoch_times[1:]))
+
+class OverheadReport:
+    """
+    Accumulates the per-iteration overhead, the time spent building or resetting the
+    model plus the first epoch overhead, against the total time of each iteration.
+    """
+    def __init__(self):
+        self.overheads = []
+        self.totals = []
+
+    def add(self, setup_time, timer, total_time):
+        self.overheads.append(setup_time + timer.first_epoch_overhead())
+        self.totals.append(total_time)
+
+    def report(self, label):
+        if not self.totals:
+            return
+        overhead, total = np.mean(self.overheads), np.mean(self.totals)
+        print(label + ": overhead of %.2f s per iteration out of %.2f s (%.1f%%)" % (overhead, total, 100*overhead/total))
@@ -0,0 +1,65 @@
+"""
+    Morphing of the reference pdfs in cHW. The amplitude of the signal is linear
+    in cHW, so the expected number of events in each bin of a pdf, the cross
+    section times the probability of the bin, is a quadratic a + b cHW + c cHW^2
+    of the SM, interference and squared terms. The quadratic of each bin is found
+    from the pdfs and cross sections of three or more simulated couplings (by
+    least squares when there are more than three), and gives the pdf and cross
+    section at any cHW without new samples or predictions. The events beyond the
+    bins of the pdfs are kept as one more bin, so that the cross sections are not
+    mixed with the different fraction of each sample left out of its pdf.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+class CouplingMorphing:
+    """
+    The morphing of pdfs (n_couplings, n_bins), densities over the bin edges bins, of the
+    samples at the given couplings with the given cross sections. in_range is the fraction
+    of the events of each sample within the bins, by default all of them.
+    """
+    def __init__(self, couplings, pdfs, cross_sections, bins, in_range=None):
+        couplings = np.asarray(couplings, dtype=np.float64)
+        if len(np.unique(couplings)) < 3:
+            raise ValueError("Morphing needs the pdfs and cross sections of at least three different couplings")
+        self.bins = np.asarray(bins, dtype=np.float64)
+        pdfs = np.asarray(pdfs, dtype=np.float64)
+        in_range = np.ones(len(couplings)) if in_range is None else np.asarray(in_range, dtype=np.float64)
+        cross_sections = np.asarray(cross_sections, dtype=np.float64)
+        # The cross section in each bin, and beyond the last one
+        rates = np.column_stack((cross_sections[:,None]*in_range[:,None]*pdfs*np.diff(self.bins), cross_sections*(1.0 - in_range)))
+        # The SM, interference and squared coefficients of every bin, found at once
+        self.coefficients = np.linalg.lstsq(np.vander(couplings, 3, increasing=True), rates, rcond=None)[0]
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        The morphing of the pdfs saved by coupling_scan.py, from the samples whose cross sections are known.
+        """
+        saved = np.load(path)
+        known = np.isfinite(saved['cross_sections'])
+        return cls(saved['couplings'][known], saved['pdfs'][known], saved['cross_sections'][known], saved['edges'], saved['in_range'][known])
+
+    def rates(self, couplings):
+        """
+        The cross section in each bin (len(couplings), n_bins) at each coupling, with bins where the quadratic goes below zero set to zero.
+        """
+        return self.all_rates(couplings)[:,:-1]
+
+    def all_rates(self, couplings):
+        # The rates of the bins followed by the rate beyond them
+        return np.maximum(np.vander(np.atleast_1d(couplings).astype(np.float64), 3, increasing=True) @ self.coefficients, 0.0)
+
+    def cross_section(self, couplings):
+        """
+        The total cross section at each coupling, including the events beyond the bins.
+        """
+        return np.sum(self.all_rates(couplings), axis=1)
+
+    def pdf(self, couplings):
+        """
+        The pdf (len(couplings), n_bins) at each coupling.
+        """
+        rates = self.rates(couplings)
+        return rates/(np.sum(rates, axis=1, keepdims=True)*np.diff(self.bins))
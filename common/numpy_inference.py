@@ -0,0 +1,189 @@
+"""
+    Inference with trained models in NumPy alone. export_model() turns a
+    trained Keras model (the CNN, the DNN or a VAE) into a compact bundle of
+    its layers and weights in one .npz file, and NumpyModel runs the same
+    forward pass with NumPy and SciPy, so scoring jobs and the LLR tooling can
+    use the models without importing TensorFlow. Only export_model() needs
+    Keras. Sequential models of Conv2D, MaxPooling2D, Flatten, Dense,
+    Dropout, Activation and Reshape layers are supported, as are VAEs whose
+    sampling Lambda takes the last two Dense layers before it as z_mean and
+    z_log_var.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import json
+import numpy as np
+from scipy.special import expit, softmax
+
+ACTIVATIONS = {'linear': lambda x: x,
+               'relu': lambda x: np.maximum(x, 0),
+               'sigmoid': expit,
+               'tanh': np.tanh,
+               'softmax': lambda x: softmax(x, axis=-1)}
+
+def layer_spec(layer):
+    """
+    The type, settings and weights of a Keras layer, or None for layers that do nothing at inference.
+    """
+    kind = layer.__class__.__name__
+    config = layer.get_config()
+    if kind in ('InputLayer', 'Dropout'):
+        return None
+    spec = {'type': kind}
+    if kind in ('Dense', 'Conv2D', 'Activation'):
+        spec['activation'] = config['activation']
+    if kind == 'Conv2D':
+        spec.update(strides=list(config['strides']), padding=config['padding'])
+        if tuple(config.get('dilation_rate', (1, 1))) != (1, 1) or config.get('data_format', 'channels_last') != 'channels_last':
+            raise ValueError("Only undilated channels_last Conv2D layers can be exported")
+    elif kind == 'MaxPooling2D':
+        spec.update(pool_size=list(config['pool_size']), strides=list(config['strides'] or config['pool_size']), padding=config['padding'])
+    elif kind == 'Reshape':
+        spec['target_shape'] = list(config['target_shape'])
+    elif kind not in ('Dense', 'Flatten', 'Activation'):
+        raise ValueError("Cannot export layers of type " + kind)
+    return spec, [np.asarray(w, dtype=np.float32) for w in layer.get_weights()]
+
+def vae_sections(vae):
+    """
+    The indices in vae.layers of the encoder, z_mean, z_log_var and decoder layers of a VAE.
+    The decoder is the run of Dense and Reshape layers after the sampling Lambda, which
+    leaves out the layers of the loss Keras puts after it.
+    """
+    kinds = [layer.__class__.__name__ for layer in vae.layers]
+    sampling = kinds.index('Lambda')
+    encoder = [i for i in range(sampling) if kinds[i] == 'Dense']
+    end = sampling + 1
+    while end < len(kinds) and kinds[end] in ('Dense', 'Reshape'):
+        end += 1
+    return {'encoder': encoder[:-2], 'z_mean': encoder[-2:-1], 'z_log_var': encoder[-1:],
+            'decoder': list(range(sampling + 1, end))}
+
+def export_model(model, path, epsilon_std=0.01):
+    """
+    Save the layers and weights of a trained Keras model to the .npz bundle at path.
+    A model with a Lambda layer is taken to be a VAE, with epsilon_std the standard
+    deviation of the noise of its sampling, which is not stored in the model.
+    """
+    weights = []
+    if 'Lambda' in [layer.__class__.__name__ for layer in model.layers]:
+        sections = vae_sections(model)
+        bundle = {'kind': 'vae', 'epsilon_std': epsilon_std}
+    else:
+        sections = {'layers': list(range(len(model.layers)))}
+        bundle = {'kind': 'sequential'}
+    for section, indices in sections.items():
+        bundle[section] = []
+        for i in indices:
+            exported = layer_spec(model.layers[i])
+            if exported is None:
+                continue
+            spec, layer_weights = exported
+            spec['weights'] = list(range(len(weights), len(weights) + len(layer_weights)))
+            weights += layer_weights
+            bundle[section].append(spec)
+    np.savez(path, spec=json.dumps(bundle), **{'w' + str(i): w for i, w in enumerate(weights)})
+
+def same_padding(size, kernel, stride):
+    total = max((int(np.ceil(size/stride)) - 1)*stride + kernel - size, 0)
+    return total//2, total - total//2
+
+def pad(x, window, strides, padding, pad_value=0.0):
+    """
+    The images x of shape (n, height, width, channels) padded as Keras pads them for windows of the given size.
+    """
+    if padding != 'same':
+        return x
+    pads = [same_padding(x.shape[1], window[0], strides[0]), same_padding(x.shape[2], window[1], strides[1])]
+    return np.pad(x, [(0, 0)] + pads + [(0, 0)], constant_values=pad_value)
+
+def output_size(size, window, strides):
+    return tuple((size[k] - window[k])//strides[k] + 1 for k in range(2))
+
+def windows(x, window, strides, padding, pad_value=0.0):
+    """
+    The (n, out_height, out_width, channels, window_height, window_width) view of the
+    sliding windows over the images x of shape (n, height, width, channels).
+    """
+    x = pad(x, window, strides, padding, pad_value)
+    (rows, cols), (n, _, _, channels) = output_size(x.shape[1:3], window, strides), x.shape
+    # Strided over the padded images as the Conv2D patches are sliced, without copying them
+    return np.lib.stride_tricks.as_strided(x, shape=(n, rows, cols, channels, window[0], window[1]),
+                                           strides=(x.strides[0], x.strides[1]*strides[0], x.strides[2]*strides[1], x.strides[3], x.strides[1], x.strides[2]),
+                                           writeable=False)
+
+def apply_layer(spec, weights, x):
+    kind = spec['type']
+    if kind == 'Dense':
+        kernel, bias = weights
+        return ACTIVATIONS[spec['activation']](x @ kernel + bias)
+    if kind == 'Conv2D':
+        kernel, bias = weights
+        x = pad(x, kernel.shape[:2], spec['strides'], spec['padding'])
+        (rows, cols), (row_stride, col_stride) = output_size(x.shape[1:3], kernel.shape[:2], spec['strides']), spec['strides']
+        # Lay the windows out as rows, in the (height, width, channel) order of the kernel, for a single matrix product
+        patches = np.concatenate([x[:, i:i+row_stride*(rows-1)+1:row_stride, j:j+col_stride*(cols-1)+1:col_stride]
+                                  for i in range(kernel.shape[0]) for j in range(kernel.shape[1])], axis=-1)
+        out = np.reshape(patches, (-1, patches.shape[-1])) @ np.reshape(kernel, (-1, kernel.shape[-1])) + bias
+        return ACTIVATIONS[spec['activation']](np.reshape(out, (len(x), rows, cols, -1)))
+    if kind == 'MaxPooling2D':
+        return np.max(windows(x, spec['pool_size'], spec['strides'], spec['padding'], pad_value=-np.inf), axis=(4, 5))
+    if kind == 'Flatten':
+        return np.reshape(x, (len(x), -1))
+    if kind == 'Activation':
+        return ACTIVATIONS[spec['activation']](x)
+    if kind == 'Reshape':
+        return np.reshape(x, (len(x),) + tuple(spec['target_shape']))
+    raise ValueError("Unknown layer type " + kind)
+
+class NumpyModel:
+    """
+    The forward pass of a model exported with export_model(), in NumPy.
+    """
+    def __init__(self, path):
+        bundle = np.load(path)
+        self.spec = json.loads(str(bundle['spec']))
+        self.weights = [bundle['w' + str(i)] for i in range(len(bundle.files) - 1)]
+        self.kind = self.spec['kind']
+
+    def run(self, section, x):
+        for spec in self.spec[section]:
+            x = apply_layer(spec, [self.weights[i] for i in spec['weights']], x)
+        return x
+
+    def predict(self, x, batch_size=10000, verbose=0, rng=None, n_draws=0):
+        """
+        The outputs for x, batch_size events at a time. A VAE reconstructs from
+        z_mean, or from a sampled latent point as Keras does if rng (a numpy
+        Generator) is given, or from n_draws sampled latent points per event,
+        along a second axis, if n_draws > 0 as well. verbose is ignored, so that
+        this can stand in for the predict of the Keras model.
+        """
+        return np.concatenate([self.predict_batch(np.asarray(x[start:start+batch_size], dtype=np.float32), rng, n_draws)
+                               for start in range(0, len(x), batch_size)])
+
+    def predict_batch(self, x, rng=None, n_draws=0):
+        if self.kind == 'sequential':
+            return self.run('layers', x)
+        h = self.run('encoder', x)
+        z = self.run('z_mean', h)
+        if rng is None:
+            return self.run('decoder', z)
+        z_log_var = self.run('z_log_var', h)
+        if n_draws > 0:
+            # The draws are decoded as one batch of len(x)*n_draws latent points
+            z, z_log_var = np.repeat(z, n_draws, axis=0), np.repeat(z_log_var, n_draws, axis=0)
+        z = z + np.exp(z_log_var/2)*rng.normal(0.0, self.spec['epsilon_std'], size=z.shape).astype(np.float32)
+        decoded = self.run('decoder', z)
+        return np.reshape(decoded, (len(x), n_draws) + decoded.shape[1:]) if n_draws > 0 else decoded
+
+    def reconstruction_errors(self, x, batch_size=10000, rng=None, n_draws=0):
+        """
+        The mean squared error of the VAE reconstruction of each event, averaged over the draws if n_draws > 0.
+        """
+        errors = []
+        for start in range(0, len(x), batch_size):
+            batch = np.asarray(x[start:start+batch_size], dtype=np.float32)
+            decoded = np.reshape(self.predict_batch(batch, rng, n_draws), (len(batch), max(n_draws, 1)) + batch.shape[1:])
+            errors.append(np.mean(np.square(batch[:,None] - decoded), axis=tuple(range(1, decoded.ndim))))
+        return np.concatenate(errors)
@@ -0,0 +1,58 @@
+"""
+    Spread of the bootstrap PDFs over the iterations of a run, saved so that runs
+    trained differently, such as warm-started replicas against cold-started
+    ones, can be compared on the same bins. The comparison is the same for the
+    CNN, DNN and VAE.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import os
+import numpy as np
+
+def iteration_pdfs(values_list, bins):
+    """
+    The PDF of the values of each iteration, of shape (n_iterations, len(bins) - 1).
+    """
+    return np.stack([np.histogram(values, bins=bins, density=True)[0] for values in values_list])
+
+def pdf_bands(pdfs, percentiles=(2.5, 16, 50, 84, 97.5)):
+    """
+    The per-bin 'mean', 'std' and 'percentiles' over the iterations of the PDFs of
+    shape (n_iterations, n_classes, n_bins), as bootstrap_pdf_bands of the CNN gives them.
+    """
+    return {'mean': np.mean(pdfs, axis=0), 'std': np.std(pdfs, axis=0),
+            'percentiles': np.percentile(pdfs, percentiles, axis=0), 'percentile_levels': np.array(percentiles)}
+
+def compare_pdf_spread(bands, reference_bands, bins, class_names):
+    """
+    Compare the bootstrap PDFs of two runs binned the same way, given as the bands of
+    pdf_bands(). For each class prints the ratio of the summed per-bin standard
+    deviations and of the summed widths of the outermost percentile band to those of
+    the reference run, and the total variation distance between the two mean PDFs.
+    Returns the standard deviation ratio of each class.
+    """
+    std_ratios = []
+    for c, name in enumerate(class_names):
+        std_ratio = np.sum(bands['std'][c])/np.sum(reference_bands['std'][c])
+        band_ratio = np.sum(bands['percentiles'][-1,c] - bands['percentiles'][0,c])/np.sum(reference_bands['percentiles'][-1,c] - reference_bands['percentiles'][0,c])
+        distance = 0.5*np.sum(np.abs(bands['mean'][c] - reference_bands['mean'][c])*np.diff(bins))
+        print(name + ": spread ratio (std) = %.3f, spread ratio (percentile band) = %.3f, distance between mean PDFs = %.4f" % (std_ratio, band_ratio, distance))
+        std_ratios.append(std_ratio)
+    return std_ratios
+
+def save_and_compare(path, reference_path, bins, pdfs_dict):
+    """
+    Save the per-iteration PDFs of each class in pdfs_dict to path, and compare them
+    with those saved at reference_path if that run has been done.
+    """
+    np.savez(path, bins=bins, **pdfs_dict)
+    if reference_path is None:
+        return
+    if not os.path.exists(reference_path):
+        print("No run to compare the PDF spread with at " + reference_path)
+        return
+    reference = np.load(reference_path)
+    names = list(pdfs_dict)
+    print("Spread of the bootstrap PDFs compared to " + reference_path + ":")
+    compare_pdf_spread(pdf_bands(np.stack([pdfs_dict[name] for name in names], axis=1)),
+                       pdf_bands(np.stack([reference[name] for name in names], axis=1)), bins, names)
@@ -0,0 +1,151 @@
+"""
+    Prepared datasets published once into shared memory and attached zero-copy
+    by every process that trains on them, so that many jobs on one node
+    (bootstrap workers, sigma sweeps or shards of a run) hold a single copy of
+    the data between them. A dataset is a directory of .npy files in /dev/shm
+    that every process memory maps read-only. The processes attached to it are
+    recorded by pid, and the last one to detach deletes it. The pids of
+    processes that died without detaching are dropped whenever the record is
+    updated, so a crashed job does not keep the data in memory for good.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import os
+import sys
+import glob
+import fcntl
+import atexit
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import numpy as np
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+PREFIX = 'shared_dataset_'
+
+def source_key(paths):
+    """
+    A short key for the current version of the given source files, from their paths, sizes and modification times.
+    """
+    hasher = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        hasher.update((os.path.abspath(path) + ' ' + str(stat.st_size) + ' ' + str(stat.st_mtime_ns)).encode())
+    return hasher.hexdigest()[:16]
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        return True
+    return True
+
+class SharedDataset:
+    """
+    A dataset in shm_dir under the given name. attach() publishes it if no process
+    has yet and returns read-only memory maps of its arrays, detach() (also run
+    at exit) drops this process's reference.
+    """
+    def __init__(self, name, shm_dir=SHM_DIR):
+        self.directory = os.path.join(shm_dir, PREFIX + name)
+        # The lock file is never deleted, as processes waiting on it would be left locking a deleted file
+        self.lock_path = self.directory + '.lock'
+        self.refs_path = os.path.join(self.directory, 'refs')
+        self.complete_path = os.path.join(self.directory, 'complete')
+        self.attached = False
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def live_pids(self):
+        if not os.path.exists(self.refs_path):
+            return []
+        with open(self.refs_path) as refs_file:
+            return [int(pid) for pid in refs_file.read().split() if pid_alive(int(pid))]
+
+    def write_pids(self, pids):
+        with open(self.refs_path, 'w') as refs_file:
+            refs_file.write(' '.join(str(pid) for pid in pids))
+
+    def attach(self, build):
+        """
+        Attach to the dataset, first publishing the dictionary of arrays returned by
+        build() if it is not published yet, and return a dictionary of read-only
+        memory maps of its arrays. Other processes attaching while it is built wait
+        for it rather than building it too.
+        """
+        with self.lock():
+            if not os.path.exists(self.complete_path):
+                # Not published, or left half written by a process that crashed
+                shutil.rmtree(self.directory, ignore_errors=True)
+                os.makedirs(self.directory)
+                arrays = build()
+                try:
+                    for key, array in arrays.items():
+                        np.save(os.path.join(self.directory, key + '.npy'), np.ascontiguousarray(array))
+                except OSError as error:
+                    # Such as shm_dir being too small for the dataset
+                    shutil.rmtree(self.directory, ignore_errors=True)
+                    print("Could not publish dataset to shared memory (" + str(error) + "), using a private copy")
+                    return arrays
+                open(self.complete_path, 'w').close()
+                print("Published dataset to shared memory in " + self.directory)
+            else:
+                print("Attaching to shared dataset in " + self.directory)
+            self.write_pids(self.live_pids() + [os.getpid()])
+        if not self.attached:
+            atexit.register(self.detach)
+        self.attached = True
+        return {os.path.basename(path)[:-4]: np.load(path, mmap_mode='r')
+                for path in glob.glob(os.path.join(self.directory, '*.npy'))}
+
+    def detach(self):
+        """
+        Drop this process's reference, deleting the dataset if it was the last one.
+        Memory maps of it that are still open stay valid until they are closed.
+        """
+        if not self.attached:
+            return
+        self.attached = False
+        with self.lock():
+            pids = self.live_pids()
+            if os.getpid() in pids:
+                pids.remove(os.getpid())
+            if pids:
+                self.write_pids(pids)
+            else:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                print("Removed shared dataset " + self.directory)
+
+def load_shared(name, build, enabled=True):
+    """
+    The arrays from build(), shared with every other process loading the same name
+    if enabled and private to this process otherwise.
+    """
+    if not enabled:
+        return build()
+    return SharedDataset(name).attach(build)
+
+if __name__ == "__main__":
+    # List the shared datasets with the processes attached to them, or with --clean remove those no live process is attached to
+    for directory in sorted(glob.glob(os.path.join(SHM_DIR, PREFIX + '*'))):
+        if not os.path.isdir(directory):
+            continue
+        dataset = SharedDataset(os.path.basename(directory)[len(PREFIX):])
+        with dataset.lock():
+            pids = dataset.live_pids()
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, '*.npy')))
+            print(directory, "%.1f MB" % (size/1e6), "attached:", pids if pids else "none")
+            if not pids and '--clean' in sys.argv:
+                shutil.rmtree(directory, ignore_errors=True)
+                print("Removed", directory)
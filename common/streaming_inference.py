@@ -0,0 +1,110 @@
+"""
+    Streaming inference over datasets of any size. Events are read (and
+    preprocessed) a chunk at a time and run through the model with a large
+    batch size, tuned on the first chunk unless one is given. The output of
+    every event is written straight into a memory mapped .npy file, and the
+    histograms of the reference pdfs are updated chunk by chunk, so the pdfs
+    are ready as soon as the last chunk is done and neither the events nor
+    the outputs are ever held in memory in full.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import time
+import numpy as np
+
+class IncrementalHistogram:
+    """
+    Counts of values in the bins given by edges, separately for each of n_classes
+    classes, updated a chunk of values at a time. With log the bins are in
+    log10 of the values. Values outside the edges are counted as underflow and
+    overflow and, as in np.histogram, left out of the pdfs.
+    """
+    def __init__(self, edges, n_classes=1, log=False):
+        self.edges = np.asarray(edges, dtype=float)
+        self.n_classes = n_classes
+        self.log = log
+        self.n_bins = len(self.edges) - 1
+        self.counts = np.zeros((n_classes, self.n_bins), dtype=np.int64)
+        self.underflow = np.zeros(n_classes, dtype=np.int64)
+        self.overflow = np.zeros(n_classes, dtype=np.int64)
+
+    def update(self, values, labels=0):
+        values = np.asarray(values, dtype=float)
+        labels = np.broadcast_to(np.asarray(labels, dtype=np.int64), values.shape)
+        if self.log:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.log10(values)
+            # Non-positive values have no log and fall below any bin
+            values[np.isnan(values)] = -np.inf
+        bin_indices = np.searchsorted(self.edges, values, side='right') - 1
+        # As in np.histogram the last bin includes its right edge
+        bin_indices[values == self.edges[-1]] = self.n_bins - 1
+        self.underflow += np.bincount(labels[bin_indices < 0], minlength=self.n_classes)
+        self.overflow += np.bincount(labels[bin_indices >= self.n_bins], minlength=self.n_classes)
+        in_range = (bin_indices >= 0) & (bin_indices < self.n_bins)
+        flat_indices = labels[in_range]*self.n_bins + bin_indices[in_range]
+        self.counts += np.bincount(flat_indices, minlength=self.n_classes*self.n_bins).reshape(self.n_classes, self.n_bins)
+
+    def pdfs(self):
+        """
+        The pdf of each class, the same as np.histogram(..., density=True) would give.
+        """
+        totals = np.sum(self.counts, axis=1, keepdims=True).astype(float)
+        totals[totals == 0] = 1.0
+        return self.counts/totals/np.diff(self.edges)
+
+    def save(self, path, class_names):
+        np.savez(path, edges=self.edges, centers=(self.edges[:-1] + self.edges[1:])/2, log=self.log,
+                 counts=self.counts, pdfs=self.pdfs(), underflow=self.underflow, overflow=self.overflow,
+                 class_names=np.array(class_names))
+
+def tune_batch_size(predict, sample, candidates=(1024, 4096, 16384, 65536)):
+    """
+    The candidate batch size that runs predict(x, batch_size) over sample the
+    fastest, timed after a first call with each to leave out any tracing.
+    """
+    best_batch_size, best_rate = candidates[0], 0.0
+    for batch_size in candidates:
+        if batch_size > len(sample) and batch_size != candidates[0]:
+            break
+        predict(sample[:batch_size], batch_size)
+        start = time.time()
+        predict(sample, batch_size)
+        rate = len(sample)/max(time.time() - start, 1e-9)
+        print("Batch size", batch_size, ": %.0f events/s" % rate)
+        if rate > best_rate:
+            best_batch_size, best_rate = batch_size, rate
+    print("Using batch size", best_batch_size)
+    return best_batch_size
+
+def stream_predict(predict, events, output_path, chunk_size=100000, batch_size=0, transform=None, histogram=None, labels=0):
+    """
+    Run predict(x, batch_size), which returns one output per event, over events
+    (an array or memory map) chunk_size events at a time, after applying
+    transform to each chunk if given. The outputs are written to a float32 .npy
+    memory map at output_path and added to histogram under labels, either one
+    class for every event or an array of the class (or the one-hot class) of
+    each event. With batch_size 0 it is tuned on the first chunk. Returns the
+    memory map of the outputs and the batch size used.
+    """
+    n_events = len(events)
+    outputs = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(n_events,))
+    start_time = time.time()
+    for start in range(0, n_events, chunk_size):
+        x = events[start:start+chunk_size]
+        x = transform(x) if transform is not None else np.asarray(x)
+        if batch_size == 0:
+            batch_size = tune_batch_size(predict, x[:min(len(x), 4*65536)])
+        chunk_outputs = np.ravel(predict(x, batch_size))
+        outputs[start:start+len(x)] = chunk_outputs
+        if histogram is not None:
+            chunk_labels = labels
+            if np.ndim(labels) > 0:
+                chunk_labels = np.asarray(labels[start:start+len(x)])
+                if chunk_labels.ndim == 2:
+                    chunk_labels = np.argmax(chunk_labels, axis=1)
+            histogram.update(chunk_outputs, chunk_labels)
+        print("Predicted", start + len(x), "/", n_events, "events")
+    outputs.flush()
+    print("%d events in %.1f s (%.0f events/s)" % (n_events, time.time() - start_time, n_events/max(time.time() - start_time, 1e-9)))
+    return outputs, batch_size
@@ -0,0 +1,74 @@
+"""
+    MinMax normalisation of event features fitted and applied in chunks, so
+    that it works on samples far larger than memory. The per-feature min and
+    max are found in one chunked pass over any number of .dat files (through
+    the event cache), saved next to the model, and loaded by the prediction
+    scripts so that events are normalised exactly as they were in training.
+    The transform is the same as that of sklearn's MinMaxScaler.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+from event_cache import load_events
+
+class StreamingMinMaxScaler:
+    """
+    Scales each feature to [0, 1] using the data_min_ and data_max_ it is fitted to,
+    named as in MinMaxScaler so it can be used in its place.
+    """
+    def __init__(self, data_min=None, data_max=None):
+        self.data_min_ = None if data_min is None else np.asarray(data_min, dtype=np.float64)
+        self.data_max_ = None if data_max is None else np.asarray(data_max, dtype=np.float64)
+
+    def partial_fit(self, x):
+        x_min, x_max = np.min(x, axis=0), np.max(x, axis=0)
+        if self.data_min_ is None:
+            self.data_min_, self.data_max_ = x_min.astype(np.float64), x_max.astype(np.float64)
+        else:
+            self.data_min_ = np.minimum(self.data_min_, x_min)
+            self.data_max_ = np.maximum(self.data_max_, x_max)
+        return self
+
+    def fit_files(self, paths, chunk_size=1000000):
+        """
+        Fit to the features of every event in the given .dat files, that is every
+        column but the last (signal) one, reading chunk_size events at a time.
+        """
+        for path in paths:
+            events = load_events(path)[:,:-1]
+            for start in range(0, len(events), chunk_size):
+                self.partial_fit(events[start:start+chunk_size])
+        return self
+
+    def transform(self, x):
+        data_range = self.data_max_ - self.data_min_
+        # Constant features are left unscaled, as in MinMaxScaler
+        data_range[data_range == 0] = 1.0
+        scale = 1.0/data_range
+        return (x*scale - self.data_min_*scale).astype(np.float32)
+
+    def transform_chunks(self, events, chunk_size=1000000):
+        """
+        Yield the normalised events chunk_size at a time.
+        """
+        for start in range(0, len(events), chunk_size):
+            yield self.transform(events[start:start+chunk_size])
+
+    def save(self, path):
+        np.save(path, np.stack((self.data_min_, self.data_max_)))
+
+    @classmethod
+    def load(cls, path):
+        data_min, data_max = np.load(path)
+        return cls(data_min, data_max)
+
+def load_or_fit_scaler(path, paths):
+    """
+    The scaler saved at path, or if there is none, one fitted to the given .dat files.
+    """
+    try:
+        return StreamingMinMaxScaler.load(path)
+    except FileNotFoundError:
+        print("No scaler saved in " + path + ", fitting one to " + ", ".join(paths))
+        return StreamingMinMaxScaler().fit_files(paths)
@@ -0,0 +1,71 @@
+"""
+    Compact storage of the weights of every bootstrap model of a run, so that
+    the models can be rerun over any dataset without retraining. The weights of
+    each model are flattened to one float32 vector, in the order of
+    model.get_weights(), and written as a row of one preallocated memory mapped
+    .npy file as soon as the model is trained. The MinMaxScaler the inputs were
+    normalised with is stored alongside, as its per-feature min and max.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+from event_cache import load_events
+from streaming_scaler import StreamingMinMaxScaler
+
+def flatten_weights(weights):
+    return np.concatenate([np.ravel(w) for w in weights]).astype(np.float32)
+
+def unflatten_weights(flat_weights, shapes):
+    """
+    Split a flat weight vector back into arrays of the given shapes, for model.set_weights().
+    """
+    weights = []
+    start = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        weights.append(np.reshape(flat_weights[start:start+size], shape))
+        start += size
+    return weights
+
+class WeightStore:
+    """
+    The weights of the models of one run, in array_dir as 'weights_arr' + extension
+    + '.npy' of shape (n_models, n_params), with 'done_arr' flagging the rows that
+    are written and 'scaler_arr' holding the min and max of each input feature.
+    """
+    def __init__(self, array_dir, extension, n_models, n_params, scaler):
+        self.weights_arr = np.lib.format.open_memmap(array_dir + 'weights_arr' + extension + '.npy', mode='w+', dtype=np.float32, shape=(n_models, n_params))
+        self.done_arr = np.lib.format.open_memmap(array_dir + 'done_arr' + extension + '.npy', mode='w+', dtype=np.uint8, shape=(n_models,))
+        np.save(array_dir + 'scaler_arr' + extension, np.stack((scaler.data_min_, scaler.data_max_)))
+
+    def write(self, i, weights):
+        self.weights_arr[i] = flatten_weights(weights)
+        self.weights_arr.flush()
+        self.done_arr[i] = 1
+        self.done_arr.flush()
+
+def load_weight_store(array_dir, extension):
+    """
+    Return the memory mapped weights of the models that were written, and the
+    per-feature min and max of the scaler.
+    """
+    done = np.load(array_dir + 'done_arr' + extension + '.npy').astype(bool)
+    weights_arr = np.load(array_dir + 'weights_arr' + extension + '.npy', mmap_mode='r')
+    data_min, data_max = np.load(array_dir + 'scaler_arr' + extension + '.npy')
+    return weights_arr[done], data_min, data_max
+
+def read_events(path):
+    """
+    Read the features of a dataset, either a .dat file as in Data/ (whose last column
+    is dropped, as in training) or a .npy array of unnormalised features.
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return load_events(path)[:,:-1]
+
+def scale_events(x, data_min, data_max):
+    """
+    The same as MinMaxScaler.transform for a scaler fitted to data with the given min and max.
+    """
+    return StreamingMinMaxScaler(data_min, data_max).transform(x)
@@ -0,0 +1,145 @@
+#Purpose: Evaluate a trained DNN on the SM and every cHW coupling sample in one pass, and run the LLR test of each coupling against the SM
+import os
+import sys
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+from numpy_inference import NumpyModel
+from couplings import SM_NAME, coupling_value, coupling_file, cross_sections
+from llr_engine import multi_hypothesis_test
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--model",
+                    type=str,
+                    default="model_dnn/dnn_100k_11epochs001.h5",
+                    help="str: The trained DNN, or its NumPy export (.npz) from export_numpy.py to predict without TensorFlow. Default is 'model_dnn/dnn_100k_11epochs001.h5'.")
+
+parser.add_argument("--scaler",
+                    type=str,
+                    default="model_dnn/scaler001.npy",
+                    help="str: The scaler saved with the model, which every sample is normalised with. If it does not exist one is fitted to the SM and cHW = 0.005 events as in training. Default is 'model_dnn/scaler001.npy'.")
+
+parser.add_argument("--couplings",
+                    type=str,
+                    nargs='+',
+                    default=['zp005', 'zpz1', 'zpz3', 'zp1'],
+                    help="str: The names of the cHW samples in Data/ (vh_chw_<name>.dat) to test against the SM. Default is 'zp005 zpz1 zpz3 zp1'.")
+
+parser.add_argument("--cross_sections",
+                    type=float,
+                    nargs='+',
+                    default=None,
+                    help="float: The cross section in pb of each coupling sample, in the order of --couplings, with 0 for those whose cross section is known (see couplings.py). Samples without a known cross section only have their pdf made. Default is None, which uses the known ones.")
+
+parser.add_argument("--n_bins",
+                    type=int,
+                    default=50,
+                    help="int: The number of bins of the pdfs of P(EFT), between 0 and 1. Default is 50.")
+
+parser.add_argument("--luminosities",
+                    type=float,
+                    nargs=3,
+                    default=[0.1, 8.0, 30],
+                    help="float: The first and last luminosity (in fb^-1) and number of luminosities the LLR test is run at. Default is 0.1 8.0 30.")
+
+parser.add_argument("--ntoys",
+                    type=int,
+                    default=10000,
+                    help="int: The number of toy experiments of each hypothesis at each luminosity. Default is 10000.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=10000,
+                    help="int: The batch size of the predictions. Default is 10000.")
+
+parser.add_argument("--seed",
+                    type=int,
+                    default=None,
+                    help="int: The seed of the toys. Default is None, which seeds them randomly.")
+
+parser.add_argument("--output_dir",
+                    type=str,
+                    default="arrays/",
+                    help="str: The directory the pdfs and LLR results are saved to. Default is 'arrays/'.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+os.makedirs(args.output_dir, exist_ok=True)
+tag = os.path.splitext(os.path.basename(args.model))[0]
+detector_efficiency = 1
+
+names = [SM_NAME] + args.couplings
+sample_cross_sections = cross_sections(names, [0] + args.cross_sections if args.cross_sections else None)
+
+# Every sample is normalised with the one scaler the model was trained with
+scaler = load_or_fit_scaler(args.scaler, [coupling_file(SM_NAME), coupling_file('zp005')])
+# Drop signal column
+events = {name: load_events(coupling_file(name))[:,:-1] for name in set(names) | {'zp005'}}
+# The DNN was trained on 70% of the first 100k SM and cHW = 0.005 events, split as in eft_dnn_predictions.py, so only the
+# held-out 30% of these two samples is used for their pdfs. The other samples were never seen in training and are used whole
+n_sm, n_eft = min(len(events[SM_NAME]), 100000), min(len(events['zp005']), 100000)
+_, test_indices = train_test_split(np.arange(n_sm + n_eft), test_size=0.3, random_state=42)
+events[SM_NAME] = events[SM_NAME][test_indices[test_indices < n_sm]]
+events['zp005'] = events['zp005'][test_indices[test_indices >= n_sm] - n_sm]
+events = [events[name] for name in names]
+offsets = np.cumsum([0] + [len(x) for x in events])
+x_data = scaler.transform(np.concatenate(events))
+del events
+
+if args.model.endswith('.npz'):
+    model_dnn = NumpyModel(args.model)
+else:
+    import keras
+    model_dnn = keras.models.load_model(args.model)
+print("Predicting on", len(x_data), "events of", len(names), "samples in one pass")
+eft_probs = model_dnn.predict(x_data, batch_size=args.batch_size, verbose=0)[:,1]
+
+# ============================ Reference pdfs ==================================
+
+bins = np.linspace(0, 1, args.n_bins + 1)
+counts = np.stack([np.histogram(eft_probs[offsets[i]:offsets[i+1]], bins=bins)[0] for i in range(len(names))])
+pdfs = counts/(np.sum(counts, axis=1, keepdims=True)*np.diff(bins))
+# The fraction of each sample within the bins, which the morphing needs (all of it, as the probabilities are in [0, 1])
+in_range = np.sum(counts, axis=1)/np.diff(offsets)
+pdf_file = args.output_dir + 'coupling_pdfs_' + tag + '.npz'
+np.savez(pdf_file, names=names, couplings=[coupling_value(name) for name in names],
+         cross_sections=[np.nan if xs is None else xs for xs in sample_cross_sections], edges=bins, counts=counts, pdfs=pdfs, in_range=in_range)
+print("Saved the pdfs of", ", ".join(names), "to", pdf_file)
+
+# ========================== LLR test of each coupling =========================
+
+tested = [i for i in range(1, len(names)) if sample_cross_sections[i] is not None]
+for i in range(1, len(names)):
+    if i not in tested:
+        print("No cross section for cHW =", coupling_value(names[i]), "given with --cross_sections, so only its pdf is made")
+
+rng = np.random.default_rng(args.seed)
+luminosity_arr = np.linspace(args.luminosities[0], args.luminosities[1], int(args.luminosities[2]))
+alpha_arr = np.zeros((len(luminosity_arr), len(tested)))
+nstdevs_arr = np.zeros((len(luminosity_arr), len(tested)))
+tested_cross_sections = np.array([sample_cross_sections[i] for i in tested])
+for j, luminosity in enumerate(luminosity_arr):
+    # The SM toys are drawn once per luminosity and tested against every coupling in one matrix product
+    mu_sm = luminosity*detector_efficiency*sample_cross_sections[0]*1000
+    mu_mixed = luminosity*detector_efficiency*tested_cross_sections*1000
+    alpha_arr[j], nstdevs_arr[j], _, _ = multi_hypothesis_test(pdfs[0], pdfs[tested], mu_sm, mu_mixed, bins, args.ntoys, rng)
+
+llr_file = args.output_dir + 'coupling_llr_' + tag + '.npz'
+np.savez(llr_file, names=[names[i] for i in tested], couplings=[coupling_value(names[i]) for i in tested],
+         luminosity=luminosity_arr, alpha=alpha_arr, nstdevs=nstdevs_arr)
+
+print("\nZ of each coupling against the SM")
+print("lumi [fb^-1] " + " ".join("{:>10}".format('cHW=' + str(coupling_value(names[i]))) for i in tested))
+for j, luminosity in enumerate(luminosity_arr):
+    print("{:12.3f} ".format(luminosity) + " ".join("{:10.3f}".format(z) for z in nstdevs_arr[j]))
+print("Saved the LLR results to", llr_file)
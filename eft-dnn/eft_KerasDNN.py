@@ -15,28 +15,25 @@ from keras.layers import Dense, Flatten, Dropout, Activation, Conv2D, MaxPooling
 from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import StreamingMinMaxScaler
+
 data_dir = 'Data/'
 
-vh_chwzero_df = pd.read_csv(data_dir + 'vh_chw_zero_100k.dat', sep="\s+", header=None)
-vh_chwzp005_df = pd.read_csv(data_dir + 'vh_chw_zp005.dat', sep="\s+", header=None)
+vh_chwzero = load_events(data_dir + 'vh_chw_zero_100k.dat')
+vh_chwzp005 = load_events(data_dir + 'vh_chw_zp005.dat')
 
 # Drop signal column if using 100k sample
-vh_chwzero_df = vh_chwzero_df.iloc[:,:-1]
-vh_chwzp005_df = vh_chwzp005_df.iloc[:,:-1]
-
-# Normalising together
-scaler = preprocessing.MinMaxScaler()
-vh_mixed_combined_df = vh_chwzero_df.append(vh_chwzp005_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
-
-vh_chwzero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chwzero_df.shape[0],:]
-vh_chwzp005_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chwzero_df.shape[0]:,:]
+vh_chwzero = vh_chwzero[:,:-1]
+vh_chwzp005 = vh_chwzp005[:,:-1]
 
+# Normalising together, with a scaler fitted in chunks and saved with the model for the prediction scripts
+scaler = StreamingMinMaxScaler().fit_files([data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
 
-vh_chwzero = vh_chwzero_df_normalised.to_numpy()
-vh_chwzp005 = vh_chwzp005_df_normalised.to_numpy()
+vh_chwzero = scaler.transform(vh_chwzero)
+vh_chwzp005 = scaler.transform(vh_chwzp005)
 
 # Use 100k events from each
 data0 = vh_chwzero[:100000:]
@@ -107,4 +104,5 @@ plt.show()
 model_dir='model_dnn/'
 if not os.path.isdir(model_dir): os.system('mkdir '+model_dir)
 model_dnn.save(model_dir+'dnn100k_12epochs001.h5')
+scaler.save(model_dir+'scaler001.npy')
 np.savez(model_dir+'training_history001.npz', [history])
@@ -16,6 +16,7 @@ from scipy.stats import norm
 from scipy import integrate
 import random
 import os
+import sys
 from keras.layers import Input, Dense, Lambda, Flatten, Reshape
 from keras.models import Model
 from keras import backend as K
@@ -23,6 +24,11 @@ from keras import metrics
 
 import seaborn as sns; sns.set(style="white", color_codes=True)
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from morphing import CouplingMorphing
+from llr_engine import bin_probabilities, log_pdf, toy_counts, luminosity_test, rate_scan
+
 # =========================== Take in arguments ================================
 import argparse
 
@@ -43,6 +49,33 @@ parser.add_argument("--ext_num",
                     default=999,
                     help="str: The extension number for the output files. Should take the form of 00x, 0xy, xyz.")
 
+parser.add_argument("--scan_cross_sections",
+                    type=float,
+                    nargs=3,
+                    default=None,
+                    help="float: The first and last SM + EFT cross section (in pb) and number of cross sections to find the significance of at --scan_luminosity, all from one set of toys, with the shape of the EFT pdf kept. Default is None, which skips the scan.")
+
+parser.add_argument("--scan_luminosity",
+                    type=float,
+                    default=8.0,
+                    help="float: The luminosity (in fb^-1) of the scan of cross sections. Default is 8.0.")
+
+parser.add_argument("--morph",
+                    type=str,
+                    default=None,
+                    help="str: The coupling pdfs saved by coupling_scan.py (arrays/coupling_pdfs_<model>.npz), from at least three couplings with known cross sections. If given, the pdf and cross section are morphed to every cHW of --morph_couplings and the significance at --morph_luminosity is found for each. Default is None.")
+
+parser.add_argument("--morph_couplings",
+                    type=float,
+                    nargs=3,
+                    default=[0.001, 0.1, 100],
+                    help="float: The first and last cHW and number of couplings of the morphed scan. Default is 0.001 0.1 100.")
+
+parser.add_argument("--morph_luminosity",
+                    type=float,
+                    default=8.0,
+                    help="float: The luminosity (in fb^-1) of the morphed scan. Default is 8.0.")
+
 args = parser.parse_args()
 
 print("Pcut = " + str(args.pcut) + "ntoys = " + str(args.ntoys) + ", extension number = " + str(args.ext_num))
@@ -912,6 +945,62 @@ else:
     #plt.ylim(0,10)
 """
 
+# =========================== Z vs cHW ============================================
+
+# The pdfs of the couplings between the simulated ones are morphed rather than simulated and predicted on
+if args.morph:
+    morphing = CouplingMorphing.from_file(args.morph)
+    chw_arr = np.linspace(args.morph_couplings[0], args.morph_couplings[1], int(args.morph_couplings[2]))
+    morph_pdfs = morphing.pdf(chw_arr)
+    morph_cross_sections = morphing.cross_section(chw_arr)*1000
+    morph_sm_pdf = morphing.pdf(0.0)[0]
+    morph_sm_cross_section = morphing.cross_section(0.0)[0]*1000
+    print("Morphed SM cross section:", morph_sm_cross_section, "fb, known:", sm_cross_section, "fb")
+
+    rng = np.random.default_rng()
+    mu_sm = args.morph_luminosity*detector_efficiency*morph_sm_cross_section
+    sm_probabilities = bin_probabilities(morph_sm_pdf, morphing.bins)
+    sm_log_pdf = log_pdf(morph_sm_pdf)
+    # The SM toys are the same for every coupling
+    sm_counts = toy_counts(sm_probabilities, mu_sm, N_toys, rng)
+    nstdevs_chw_list = []
+    for chw_pdf, chw_cross_section in zip(morph_pdfs, morph_cross_sections):
+        mu_eft = args.morph_luminosity*detector_efficiency*chw_cross_section
+        _, nstdevs, _, _ = luminosity_test(sm_probabilities, bin_probabilities(chw_pdf, morphing.bins), sm_log_pdf, log_pdf(chw_pdf),
+                                           mu_sm, mu_eft, N_toys, rng, counts_b=sm_counts)
+        nstdevs_chw_list.append(nstdevs)
+
+    extension_chw = str(args.morph_luminosity) + 'L_' + extension
+    np.savetxt(array_dir + 'chwZvschw_arr' + extension_chw + '.txt', chw_arr)
+    np.savetxt(array_dir + 'cross_sectionZvschw_arr' + extension_chw + '.txt', morph_cross_sections)
+    np.savetxt(array_dir + 'nstdevsZvschw_arr' + extension_chw + '.txt', np.stack((nstdevs_chw_list)))
+
+    plt.figure()
+    plt.plot(chw_arr, nstdevs_chw_list, label = r'Morphed, $L = %s$ fb$^{-1}$' % args.morph_luminosity)
+    plt.legend()
+    plt.xlabel(r'$c_{HW}$')
+    plt.ylabel(r'Significance $Z$')
+
+# =========================== Z vs EFT cross section ==============================
+
+# Changing the EFT cross section only changes the expected number of events, so every cross section is tested with the same toys
+if args.scan_cross_sections:
+    scan_cross_section_arr = np.linspace(args.scan_cross_sections[0], args.scan_cross_sections[1], int(args.scan_cross_sections[2]))
+    mu_sm = args.scan_luminosity*detector_efficiency*sm_cross_section
+    mu_eft = args.scan_luminosity*detector_efficiency*scan_cross_section_arr*1000
+    _, nstdevs_scan_arr, effective_n_toys = rate_scan(sm_reference_pdf, np.tile(eft_reference_pdf, (len(mu_eft), 1)), mu_sm, mu_eft, sm_bins, N_toys, np.random.default_rng())
+    print("Effective number of toys of each EFT cross section:", effective_n_toys)
+
+    extension_scan = str(args.scan_luminosity) + 'L_' + extension
+    np.savetxt(array_dir + 'eft_cross_sectionZvsxsec_arr' + extension_scan + '.txt', scan_cross_section_arr)
+    np.savetxt(array_dir + 'nstdevsZvsxsec_arr' + extension_scan + '.txt', nstdevs_scan_arr)
+
+    plt.figure()
+    plt.plot(scan_cross_section_arr, nstdevs_scan_arr, label = r'$L = %s$ fb$^{-1}$' % args.scan_luminosity)
+    plt.legend()
+    plt.xlabel(r'$\sigma_{SM + EFT}$ [pb]')
+    plt.ylabel(r'Significance $Z$')
+
 # Run for specific values only for LLR plotting purposes
 #luminosity = 2.0
 #prob_threshold = 0
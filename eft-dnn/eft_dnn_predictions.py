@@ -14,33 +14,30 @@ from keras.layers import Dense, Flatten, Dropout, Activation, Conv2D, MaxPooling
 from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+
 data_dir = 'Data/'
 
-vh_chwzero_df = pd.read_csv(data_dir + 'vh_chw_zero_100k.dat', sep="\s+", header=None)
-vh_chwzp005_df = pd.read_csv(data_dir + 'vh_chw_zp005.dat', sep="\s+", header=None)
-#vh_chwzpz3_df = pd.read_csv(data_dir + 'vh_chwzpz3.dat', sep="\s+", header=None)
+vh_chwzero = load_events(data_dir + 'vh_chw_zero_100k.dat')
+vh_chwzp005 = load_events(data_dir + 'vh_chw_zp005.dat')
+#vh_chwzpz3 = load_events(data_dir + 'vh_chwzpz3.dat')
 
 # Drop signal column if using 100k sample
-vh_chwzero_df = vh_chwzero_df.iloc[:,:-1]
+vh_chwzero = vh_chwzero[:,:-1]
 
-vh_chwzp005_df = vh_chwzp005_df.iloc[:,:-1]
+vh_chwzp005 = vh_chwzp005[:,:-1]
 
 # Quick renaming zp005 - > zpz3 for speed
-vh_chwzpz3_df = vh_chwzp005_df
-
-# Normalising together
-scaler = preprocessing.MinMaxScaler()
-vh_mixed_combined_df = vh_chwzero_df.append(vh_chwzpz3_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
-
-vh_chwzero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chwzero_df.shape[0],:]
-vh_chwzpz3_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chwzero_df.shape[0]:,:]
+vh_chwzpz3 = vh_chwzp005
 
+# Normalising with the scaler saved with the model, so that events are scaled exactly as in training
+scaler = load_or_fit_scaler('model_dnn/scaler001.npy', [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
 
-vh_chwzero = vh_chwzero_df_normalised.to_numpy()
-vh_chwzpz3 = vh_chwzpz3_df_normalised.to_numpy()
+vh_chwzero = scaler.transform(vh_chwzero)
+vh_chwzpz3 = scaler.transform(vh_chwzpz3)
 
 # Use 100k events from each
 data0 = vh_chwzero[:100000:]
@@ -2,7 +2,7 @@
 #Original Source: Charanjit K. Khosa, University of Genova, Italy
 #Modified By: Michael Soughton, University of Sussex, UK, Michael Soughton, University of Sussex, UK
 #Date: 26.03.2021
-import sys, os
+import sys, os, time
 import numpy as np
 import pandas as pd
 from numpy import expand_dims
@@ -14,48 +14,109 @@ from keras.layers import Dense, Flatten, Dropout, Activation, Conv2D, MaxPooling
 from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from packed_ensemble import create_packed_model, ReplicaBatches, replica_weights, set_replica_weights
+from pdf_spread import iteration_pdfs, save_and_compare
+from model_pool import ModelPool, EpochTimer, OverheadReport
+from weight_store import WeightStore
+from shared_data import load_shared, source_key
+from event_cache import load_events
+from streaming_scaler import StreamingMinMaxScaler
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--n_iter",
+                    type=int,
+                    default=1000,
+                    help="int: The number of bootstrap iterations. Default is 1000.")
+
+parser.add_argument("--pack_size",
+                    type=int,
+                    default=1,
+                    help="int: The number of bootstrap replicas trained together as one packed model. Default is 1, which trains them one after another.")
+
+parser.add_argument("--benchmark",
+                    type=int,
+                    default=0,
+                    help="int: If non-zero, train this many replicas one after another and then packed together, print the replicas/hour of each and exit. Default is 0.")
+
+parser.add_argument("--model_pool",
+                    type=int,
+                    default=1,
+                    help="int: If 1, build and compile each model once and reinitialise its weights and optimiser for each iteration, rather than building a new one each time (0). Default is 1.")
+
+parser.add_argument("--warm_start",
+                    type=int,
+                    default=0,
+                    help="int: If 1, train one base model and fine-tune every bootstrap replica from it for fine_tune_epochs epochs, rather than training each replica from scratch (0). Default is 0.")
+
+parser.add_argument("--fine_tune_epochs",
+                    type=int,
+                    default=3,
+                    help="int: The number of epochs each replica is fine-tuned for with warm_start. Default is 3.")
+
+parser.add_argument("--shared_data",
+                    type=int,
+                    default=1,
+                    help="int: If 1, prepare the data into shared memory once and have every job on the node attach to it, rather than each preparing its own copy (0). Default is 1.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
 data_dir = 'Data/'
 
-vh_chwzero_df = pd.read_csv(data_dir + 'vh_chw_zero_100k.dat', sep="\s+", header=None)
-vh_chwzp005_df = pd.read_csv(data_dir + 'vh_chw_zp005.dat', sep="\s+", header=None)
-#vh_chwzpz3_df = pd.read_csv(data_dir + 'vh_chwzpz3.dat', sep="\s+", header=None)
+source_files = [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat']
+
+def prepare_data():
+    """
+    Read and normalise the SM and cHW = 0.005 events, returning the events, their
+    labels and the per-feature min and max of the scaler.
+    """
+    vh_chwzero = load_events(source_files[0])
+    vh_chwzp005 = load_events(source_files[1])
+    #vh_chwzpz3 = load_events(data_dir + 'vh_chwzpz3.dat')
 
-# Drop signal column if using 100k sample
-vh_chwzero_df = vh_chwzero_df.iloc[:,:-1]
+    # Drop signal column if using 100k sample
+    vh_chwzero = vh_chwzero[:,:-1]
 
-vh_chwzp005_df = vh_chwzp005_df.iloc[:,:-1]
+    vh_chwzp005 = vh_chwzp005[:,:-1]
 
-# Quick renaming zp005 - > zpz3 for speed
-vh_chwzpz3_df = vh_chwzp005_df
+    # Quick renaming zp005 - > zpz3 for speed
+    vh_chwzpz3 = vh_chwzp005
 
-# Normalising together
-scaler = preprocessing.MinMaxScaler()
-vh_mixed_combined_df = vh_chwzero_df.append(vh_chwzpz3_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
+    # Normalising together
+    scaler = StreamingMinMaxScaler().fit_files(source_files)
 
-vh_chwzero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chwzero_df.shape[0],:]
-vh_chwzpz3_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chwzero_df.shape[0]:,:]
+    vh_chwzero = scaler.transform(vh_chwzero)
+    vh_chwzpz3 = scaler.transform(vh_chwzpz3)
 
+    # Use 100k events from each
+    data0 = vh_chwzero[:100000:]
+    data1 = vh_chwzpz3[:100000:]
 
-vh_chwzero = vh_chwzero_df_normalised.to_numpy()
-vh_chwzpz3 = vh_chwzpz3_df_normalised.to_numpy()
 
-# Use 100k events from each
-data0 = vh_chwzero[:100000:]
-data1 = vh_chwzpz3[:100000:]
+    print("data0",data0.shape)
+    print('We have {} QCD jets and {} top jets'.format(len(data0), len(data1)))
 
+    # objects and labels
+    x_data = np.concatenate((data0, data1))
+    y_data = np.array([0]*len(data0)+[1]*len(data1))
 
-print("data0",data0.shape)
-print('We have {} QCD jets and {} top jets'.format(len(data0), len(data1)))
 
-# objects and labels
-x_data = np.concatenate((data0, data1))
-y_data = np.array([0]*len(data0)+[1]*len(data1))
+    print("xdatashape",x_data.shape)
 
+    return {'x_data': x_data, 'y_data': y_data, 'data_min': scaler.data_min_, 'data_max': scaler.data_max_}
+
+# Every job on the node attaches to one copy of the prepared data in shared memory
+prepared = load_shared('eft_dnn_' + source_key(source_files), prepare_data, enabled=args.shared_data)
+x_data, y_data = prepared['x_data'], prepared['y_data']
+scaler = StreamingMinMaxScaler(prepared['data_min'], prepared['data_max'])
 
-print("xdatashape",x_data.shape)
 #y_data = keras.utils.to_categorical(y_data, 2)
 #x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.3, random_state=42)
 
@@ -79,80 +140,227 @@ def create_model():
 
     return model_dnn
 
-n_iterations = 1000
+model_pools = {}
+
+def get_model(n_replicas=0, use_pool=args.model_pool):
+    """
+    A freshly initialised DNN, or a packed model of n_replicas replicas if n_replicas > 0,
+    from the model pools if they are used, and the time taken to get it.
+    """
+    start = time.time()
+    build = (lambda: create_packed_model(n_replicas, shared_input=False)) if n_replicas > 0 else create_model
+    if not use_pool:
+        return build(), time.time() - start
+    if n_replicas not in model_pools:
+        model_pools[n_replicas] = ModelPool(build)
+    return model_pools[n_replicas].get(), model_pools[n_replicas].setup_time
+
+def release_model(model_dnn, use_pool=args.model_pool):
+    # Pooled models are kept for the next iteration, otherwise clear model and memory
+    if not use_pool:
+        from keras import backend as K
+        import gc
+        del model_dnn
+        K.clear_session()
+        gc.collect()
+        print("Cleared session and memory")
+
+def train_packed_replicas(n_replicas, first_iteration=None):
+    """
+    Train n_replicas bootstrap replicas at once as a packed model, each on its own
+    train/test split, and return the EFT and SM probabilities of each replica's test events.
+    Each replica is fed its own batches of 100 of its training events, in its own
+    shuffled order, so it takes as many steps per epoch as a replica trained alone.
+    If first_iteration is given the weights of the replicas are stored as the
+    iterations from first_iteration on.
+    """
+    splits = [train_test_split(np.arange(len(x_data)), test_size=0.3) for k in range(n_replicas)]
+    train_indices = np.stack([train for train, test in splits])
+    test_indices = np.stack([test for train, test in splits])
+
+    y_onehot = keras.utils.to_categorical(y_data, 2)
+    train_batches = ReplicaBatches(x_data, y_onehot, train_indices, batch_size=100, shuffle=True, seed=np.random.randint(2**31))
+    test_batches = ReplicaBatches(x_data, y_onehot, test_indices, batch_size=100)
+
+    start = time.time()
+    model_dnn, setup_time = get_model(n_replicas)
+    if base_weights is not None:
+        set_replica_weights(model_dnn, [base_weights]*n_replicas)
+    timer = EpochTimer()
+    history = model_dnn.fit(train_batches, validation_data=test_batches, epochs=iteration_epochs, verbose=1, callbacks=[timer])
+    overheads.add(setup_time, timer, time.time() - start)
+    # Predictions of shape (n_test, n_replicas, 2), on the test events of each replica
+    predictions_dnn = model_dnn.predict(ReplicaBatches(x_data, y_onehot, test_indices, batch_size=10000))
+
+    if first_iteration is not None:
+        for k in range(n_replicas):
+            weight_store.write(first_iteration + k, replica_weights(model_dnn, k))
+
+    packed_top_probs_list = []
+    packed_qcd_probs_list = []
+    for k in range(n_replicas):
+        y_top = predictions_dnn[:,k,1]
+        y_test = y_data[test_indices[k]]
+        packed_top_probs_list.append(y_top[y_test == 1])
+        packed_qcd_probs_list.append(y_top[y_test == 0])
+
+    release_model(model_dnn)
+
+    return packed_top_probs_list, packed_qcd_probs_list
+
+# Cold-started replicas are each trained from scratch for all epochs
+n_epochs = 11
+base_weights = None
+iteration_epochs = n_epochs
+overheads = OverheadReport()
+
+if args.benchmark > 0:
+    sequential_times = {}
+    for use_pool in [False, True]:
+        pool_overheads = OverheadReport()
+        start = time.time()
+        for i in range(args.benchmark):
+            iteration_start = time.time()
+            x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.3)
+            model_dnn, setup_time = get_model(use_pool=use_pool)
+            timer = EpochTimer()
+            model_dnn.fit(x_train, keras.utils.to_categorical(y_train, 2), validation_data=(x_test, keras.utils.to_categorical(y_test, 2)), epochs=11, batch_size=100, shuffle=True, verbose=0, callbacks=[timer])
+            model_dnn.predict(x_test)
+            pool_overheads.add(setup_time, timer, time.time() - iteration_start)
+            release_model(model_dnn, use_pool=use_pool)
+        sequential_times[use_pool] = time.time() - start
+        pool_overheads.report("Sequential with model pool" if use_pool else "Sequential with a new model per replica")
+
+    start = time.time()
+    train_packed_replicas(args.benchmark)
+    packed_time = time.time() - start
+
+    print("Sequential:", args.benchmark, "replicas in", sequential_times[False], "s,", 3600*args.benchmark/sequential_times[False], "replicas/hour")
+    print("Sequential with model pool:", args.benchmark, "replicas in", sequential_times[True], "s,", 3600*args.benchmark/sequential_times[True], "replicas/hour")
+    print("Packed:", args.benchmark, "replicas in", packed_time, "s,", 3600*args.benchmark/packed_time, "replicas/hour")
+    sys.exit(0)
+
+n_iterations = args.n_iter
 top_probs_list = []
 qcd_probs_list = []
 
-for i in range(n_iterations):
-
+# The weights of every replica are kept so that the ensemble can be rerun over any dataset with ensemble_predict.py
+model_dir = 'model_dnn/'
+os.makedirs(model_dir, exist_ok=True)
+extension = '_' + str(n_iterations) + '_bootstraps'
+cold_start_extension = extension
+if args.warm_start:
+    extension += '_warmstart' + str(args.fine_tune_epochs)
+# Packed runs are kept apart from the sequential ones, which their PDF spread is compared with
+if args.pack_size > 1:
+    extension += '_packed'
+from keras import backend as K
+n_params = create_model().count_params()
+K.clear_session()
+weight_store = WeightStore(model_dir, extension, n_iterations, n_params, scaler)
+
+# Warm-started replicas are fine-tuned from one base model trained on a split of its own
+if args.warm_start:
+    print("Training base model for warm-started replicas")
     x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.3)
+    model_dnn, _ = get_model()
+    model_dnn.fit(x_train, keras.utils.to_categorical(y_train, 2), validation_data=(x_test, keras.utils.to_categorical(y_test, 2)), epochs=n_epochs, batch_size=100, shuffle=True, verbose=1)
+    base_weights = model_dnn.get_weights()
+    release_model(model_dnn)
+    iteration_epochs = args.fine_tune_epochs
+
+start = time.time()
+if args.pack_size > 1:
+    n_done = 0
+    while n_done < n_iterations:
+        n_replicas = min(args.pack_size, n_iterations - n_done)
+        print("bootstrap iterations", n_done+1, "to", n_done+n_replicas, "/", n_iterations, "packed together")
+        packed_top_probs_list, packed_qcd_probs_list = train_packed_replicas(n_replicas, first_iteration=n_done)
+        top_probs_list.extend(packed_top_probs_list)
+        qcd_probs_list.extend(packed_qcd_probs_list)
+        n_done += n_replicas
+    top_probs = top_probs_list[-1]
+    qcd_probs = qcd_probs_list[-1]
+    import matplotlib.pyplot as plt
+else:
+    for i in range(n_iterations):
 
-    print("x_train",x_train.shape)
-    ytestone=y_test
+        x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.3)
 
-    y_train = keras.utils.to_categorical(y_train, 2)
-    y_test = keras.utils.to_categorical(y_test, 2)
+        print("x_train",x_train.shape)
+        ytestone=y_test
 
-    model_dnn = create_model()
-    print("bootstrap iteration", i+1, "/", n_iterations)
+        y_train = keras.utils.to_categorical(y_train, 2)
+        y_test = keras.utils.to_categorical(y_test, 2)
 
-    #history = model_dnn.fit(x_train, y_train, validation_split=0.2, epochs=3, batch_size=100, shuffle=True, verbose=1)
-    history = model_dnn.fit(x_train, y_train, validation_data=(x_test,y_test), epochs=11, batch_size=100, shuffle=True, verbose=1)
+        iteration_start = time.time()
+        model_dnn, setup_time = get_model()
+        if base_weights is not None:
+            model_dnn.set_weights(base_weights)
+        print("bootstrap iteration", i+1, "/", n_iterations)
 
+        #history = model_dnn.fit(x_train, y_train, validation_split=0.2, epochs=3, batch_size=100, shuffle=True, verbose=1)
+        timer = EpochTimer()
+        history = model_dnn.fit(x_train, y_train, validation_data=(x_test,y_test), epochs=iteration_epochs, batch_size=100, shuffle=True, verbose=1, callbacks=[timer])
+        overheads.add(setup_time, timer, time.time() - iteration_start)
+        weight_store.write(i, model_dnn.get_weights())
 
-    import warnings
-    import matplotlib.pyplot as plt
 
-    model_dir='model_dnn/'
+        import warnings
+        import matplotlib.pyplot as plt
+
+        model_dir='model_dnn/'
+
+        #history_dnn = np.load(model_dir+'training_histories.npz')['arr_0']
+        #model_dnn = keras.models.load_model(model_dir+'dnn_100k_11epochs001.h5')
+
+        predictions_dnn = model_dnn.predict(x_test)
 
-    #history_dnn = np.load(model_dir+'training_histories.npz')['arr_0']
-    #model_dnn = keras.models.load_model(model_dir+'dnn_100k_11epochs001.h5')
+        #print("predictions_dnn",predictions_dnn[10])
 
-    predictions_dnn = model_dnn.predict(x_test)
 
-    #print("predictions_dnn",predictions_dnn[10])
 
+        from sklearn.metrics import roc_curve
 
+        fpr_dnn, tpr_dnn, thresholds = roc_curve(y_test.ravel(), predictions_dnn.ravel())
 
-    from sklearn.metrics import roc_curve
+        from sklearn.metrics import auc
 
-    fpr_dnn, tpr_dnn, thresholds = roc_curve(y_test.ravel(), predictions_dnn.ravel())
+        auc = auc(fpr_dnn, tpr_dnn)
 
-    from sklearn.metrics import auc
+        plt.plot([0, 1], [0, 1], 'k--')
+        plt.plot(fpr_dnn, tpr_dnn, label='(AUC = {:.3f})'.format(auc))
+        plt.gca().set(xlabel='False positive rate', ylabel='True positive rate', title='ROC curve', xlim=(-0.01,1.01), ylim=(-0.01,1.01))
+        plt.grid(True, which="both")
+        plt.legend(loc='lower right');
+        #plt.savefig('ROC_curve.png')
 
-    auc = auc(fpr_dnn, tpr_dnn)
 
-    plt.plot([0, 1], [0, 1], 'k--')
-    plt.plot(fpr_dnn, tpr_dnn, label='(AUC = {:.3f})'.format(auc))
-    plt.gca().set(xlabel='False positive rate', ylabel='True positive rate', title='ROC curve', xlim=(-0.01,1.01), ylim=(-0.01,1.01))
-    plt.grid(True, which="both")
-    plt.legend(loc='lower right');
-    #plt.savefig('ROC_curve.png')
+        y_top=predictions_dnn[:,1]
 
+        print("y_top",y_top)
+        print("y_test",y_test)
 
-    y_top=predictions_dnn[:,1]
+        #ytestnew= y_test.flatten()
 
-    print("y_top",y_top)
-    print("y_test",y_test)
+        print("ytestone",ytestone)
+        print("y_top.shape",y_top.shape)
 
-    #ytestnew= y_test.flatten()
+        top_probs = y_top[np.where(ytestone == 1)]
+        qcd_probs = y_top[np.where(ytestone == 0)]
 
-    print("ytestone",ytestone)
-    print("y_top.shape",y_top.shape)
+        top_probs_list.append(top_probs)
+        qcd_probs_list.append(qcd_probs)
 
-    top_probs = y_top[np.where(ytestone == 1)]
-    qcd_probs = y_top[np.where(ytestone == 0)]
+        release_model(model_dnn)
 
-    top_probs_list.append(top_probs)
-    qcd_probs_list.append(qcd_probs)
+print("Trained", n_iterations, "replicas at", 3600*n_iterations/(time.time() - start), "replicas/hour")
+overheads.report("Model pool" if args.model_pool else "New model per iteration")
 
-    # Clear model and memory
-    from keras import backend as K
-    import gc
-    del model_dnn
-    K.clear_session()
-    gc.collect()
-    print("Cleared session and memory")
+# Keep the spread of the PDFs over the replicas, and compare warm-started or packed replicas with the sequential cold-started run of the same size
+pdf_bins = np.linspace(0, 1, 51)
+save_and_compare('arrays/iteration_pdfs' + extension + '.npz', 'arrays/iteration_pdfs' + cold_start_extension + '.npz' if extension != cold_start_extension else None, pdf_bins,
+                 {'SM': iteration_pdfs(qcd_probs_list, pdf_bins), 'EFT': iteration_pdfs(top_probs_list, pdf_bins)})
 
 print("SM LIST")
 print(top_probs_list)
@@ -176,8 +384,10 @@ print(len(qcd_probs_list[0]))
 print(len(top_probs_array))
 print(len(qcd_probs_array))
 
-np.savetxt("vh_chw_zero_1kbootstrap001.txt",qcd_probs_array)
-np.savetxt("vh_chw_zp005_1kbootstrap001.txt",top_probs_array)
+# Warm-started and packed runs are saved alongside the sequential cold-started ones rather than over them
+warm_start_suffix = extension[len(cold_start_extension):]
+np.savetxt("vh_chw_zero_1kbootstrap001" + warm_start_suffix + ".txt",qcd_probs_array)
+np.savetxt("vh_chw_zp005_1kbootstrap001" + warm_start_suffix + ".txt",top_probs_array)
 
 print("top_probs",top_probs)
 
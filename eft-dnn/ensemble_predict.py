@@ -0,0 +1,73 @@
+#Purpose: Run every stored bootstrap DNN over a dataset of EFT events
+import sys, os
+import numpy as np
+
+from keras import backend as K
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from packed_ensemble import create_packed_model, set_replica_weights
+from weight_store import load_weight_store, unflatten_weights, read_events, scale_events
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--extension",
+                    type=str,
+                    default="_1000_bootstraps",
+                    help="str: The extension of the bootstrap run whose models are to be used. Default is '_1000_bootstraps'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    default="Data/vh_chw_zp005.dat",
+                    help="str: The .dat file (or .npy array of unnormalised features) of events to predict on. Default is 'Data/vh_chw_zp005.dat'.")
+
+parser.add_argument("--output",
+                    type=str,
+                    default="",
+                    help="str: The .npy file the (n_models, n_events) matrix of EFT probabilities is written to. Default is arrays/ensemble_predictions + extension + .npy.")
+
+parser.add_argument("--models_per_pass",
+                    type=int,
+                    default=100,
+                    help="int: The number of models packed together and run side by side over each batch of events. Default is 100.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=10000,
+                    help="int: The number of events in each batch. Default is 10000.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+model_dir = 'model_dnn/'
+output = args.output if args.output != "" else 'arrays/ensemble_predictions' + args.extension + '.npy'
+
+weights_arr, data_min, data_max = load_weight_store(model_dir, args.extension)
+
+# The events are read and normalised once, with the scaler the models were trained with
+x_data = scale_events(read_events(args.data), data_min, data_max)
+n_models, n_events = len(weights_arr), len(x_data)
+print("Predicting with", n_models, "bootstrap models on", n_events, "events")
+
+predictions_matrix = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32, shape=(n_models, n_events))
+
+for start in range(0, n_models, args.models_per_pass):
+    pass_weights = weights_arr[start:start+args.models_per_pass]
+    model_dnn = create_packed_model(len(pass_weights))
+    shapes = [w.shape[1:] for w in model_dnn.get_weights()]
+    set_replica_weights(model_dnn, [unflatten_weights(flat_weights, shapes) for flat_weights in pass_weights])
+
+    # Each batch of events goes through every model of the pass in one forward pass
+    predictions_dnn = model_dnn.predict(x_data, batch_size=args.batch_size)
+    predictions_matrix[start:start+len(pass_weights)] = predictions_dnn[:,:,1].T
+    predictions_matrix.flush()
+    print("Models", start+1, "to", start+len(pass_weights), "/", n_models, "done")
+
+    del model_dnn
+    K.clear_session()
+
+print("Saved predictions to " + output)
@@ -0,0 +1,66 @@
+#Purpose: Export a trained DNN to a NumPy weight bundle and check that its NumPy predictions match Keras
+import os
+import sys
+import time
+import numpy as np
+
+import keras
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+from numpy_inference import export_model, NumpyModel
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--model",
+                    type=str,
+                    default="model_dnn/dnn_100k_11epochs001.h5",
+                    help="str: The trained DNN. Default is 'model_dnn/dnn_100k_11epochs001.h5'.")
+
+parser.add_argument("--scaler",
+                    type=str,
+                    default="model_dnn/scaler001.npy",
+                    help="str: The scaler saved with the model. If it does not exist one is fitted to the SM and cHW = 0.005 events as in training. Default is 'model_dnn/scaler001.npy'.")
+
+parser.add_argument("--n_check",
+                    type=int,
+                    default=10000,
+                    help="int: The number of events of each class the NumPy and Keras predictions are compared on. Default is 10000.")
+
+parser.add_argument("--tolerance",
+                    type=float,
+                    default=1e-5,
+                    help="float: The largest absolute difference allowed between the NumPy and Keras predictions. Default is 1e-5.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+data_dir = 'Data/'
+output = os.path.splitext(args.model)[0] + '.npz'
+
+model_dnn = keras.models.load_model(args.model)
+export_model(model_dnn, output)
+print("Exported", args.model, "to", output)
+
+paths = [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat']
+scaler = load_or_fit_scaler(args.scaler, paths)
+# Drop signal column
+x_check = scaler.transform(np.concatenate([load_events(path)[:args.n_check,:-1] for path in paths]))
+start = time.time()
+keras_pred = model_dnn.predict(x_check, batch_size=1000, verbose=0)
+keras_time = time.time() - start
+start = time.time()
+numpy_pred = NumpyModel(output).predict(x_check, batch_size=1000)
+numpy_time = time.time() - start
+
+difference = np.max(np.abs(numpy_pred - keras_pred))
+print("Largest difference from Keras over", len(x_check), "events:", difference)
+print("Prediction time: Keras {:.3f} s, NumPy {:.3f} s".format(keras_time, numpy_time))
+if difference > args.tolerance:
+    raise SystemExit("The NumPy predictions differ from Keras by more than " + str(args.tolerance))
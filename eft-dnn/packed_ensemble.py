@@ -0,0 +1,147 @@
+"""
+    Packed ensemble of the bootstrap DNN: n_replicas independent copies of the
+    13-20-40-40-20-2 network held side by side in one keras model, so that many
+    bootstrap replicas are trained in a single fit. Every layer holds a separate
+    kernel per replica, so no weights are shared and the outputs of the replicas
+    are independent. In training each replica is fed its own batches, drawn in its
+    own shuffled order from its own bootstrap split, so it takes the same number
+    of steps on the same number of events per step as a replica trained alone.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+import tensorflow as tf
+
+import keras
+from keras.models import Sequential
+from keras.layers import Layer, Activation
+from keras import activations, initializers
+from keras import backend as K
+
+class PackedDense(Layer):
+    """
+    n_replicas independent Dense layers applied side by side. Takes inputs of shape
+    (batch, n_replicas, input_dim), or (batch, input_dim) for an input shared by all
+    replicas, and returns outputs of shape (batch, n_replicas, units).
+    """
+    def __init__(self, units, n_replicas, activation=None, **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+        self.n_replicas = n_replicas
+        self.activation = activations.get(activation)
+
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+        # The same Glorot uniform initialisation each replica would get as a single Dense layer
+        limit = np.sqrt(6.0/(input_dim + self.units))
+        self.kernel_initializer = initializers.RandomUniform(-limit, limit)
+        self.bias_initializer = initializers.get('zeros')
+        self.kernel = self.add_weight(name='kernel', shape=(self.n_replicas, input_dim, self.units),
+                                      initializer=self.kernel_initializer, trainable=True)
+        self.bias = self.add_weight(name='bias', shape=(self.n_replicas, self.units), initializer=self.bias_initializer, trainable=True)
+        super().build(input_shape)
+
+    def call(self, inputs):
+        if len(inputs.shape) == 2:
+            outputs = tf.einsum('bi,kio->bko', inputs, self.kernel)
+        else:
+            outputs = tf.einsum('bki,kio->bko', inputs, self.kernel)
+        return self.activation(outputs + self.bias)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.n_replicas, self.units)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'units': self.units, 'n_replicas': self.n_replicas, 'activation': activations.serialize(self.activation)})
+        return config
+
+def packed_categorical_crossentropy(y_true, y_pred):
+    """
+    Categorical crossentropy of each replica, averaged over the events in the
+    replica's batch and summed over replicas. y_true has shape (batch, n_replicas, 3)
+    with the one-hot labels followed by a weight marking the events of the replica,
+    and each replica's loss is normalised by its own number of events, so that it
+    is the mean loss a replica trained alone would see.
+    """
+    weights = y_true[:,:,-1]
+    y_pred = tf.clip_by_value(y_pred, K.epsilon(), 1.0 - K.epsilon())
+    crossentropy = -tf.reduce_sum(y_true[:,:,:-1]*tf.math.log(y_pred), axis=-1)
+    # Keras averages the returned values over the batch, which turns these into per-replica means
+    weights = weights/tf.maximum(tf.reduce_mean(weights, axis=0, keepdims=True), K.epsilon())
+    return tf.reduce_sum(weights*crossentropy, axis=-1)
+
+def packed_targets(y_onehot, masks):
+    """
+    Build the (n_events, n_replicas, 3) targets for packed_categorical_crossentropy
+    from the one-hot labels, of shape (n_events, 2) or (n_events, n_replicas, 2),
+    and an (n_events, n_replicas) mask of the events of each replica.
+    """
+    n_replicas = masks.shape[1]
+    targets = np.empty((len(y_onehot), n_replicas, y_onehot.shape[-1] + 1), dtype=np.float32)
+    targets[:,:,:-1] = y_onehot[:,None,:] if y_onehot.ndim == 2 else y_onehot
+    targets[:,:,-1] = masks
+    return targets
+
+class ReplicaBatches(keras.utils.Sequence):
+    """
+    Batches for a packed model trained on a separate set of events per replica.
+    indices has shape (n_replicas, n_events) and holds the events of each replica,
+    of which each batch takes batch_size per replica, giving inputs of shape
+    (batch_size, n_replicas, n_features) and the matching packed targets. With
+    shuffle every replica goes through its events in its own random order,
+    redrawn at the end of every epoch.
+    """
+    def __init__(self, x_data, y_onehot, indices, batch_size=100, shuffle=False, seed=None):
+        super().__init__()
+        self.x_data = x_data
+        self.y_onehot = y_onehot
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(self.indices))]
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(self.indices.shape[1]/self.batch_size))
+
+    def __getitem__(self, batch):
+        batch_indices = self.order[:, batch*self.batch_size:(batch+1)*self.batch_size].T
+        y_batch = self.y_onehot[batch_indices]
+        return np.asarray(self.x_data[batch_indices], dtype=np.float32), packed_targets(y_batch, np.ones(batch_indices.shape))
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.order = np.stack([rng.permutation(replica_indices) for rng, replica_indices in zip(self.rngs, self.indices)])
+        else:
+            self.order = self.indices
+
+def create_packed_model(n_replicas, shared_input=True):
+    """
+    The packed DNN, taking inputs of shape (batch, 13) shared by every replica, or
+    of shape (batch, n_replicas, 13) with a batch per replica if not shared_input.
+    """
+    model_dnn = Sequential()
+    model_dnn.add(PackedDense(20, n_replicas, input_shape=(13,) if shared_input else (n_replicas, 13), activation='relu'))
+    model_dnn.add(PackedDense(40, n_replicas, activation='relu'))
+    model_dnn.add(PackedDense(40, n_replicas, activation='relu'))
+    model_dnn.add(PackedDense(20, n_replicas, activation='relu'))
+    model_dnn.add(PackedDense(2, n_replicas))
+    # Softmax over the classes of each replica separately
+    model_dnn.add(Activation('softmax'))
+
+    model_dnn.compile(loss=packed_categorical_crossentropy, optimizer='adam')
+
+    return model_dnn
+
+def replica_weights(packed_model, k):
+    """
+    The weights of replica k, in the order and shapes model.get_weights() gives for a single unpacked model.
+    """
+    return [w[k] for w in packed_model.get_weights()]
+
+def set_replica_weights(packed_model, weight_lists):
+    """
+    Set the weights of every replica from a list, one per replica, of the weights of a single unpacked model.
+    """
+    packed_model.set_weights([np.stack([weights[j] for weights in weight_lists]) for j in range(len(weight_lists[0]))])
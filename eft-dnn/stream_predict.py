@@ -0,0 +1,88 @@
+#Purpose: Stream a trained DNN over EFT event files of any size, saving P(EFT) of every event and the pdfs
+import os
+import sys
+import numpy as np
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+from streaming_inference import IncrementalHistogram, stream_predict
+from numpy_inference import NumpyModel
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--model",
+                    type=str,
+                    default="model_dnn/dnn_100k_11epochs001.h5",
+                    help="str: The trained DNN, or its NumPy export (.npz) from export_numpy.py to predict without TensorFlow. Default is 'model_dnn/dnn_100k_11epochs001.h5'.")
+
+parser.add_argument("--scaler",
+                    type=str,
+                    default="model_dnn/scaler001.npy",
+                    help="str: The scaler saved with the model. If it does not exist one is fitted to the SM and cHW = 0.005 events as in training. Default is 'model_dnn/scaler001.npy'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    nargs='+',
+                    default=['Data/vh_chw_zero_100k.dat', 'Data/vh_chw_zp005.dat'],
+                    help="str: The .dat files to predict on, each with a pdf of its own. Default is 'Data/vh_chw_zero_100k.dat Data/vh_chw_zp005.dat'.")
+
+parser.add_argument("--output_dir",
+                    type=str,
+                    default="arrays/",
+                    help="str: The directory the predictions and pdfs are saved to. Default is 'arrays/'.")
+
+parser.add_argument("--chunk_size",
+                    type=int,
+                    default=1000000,
+                    help="int: The number of events read and predicted at a time. Default is 1000000.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=0,
+                    help="int: The batch size of predict. Default is 0, which tunes it on the first chunk.")
+
+parser.add_argument("--n_bins",
+                    type=int,
+                    default=50,
+                    help="int: The number of bins of the pdfs of P(EFT), between 0 and 1. Default is 50.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+data_dir = 'Data/'
+os.makedirs(args.output_dir, exist_ok=True)
+tag = os.path.splitext(os.path.basename(args.model))[0]
+pdf_file = args.output_dir + 'stream_pdfs_' + tag + '.npz'
+
+if args.model.endswith('.npz'):
+    model_dnn = NumpyModel(args.model)
+else:
+    import keras
+    model_dnn = keras.models.load_model(args.model)
+scaler = load_or_fit_scaler(args.scaler, [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
+
+class_names = [os.path.splitext(os.path.basename(path))[0] for path in args.data]
+histogram = IncrementalHistogram(np.linspace(0, 1, args.n_bins + 1), n_classes=len(args.data))
+
+def predict_eft(x, batch_size):
+    return model_dnn.predict(x, batch_size=batch_size, verbose=0)[:,1]
+
+batch_size = args.batch_size
+for label, path in enumerate(args.data):
+    # Drop signal column
+    events = load_events(path)[:,:-1]
+    output = args.output_dir + 'stream_predictions_' + class_names[label] + '_' + tag + '.npy'
+    print("Predicting on", len(events), "events of", path)
+    # The batch size tuned on the first file is kept for the rest
+    _, batch_size = stream_predict(predict_eft, events, output, chunk_size=args.chunk_size, batch_size=batch_size,
+                                   transform=scaler.transform, histogram=histogram, labels=label)
+    print("Saved predictions to", output)
+
+histogram.save(pdf_file, class_names)
+print("Saved pdfs to", pdf_file)
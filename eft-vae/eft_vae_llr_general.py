@@ -18,11 +18,18 @@ import scipy.optimize
 from scipy.stats import norm
 from scipy import integrate
 import os
+import sys
 import random
 from numpy import log,inf,sqrt,pi,exp
 
 import seaborn as sns; sns.set(style="white", color_codes=True)
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from error_store import error_files, load_errors
+from morphing import CouplingMorphing
+from llr_engine import bin_probabilities, log_pdf, general_test, expected_pdf_term, profile_test
+
 plt.close("all")
 
 # =========================== Take in arguments ================================
@@ -45,6 +52,42 @@ parser.add_argument("--ext_num",
                     default=999,
                     help="str: The extension number for the output files. Should take the form of 00x, 0xy, xyz.")
 
+parser.add_argument("--bootstrap",
+                    type=int,
+                    default=0,
+                    help="int: If 1, use the reconstruction errors of every bootstrap VAE saved by eft_vae_predictions_bootstrap.py (memory mapped from vae_outputs) rather than those of the single VAE. Default is 0.")
+
+parser.add_argument("--bootstrap_extension",
+                    type=str,
+                    default="_1000_bootstraps",
+                    help="str: The extension of the bootstrap run whose reconstruction errors are used with --bootstrap 1, as in the names eft_vae_predictions_bootstrap.py saves them with, e.g. '_100_bootstraps' or '_1000_bootstraps_warmstart5'. Default is '_1000_bootstraps'.")
+
+parser.add_argument("--exact",
+                    type=int,
+                    default=0,
+                    help="int: If 1, the average of the second LLR term is found exactly from the reference pdfs rather than from toys, which are then only sampled (--ntoys of them, which may be 0) to plot its spread. Default is 0.")
+
+parser.add_argument("--profile",
+                    type=int,
+                    default=0,
+                    help="int: If 1, the number of signal events is fitted by maximum likelihood for each of --ntoys Poisson toys (or for the Asimov dataset of the expected counts if --ntoys is 0) rather than fixed to N - b, and the significance is that of the median profile LLR. Default is 0.")
+
+parser.add_argument("--morph",
+                    type=str,
+                    default=None,
+                    help="str: The coupling pdfs saved by coupling_scan.py (arrays/coupling_pdfs_<weights>.npz), from at least three couplings with known cross sections. If given, the pdf and cross section are morphed to every cHW of --morph_couplings and the significance at --morph_luminosity is found for each. Default is None.")
+
+parser.add_argument("--morph_couplings",
+                    type=float,
+                    nargs=3,
+                    default=[0.001, 0.1, 100],
+                    help="float: The first and last cHW and number of couplings of the morphed scan. Default is 0.001 0.1 100.")
+
+parser.add_argument("--morph_luminosity",
+                    type=float,
+                    default=8.0,
+                    help="float: The luminosity (in fb^-1) of the morphed scan. Default is 8.0.")
+
 args = parser.parse_args()
 
 print("Rcut = " + str(args.rcut) + "ntoys = " + str(args.ntoys) + ", extension number = " + str(args.ext_num))
@@ -63,11 +106,13 @@ if not os.path.isdir(plot_dir): os.system('mkdir '+ plot_dir)
 if not os.path.isdir(model_dir): os.system('mkdir '+ model_dir)
 
 plt.close("all")
-sm_recon_error = np.loadtxt(vae_outputs + "vh_chw_zero_recons_zp005_cHW_normalised_13output_dim001.txt")
-eft_recon_error = np.loadtxt(vae_outputs + "vh_chw_zp005_recons_zp005_cHW_normalised_13output_dim001.txt")
-
-#sm_recon_error = np.loadtxt(vae_outputs + "vh_chw_zero_recons_zp005_cHW_normalised_13output_dim_1kbootstrap001.txt")
-#eft_recon_error = np.loadtxt(vae_outputs + "vh_chw_zp005_recons_zp005_cHW_normalised_13output_dim_1kbootstrap001.txt")
+if args.bootstrap:
+    bootstrap_files = error_files(vae_outputs, args.bootstrap_extension)
+    sm_recon_error = load_errors(bootstrap_files['SM'])
+    eft_recon_error = load_errors(bootstrap_files['EFT'])
+else:
+    sm_recon_error = load_errors(vae_outputs + "vh_chw_zero_recons_zp005_cHW_normalised_13output_dim001.txt")
+    eft_recon_error = load_errors(vae_outputs + "vh_chw_zp005_recons_zp005_cHW_normalised_13output_dim001.txt")
 
 # =========================== Find and plot pdf ================================
 extension = 'with_poisson_' + str(args.rcut) + 'Pcut_' + str(int(args.ntoys/1000)) + 'ktoys_general' + str(args.ext_num)
@@ -281,8 +326,8 @@ plt.savefig(plot_dir + "pdfs" + fig_specification + ".pdf")
 # Cut PDF
 cut_point = 0.5
 #eft_recon_error_cut = np.stack(list(eft_recon_error))
-sm_recon_error_cut = np.stack(list(sm_recon_error))
-mixed_sample_cut = np.stack(list(mixed_sample))
+sm_recon_error_cut = np.array(sm_recon_error)
+mixed_sample_cut = np.array(mixed_sample)
 #eft_recon_error_cut = np.delete(eft_recon_error_cut,np.where(eft_recon_error_cut < cut_point)[0])
 sm_recon_error_cut = np.delete(sm_recon_error_cut,np.where(sm_recon_error_cut < cut_point)[0])
 mixed_sample_cut = np.delete(mixed_sample_cut,np.where(mixed_sample_cut < cut_point)[0])
@@ -603,17 +648,32 @@ def run_toys_luminosity(luminosity, R_threshold, sm_cross_section, eft_cross_sec
     if cut_probs_pdf == True:
         N = mean_N_mixed_after_cut
         #sm_sample_toy_log_likelihoodsm, sm_sample_toy_log_likelihoodeft = sample_ll_from_toys(sm_reference_pdf_cut,sm_bins_centered_cut,mixed_reference_pdf_cut, N_toys = N_toys, N_toy_events = N0)
-        eft_sample_toy_log_likelihoodeft, eft_sample_toy_log_likelihoodsm = sample_ll_from_toys(mixed_reference_pdf_cut,mixed_bins_centered_cut, sm_reference_pdf_cut, N_toys = N_toys, N_toy_events = N)
+        toy_pdf, toy_bins, other_pdf = mixed_reference_pdf_cut, mixed_bins_centered_cut, sm_reference_pdf_cut
         #sm_sample_toy_log_likelihoodsm, sm_sample_toy_log_likelihoodeft = sample_ll_from_toys(sm_reference_pdf_cut,sm_bins_centered_cut,mixed_reference_pdf_cut, N_toys = N_toys, N_toy_events = N)
         #eft_sample_toy_log_likelihoodeft, eft_sample_toy_log_likelihoodsm = sample_ll_from_toys(mixed_reference_pdf_cut,mixed_bins_centered_cut, sm_reference_pdf_cut, N_toys = N_toys, N_toy_events = N)
 
     # If not cutting on probs PDF
     elif cut_probs_pdf != True:
         N = mean_N_toy_mixed_events
-        eft_sample_toy_log_likelihoodeft, eft_sample_toy_log_likelihoodsm = sample_ll_from_toys(mixed_reference_pdf,mixed_bins_centered, sm_reference_pdf, N_toys = N_toys, N_toy_events = N)
+        toy_pdf, toy_bins, other_pdf = mixed_reference_pdf, mixed_bins_centered, sm_reference_pdf
         #sm_sample_toy_log_likelihoodsm, sm_sample_toy_log_likelihoodeft = sample_ll_from_toys(sm_reference_pdf,sm_bins_centered,mixed_reference_pdf, N_toys = N_toys, N_toy_events = N)
         #eft_sample_toy_log_likelihoodeft, eft_sample_toy_log_likelihoodsm = sample_ll_from_toys(mixed_reference_pdf,mixed_bins_centered, sm_reference_pdf, N_toys = N_toys, N_toy_events = N)
 
+    if args.profile:
+        # Fit the number of signal events of each toy rather than fixing it to mu = N - b
+        alpha, nstdevs, mu_hat, mu_error = profile_test(other_pdf/np.sum(other_pdf), toy_pdf/np.sum(toy_pdf), float_mean_N_sm_after_cut,
+                                                        float_mean_N_mixed_after_cut, N_toys, np.random.default_rng())
+        print("Fitted mu:", np.mean(mu_hat), "+/-", np.mean(mu_error), "expected:", float_mean_N_mixed_after_cut - float_mean_N_sm_after_cut)
+        print("alpha:",alpha, "nstdevs:", nstdevs)
+        return alpha, nstdevs
+
+    if N_toys > 0:
+        eft_sample_toy_log_likelihoodeft, eft_sample_toy_log_likelihoodsm = sample_ll_from_toys(toy_pdf, toy_bins, other_pdf, N_toys = N_toys, N_toy_events = N)
+    if args.exact:
+        # The toys each have N events drawn from toy_pdf, so the average of the second term over them is
+        # N times its pdf-weighted average over one event
+        exact_LLR_second_term = expected_pdf_term(toy_pdf/np.sum(toy_pdf), log_pdf(other_pdf), log_pdf(toy_pdf), N)
+
     print("fraction of SM pdf remaining after cut:",sm_reference_pdf_cut.sum()*sm_bin_width)
     print("fraction of mixed pdf remaining after cut:",mixed_reference_pdf_cut.sum()*eft_bin_width)
 
@@ -667,13 +727,19 @@ def run_toys_luminosity(luminosity, R_threshold, sm_cross_section, eft_cross_sec
         LLR_list.append(LLR)
         LLR_second_term_list.append(LLR_second_term)
 
-    avg_LLR_second_term = np.average(LLR_second_term_list)
+    if args.exact:
+        if N_toys > 0:
+            print("Second LLR term: exact", exact_LLR_second_term, "toys", np.average(LLR_second_term_list))
+        avg_LLR_second_term = exact_LLR_second_term
+    else:
+        avg_LLR_second_term = np.average(LLR_second_term_list)
 
     #final_LLR = LLR_poisson + avg_LLR_second_term # Maybe just make this a minus
     final_LLR = LLR_poisson - avg_LLR_second_term
 
     # Plot
-    LLR_histo, LLR_bins = plot_llr(LLR_second_term_list, 'eft', N_toys = 10000, N_toy_events = (mean_N_toy_sm_events, mean_N_toy_mixed_events), R_threshold=R_threshold)
+    if N_toys > 0:
+        LLR_histo, LLR_bins = plot_llr(LLR_second_term_list, 'eft', N_toys = 10000, N_toy_events = (mean_N_toy_sm_events, mean_N_toy_mixed_events), R_threshold=R_threshold)
 
     print("LLR",LLR_poisson, avg_LLR_second_term, final_LLR, "N,b,s",N,b,mu)
 
@@ -740,6 +806,39 @@ plt.legend()
 plt.xlabel(r'$N_{eft}$')
 plt.ylabel(r'Significance $Z$')
 
+# =========================== Z vs cHW ============================================
+
+# The pdfs of the couplings between the simulated ones are morphed rather than simulated and reconstructed
+if args.morph:
+    morphing = CouplingMorphing.from_file(args.morph)
+    chw_arr = np.linspace(args.morph_couplings[0], args.morph_couplings[1], int(args.morph_couplings[2]))
+    morph_pdfs = morphing.pdf(chw_arr)
+    morph_cross_sections = morphing.cross_section(chw_arr)*1000
+    morph_sm_pdf = morphing.pdf(0.0)[0]
+    morph_sm_cross_section = morphing.cross_section(0.0)[0]*1000
+    print("Morphed SM cross section:", morph_sm_cross_section, "fb, known:", sm_cross_section, "fb")
+
+    rng = np.random.default_rng()
+    N_sm = args.morph_luminosity*detector_efficiency*morph_sm_cross_section
+    sm_log_pdf = log_pdf(morph_sm_pdf)
+    nstdevs_chw_list = []
+    for chw_pdf, chw_cross_section in zip(morph_pdfs, morph_cross_sections):
+        N_eft = args.morph_luminosity*detector_efficiency*chw_cross_section
+        _, nstdevs = general_test(bin_probabilities(chw_pdf, morphing.bins), sm_log_pdf, log_pdf(chw_pdf), N_sm, N_eft,
+                                    0 if args.exact else N_toys, rng)
+        nstdevs_chw_list.append(nstdevs)
+
+    extension_chw = str(args.morph_luminosity) + 'L' + extension
+    np.savetxt(array_dir + 'chwZvschw_arr' + extension_chw + '.txt', chw_arr)
+    np.savetxt(array_dir + 'cross_sectionZvschw_arr' + extension_chw + '.txt', morph_cross_sections)
+    np.savetxt(array_dir + 'nstdevsZvschw_arr' + extension_chw + '.txt', np.stack((nstdevs_chw_list)))
+
+    plt.figure()
+    plt.plot(chw_arr, nstdevs_chw_list, label = r'Morphed, $L = %s$ fb$^{-1}$' % args.morph_luminosity)
+    plt.legend()
+    plt.xlabel(r'$c_{HW}$')
+    plt.ylabel(r'Significance $Z$')
+
 # =========================== Z vs Pcut ===========================================
 """
 luminosity_arr = np.linspace(5,5,1)
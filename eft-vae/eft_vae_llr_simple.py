@@ -23,6 +23,8 @@ from numpy import log
 
 import seaborn as sns; sns.set(style="white", color_codes=True)
 
+from error_store import error_files, load_errors
+
 plt.close("all")
 
 # =========================== Take in arguments ================================
@@ -45,6 +47,16 @@ parser.add_argument("--ext_num",
                     default=999,
                     help="str: The extension number for the output files. Should take the form of 00x, 0xy, xyz.")
 
+parser.add_argument("--bootstrap",
+                    type=int,
+                    default=0,
+                    help="int: If 1, use the reconstruction errors of every bootstrap VAE saved by eft_vae_predictions_bootstrap.py (memory mapped from vae_outputs) rather than those of the single VAE. Default is 0.")
+
+parser.add_argument("--bootstrap_extension",
+                    type=str,
+                    default="_1000_bootstraps",
+                    help="str: The extension of the bootstrap run whose reconstruction errors are used with --bootstrap 1, as in the names eft_vae_predictions_bootstrap.py saves them with, e.g. '_100_bootstraps' or '_1000_bootstraps_warmstart5'. Default is '_1000_bootstraps'.")
+
 args = parser.parse_args()
 
 print("Rcut = " + str(args.rcut) + "ntoys = " + str(args.ntoys) + ", extension number = " + str(args.ext_num))
@@ -63,9 +75,14 @@ if not os.path.isdir(plot_dir): os.system('mkdir '+ plot_dir)
 if not os.path.isdir(model_dir): os.system('mkdir '+ model_dir)
 
 plt.close("all")
-sm_recon_error = np.loadtxt(vae_outputs + "vh_chw_zero_recons_zp005_cHW_normalised_001.txt")
-#sm_recon_error = np.loadtxt("vh_chw_zero_recons_zp005_cHW_normalised_001.txt")
-eft_recon_error = np.loadtxt(vae_outputs + "vh_chw_zp005_recons_zp005_cHW_normalised_001.txt")
+if args.bootstrap:
+    bootstrap_files = error_files(vae_outputs, args.bootstrap_extension)
+    sm_recon_error = load_errors(bootstrap_files['SM'])
+    eft_recon_error = load_errors(bootstrap_files['EFT'])
+else:
+    sm_recon_error = load_errors(vae_outputs + "vh_chw_zero_recons_zp005_cHW_normalised_001.txt")
+    #sm_recon_error = np.loadtxt("vh_chw_zero_recons_zp005_cHW_normalised_001.txt")
+    eft_recon_error = load_errors(vae_outputs + "vh_chw_zp005_recons_zp005_cHW_normalised_001.txt")
 
 # =========================== Find and plot pdf ================================
 extension = 'with_poisson_' + str(args.rcut) + 'Pcut_' + str(int(args.ntoys/1000)) + 'ktoys_simple' + str(args.ext_num)
@@ -272,8 +289,8 @@ plt.savefig(plot_dir + "pdfs" + fig_specification + ".pdf")
 # Cut PDF
 cut_point = 0.5
 #eft_recon_error_cut = np.stack(list(eft_recon_error))
-sm_recon_error_cut = np.stack(list(sm_recon_error))
-mixed_sample_cut = np.stack(list(mixed_sample))
+sm_recon_error_cut = np.array(sm_recon_error)
+mixed_sample_cut = np.array(mixed_sample)
 #eft_recon_error_cut = np.delete(eft_recon_error_cut,np.where(eft_recon_error_cut < cut_point)[0])
 sm_recon_error_cut = np.delete(sm_recon_error_cut,np.where(sm_recon_error_cut < cut_point)[0])
 mixed_sample_cut = np.delete(mixed_sample_cut,np.where(mixed_sample_cut < cut_point)[0])
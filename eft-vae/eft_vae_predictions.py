@@ -15,8 +15,15 @@ from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 
 import os
+import sys
 import random
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import StreamingMinMaxScaler, load_or_fit_scaler
+from vae_model import create_vae, create_scorer, reconstruction_errors
+
 plt.close("all")
 
 # =========================== Load and prepare data ============================
@@ -34,32 +41,29 @@ if not os.path.isdir(model_dir): os.system('mkdir '+ model_dir)
 plt.close("all")
 
 
-vh_chw_zero_df = pd.read_csv(data_dir + 'vh_chw_zero_100k.dat', sep="\s+", header=None)
-vh_chw_zp005_df = pd.read_csv(data_dir + 'vh_chw_zp005.dat', sep="\s+", header=None)
-vh_chw_zpz1_df = pd.read_csv(data_dir + 'vh_chw_zpz1.dat', sep="\s+", header=None)
-vh_chw_zpz3_df = pd.read_csv(data_dir + 'vh_chw_zpz3.dat', sep="\s+", header=None)
-vh_chw_zp1_df = pd.read_csv(data_dir + 'vh_chw_zp1.dat', sep="\s+", header=None)
+vh_chw_zero = load_events(data_dir + 'vh_chw_zero_100k.dat')
+vh_chw_zp005 = load_events(data_dir + 'vh_chw_zp005.dat')
+vh_chw_zpz1 = load_events(data_dir + 'vh_chw_zpz1.dat')
+vh_chw_zpz3 = load_events(data_dir + 'vh_chw_zpz3.dat')
+vh_chw_zp1 = load_events(data_dir + 'vh_chw_zp1.dat')
 
 # Drop signal column
-vh_chw_zero_df = vh_chw_zero_df.iloc[:,:-1]
-vh_chw_zp005_df = vh_chw_zp005_df.iloc[:,:-1]
-vh_chw_zpz1_df = vh_chw_zpz1_df.iloc[:,:-1]
-#vh_chw_zpz3_df = vh_chw_zpz3_df.iloc[:,:-1]
-vh_chw_zp1_df = vh_chw_zp1_df.iloc[:,:-1]
-
-scaler = preprocessing.MinMaxScaler()
-
-# Normalising SM and cHW 0.005 together
-vh_mixed_combined_df = vh_chw_zero_df.append(vh_chw_zp005_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
-
-vh_chw_zero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chw_zero_df.shape[0],:]
-vh_chw_zp005_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chw_zero_df.shape[0]:,:]
+vh_chw_zero = vh_chw_zero[:,:-1]
+vh_chw_zp005 = vh_chw_zp005[:,:-1]
+vh_chw_zpz1 = vh_chw_zpz1[:,:-1]
+#vh_chw_zpz3 = vh_chw_zpz3[:,:-1]
+vh_chw_zp1 = vh_chw_zp1[:,:-1]
+
+# Normalising SM and cHW 0.005 together, with the scaler saved next to the model so that a loaded model sees events scaled as in training
+scaler_file = model_dir + 'chw_zero_trained_model2_scaler.npy'
+if model_option == "load":
+    scaler = load_or_fit_scaler(scaler_file, [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
+else:
+    scaler = StreamingMinMaxScaler().fit_files([data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
+    scaler.save(scaler_file)
 
-vh_chw_zero = vh_chw_zero_df_normalised.to_numpy()
-vh_chw_zp005 = vh_chw_zp005_df_normalised.to_numpy()
+vh_chw_zero = scaler.transform(vh_chw_zero)
+vh_chw_zp005 = scaler.transform(vh_chw_zp005)
 
 x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3, random_state=42)
 x_test_vh_chw_zp005 = vh_chw_zp005
@@ -67,22 +71,12 @@ x_test_vh_chw_zp005 = vh_chw_zp005
 
 """
 # Normalising all together
-vh_mixed_combined_df = vh_chw_zero_df.append(vh_chw_zpz1_df)
-vh_mixed_combined_df = vh_mixed_combined_df.append(vh_chw_zpz3_df)
-vh_mixed_combined_df = vh_mixed_combined_df.append(vh_chw_zp1_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
+scaler = StreamingMinMaxScaler().partial_fit(np.concatenate((vh_chw_zero, vh_chw_zpz1, vh_chw_zpz3, vh_chw_zp1)))
 
-vh_chw_zero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chw_zero_df.shape[0],:]
-vh_chw_zpz1_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chw_zero_df.shape[0]:(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]),:]
-vh_chw_zpz3_df_normalised = vh_mixed_combined_df_normalised.iloc[(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]):(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]+vh_chw_zpz3_df.shape[0]),:]
-vh_chw_zp1_df_normalised = vh_mixed_combined_df_normalised.iloc[(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]+vh_chw_zpz3_df.shape[0]):,:]
-
-vh_chw_zero = vh_chw_zero_df_normalised.to_numpy()
-vh_chw_zpz1 = vh_chw_zpz1_df_normalised.to_numpy()
-vh_chw_zpz3 = vh_chw_zpz3_df_normalised.to_numpy()
-vh_chw_zp1 = vh_chw_zp1_df_normalised.to_numpy()
+vh_chw_zero = scaler.transform(vh_chw_zero)
+vh_chw_zpz1 = scaler.transform(vh_chw_zpz1)
+vh_chw_zpz3 = scaler.transform(vh_chw_zpz3)
+vh_chw_zp1 = scaler.transform(vh_chw_zp1)
 
 
 x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3, random_state=42)
@@ -111,50 +105,14 @@ intermediate_dim = 10
 final_dim = 5
 epochs = 50
 epsilon_std = 0.01
+# How events are scored: "sample" reconstructs from one sampled latent point as in training, "mean" from z_mean,
+# which is reproducible, and "draws" averages the errors of n_draws sampled latent points found in one predict
+scoring = "sample"
+n_draws = 10
 
 # ========================== Build VAE network =================================
 
-# Build model
-x = Input(shape=(original_dim,))
-
-h = Dense(intermediate_dim, activation='relu')(x)
-h = Dense(final_dim, activation = 'relu')(h)
-
-z_mean = Dense(latent_dim)(h)
-z_log_var = Dense(latent_dim)(h)
-
-def sampling(args):
-    z_mean, z_log_var = args
-    epsilon = K.random_normal(shape=(K.shape(z_mean)[0], latent_dim), mean=0.,
-                              stddev=epsilon_std)
-    return z_mean + K.exp(z_log_var / 2) * epsilon
-
-# Note that "output_shape" isn't necessary with the TensorFlow backend
-z = Lambda(sampling, output_shape=(latent_dim,))([z_mean, z_log_var])
-
-# We instantiate these layers separately so as to reuse them later
-decoder_f = Dense(final_dim, activation='relu')
-decoder_h = Dense(intermediate_dim, activation='relu')
-decoder_mean = Dense(original_dim, activation='sigmoid')
-
-f_decoded = decoder_f(z)
-h_decoded = decoder_h(f_decoded)
-x_decoded_mean = decoder_mean(h_decoded)
-x_decoded_img = Reshape(original_shape)(x_decoded_mean)
-
-
-# Instantiate VAE model
-vae = Model(x, x_decoded_img)
-
-
-# Compute VAE loss
-xent_loss = original_dim * metrics.binary_crossentropy(x, x_decoded_mean) # is using original_dim an arbitrary choice?
-kl_loss = - 0.5 * K.sum(1 + z_log_var - K.square(z_mean) - K.exp(z_log_var), axis=-1)
-vae_loss = K.mean(xent_loss + kl_loss)
-
-vae.add_loss(vae_loss)
-vae.compile(optimizer='rmsprop')
-vae.summary()
+vae = create_vae(original_shape, latent_dim, intermediate_dim, final_dim, epsilon_std)
 
 # ============================== Train VAE =====================================
 
@@ -218,7 +176,8 @@ This is just in case you cannot fit all the data in the CPU/GPU RAM at the same
 
 Keras has some problems - predictions should not depend on batch size but they actually do (to a small extent)
 """
-model_mse = lambda x: np.mean(np.square(x-vae.predict(x)), axis=1)
+scorer = create_scorer(vae, scoring, n_draws, epsilon_std)
+model_mse = lambda x: reconstruction_errors(scorer, x, batch_size=batch_size)
 
 x_train_reconerror = model_mse(x_train)
 x_test_reconerror = model_mse(x_test)
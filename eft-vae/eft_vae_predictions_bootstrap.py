@@ -15,51 +15,121 @@ from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 
 import os
+import sys
 import random
+import time
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from packed_ensemble import create_packed_vae, ReplicaBatches, packed_reconstruction_errors, replica_weights, set_replica_weights
+from pdf_spread import iteration_pdfs, save_and_compare
+from model_pool import ModelPool, EpochTimer, OverheadReport
+from weight_store import WeightStore
+from error_store import ErrorStore, error_files, finished_rows
+from shared_data import load_shared, source_key
+from event_cache import load_events
+from streaming_scaler import StreamingMinMaxScaler
+from vae_model import SCORING_MODES, create_scorer, reconstruction_errors
 
 plt.close("all")
 
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--n_iter",
+                    type=int,
+                    default=1000,
+                    help="int: The number of bootstrap iterations. Default is 1000.")
+
+parser.add_argument("--pack_size",
+                    type=int,
+                    default=1,
+                    help="int: The number of bootstrap VAEs trained together as one packed model. Default is 1, which trains them one after another.")
+
+parser.add_argument("--model_pool",
+                    type=int,
+                    default=1,
+                    help="int: If 1, build and compile each VAE once and reinitialise its weights and optimiser for each iteration, rather than building a new one each time (0). Default is 1.")
+
+parser.add_argument("--warm_start",
+                    type=int,
+                    default=0,
+                    help="int: If 1, train one base VAE and fine-tune every bootstrap VAE from it for fine_tune_epochs epochs, rather than training each from scratch (0). Default is 0.")
+
+parser.add_argument("--fine_tune_epochs",
+                    type=int,
+                    default=5,
+                    help="int: The number of epochs each VAE is fine-tuned for with warm_start. Default is 5.")
+
+parser.add_argument("--shared_data",
+                    type=int,
+                    default=1,
+                    help="int: If 1, prepare the data into shared memory once and have every job on the node attach to it, rather than each preparing its own copy (0). Default is 1.")
+
+parser.add_argument("--scoring",
+                    type=str,
+                    default="sample",
+                    choices=SCORING_MODES,
+                    help="str: How events are scored after training: 'sample' reconstructs from one sampled latent point as in training, 'mean' from z_mean, which is reproducible, and 'draws' averages the errors of n_draws sampled latent points found in one predict. Default is 'sample'.")
+
+parser.add_argument("--n_draws",
+                    type=int,
+                    default=10,
+                    help="int: The number of latent points per event averaged over with scoring 'draws'. Default is 10.")
+
+args = parser.parse_args()
+
 # =========================== Load and prepare data ============================
 
 data_dir = 'Data/'
 plot_dir = 'Plots_bootstrap/'
 model_dir = 'models_bootstrap/'
+output_dir = 'vae_outputs/'
 
 model_option = "save"
 
 fig_specification = 'regular_EFT_run2_combnorm'
 if not os.path.isdir(plot_dir): os.system('mkdir '+ plot_dir)
 if not os.path.isdir(model_dir): os.system('mkdir '+ model_dir)
+if not os.path.isdir(output_dir): os.system('mkdir '+ output_dir)
 
 plt.close("all")
 
 
-vh_chw_zero_df = pd.read_csv(data_dir + 'vh_chw_zero_100k.dat', sep="\s+", header=None)
-vh_chw_zp005_df = pd.read_csv(data_dir + 'vh_chw_zp005.dat', sep="\s+", header=None)
-vh_chw_zpz1_df = pd.read_csv(data_dir + 'vh_chw_zpz1.dat', sep="\s+", header=None)
-vh_chw_zpz3_df = pd.read_csv(data_dir + 'vh_chw_zpz3.dat', sep="\s+", header=None)
-vh_chw_zp1_df = pd.read_csv(data_dir + 'vh_chw_zp1.dat', sep="\s+", header=None)
+source_files = [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat', data_dir + 'vh_chw_zpz1.dat', data_dir + 'vh_chw_zpz3.dat', data_dir + 'vh_chw_zp1.dat']
 
-# Drop signal column
-vh_chw_zero_df = vh_chw_zero_df.iloc[:,:-1]
-vh_chw_zp005_df = vh_chw_zp005_df.iloc[:,:-1]
-vh_chw_zpz1_df = vh_chw_zpz1_df.iloc[:,:-1]
-#vh_chw_zpz3_df = vh_chw_zpz3_df.iloc[:,:-1]
-vh_chw_zp1_df = vh_chw_zp1_df.iloc[:,:-1]
+def prepare_data():
+    """
+    Read the events of every coupling and normalise the SM and cHW = 0.005 events
+    together, returning them and the per-feature min and max of the scaler.
+    """
+    vh_chw_zero = load_events(source_files[0])
+    vh_chw_zp005 = load_events(source_files[1])
+    vh_chw_zpz1 = load_events(source_files[2])
+    vh_chw_zpz3 = load_events(source_files[3])
+    vh_chw_zp1 = load_events(source_files[4])
 
-scaler = preprocessing.MinMaxScaler()
+    # Drop signal column
+    vh_chw_zero = vh_chw_zero[:,:-1]
+    vh_chw_zp005 = vh_chw_zp005[:,:-1]
+    vh_chw_zpz1 = vh_chw_zpz1[:,:-1]
+    #vh_chw_zpz3 = vh_chw_zpz3[:,:-1]
+    vh_chw_zp1 = vh_chw_zp1[:,:-1]
 
-# Normalising SM and cHW 0.005 together
-vh_mixed_combined_df = vh_chw_zero_df.append(vh_chw_zp005_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
+    # Normalising SM and cHW 0.005 together
+    scaler = StreamingMinMaxScaler().fit_files(source_files[:2])
 
-vh_chw_zero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chw_zero_df.shape[0],:]
-vh_chw_zp005_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chw_zero_df.shape[0]:,:]
+    vh_chw_zero = scaler.transform(vh_chw_zero)
+    vh_chw_zp005 = scaler.transform(vh_chw_zp005)
 
-vh_chw_zero = vh_chw_zero_df_normalised.to_numpy()
-vh_chw_zp005 = vh_chw_zp005_df_normalised.to_numpy()
+    return {'vh_chw_zero': vh_chw_zero, 'vh_chw_zp005': vh_chw_zp005, 'data_min': scaler.data_min_, 'data_max': scaler.data_max_}
+
+# Every job on the node attaches to one copy of the prepared data in shared memory
+prepared = load_shared('eft_vae_' + source_key(source_files), prepare_data, enabled=args.shared_data)
+vh_chw_zero, vh_chw_zp005 = prepared['vh_chw_zero'], prepared['vh_chw_zp005']
+scaler = StreamingMinMaxScaler(prepared['data_min'], prepared['data_max'])
 
 #x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3, random_state=42)
 #x_test_vh_chw_zp005 = vh_chw_zp005
@@ -67,22 +137,12 @@ vh_chw_zp005 = vh_chw_zp005_df_normalised.to_numpy()
 
 """
 # Normalising all together
-vh_mixed_combined_df = vh_chw_zero_df.append(vh_chw_zpz1_df)
-vh_mixed_combined_df = vh_mixed_combined_df.append(vh_chw_zpz3_df)
-vh_mixed_combined_df = vh_mixed_combined_df.append(vh_chw_zp1_df)
-vh_mixed_combined_df_normalised = pd.DataFrame(scaler.fit_transform(vh_mixed_combined_df),
-                             columns=vh_mixed_combined_df.columns,
-                             index=vh_mixed_combined_df.index)
-
-vh_chw_zero_df_normalised = vh_mixed_combined_df_normalised.iloc[:vh_chw_zero_df.shape[0],:]
-vh_chw_zpz1_df_normalised = vh_mixed_combined_df_normalised.iloc[vh_chw_zero_df.shape[0]:(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]),:]
-vh_chw_zpz3_df_normalised = vh_mixed_combined_df_normalised.iloc[(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]):(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]+vh_chw_zpz3_df.shape[0]),:]
-vh_chw_zp1_df_normalised = vh_mixed_combined_df_normalised.iloc[(vh_chw_zero_df.shape[0]+vh_chw_zpz1_df.shape[0]+vh_chw_zpz3_df.shape[0]):,:]
+scaler = StreamingMinMaxScaler().partial_fit(np.concatenate((vh_chw_zero, vh_chw_zpz1, vh_chw_zpz3, vh_chw_zp1)))
 
-vh_chw_zero = vh_chw_zero_df_normalised.to_numpy()
-vh_chw_zpz1 = vh_chw_zpz1_df_normalised.to_numpy()
-vh_chw_zpz3 = vh_chw_zpz3_df_normalised.to_numpy()
-vh_chw_zp1 = vh_chw_zp1_df_normalised.to_numpy()
+vh_chw_zero = scaler.transform(vh_chw_zero)
+vh_chw_zpz1 = scaler.transform(vh_chw_zpz1)
+vh_chw_zpz3 = scaler.transform(vh_chw_zpz3)
+vh_chw_zp1 = scaler.transform(vh_chw_zp1)
 
 
 x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3, random_state=42)
@@ -177,29 +237,151 @@ def create_model():
     return vae
 
 # ============================== Train VAE =====================================
-model_mse = lambda x: np.mean(np.square(x-vae.predict(x)), axis=1)
-x_train_reconerror_list = []
-x_test_reconerror_list = []
-x_test_vh_chw_zp005_reconerror_list = []
+# The scorer of a pooled VAE shares its layers, so it is built once and reused with it
+scorers = {}
+def model_mse(x):
+    if vae not in scorers:
+        scorers[vae] = create_scorer(vae, args.scoring, args.n_draws, epsilon_std)
+    return reconstruction_errors(scorers[vae], x, batch_size=10000)
+
+model_pools = {}
+packed_reconstructors = {}
+overheads = OverheadReport()
+
+def build_packed_vae(n_replicas):
+    vae, reconstructor = create_packed_vae(n_replicas, original_dim, final_dim, latent_dim, epsilon_std, args.scoring, args.n_draws)
+    # The reconstructor shares its layers with the VAE, so it is reinitialised along with it
+    packed_reconstructors[n_replicas] = reconstructor
+    return vae
+
+def get_model(n_replicas=0):
+    """
+    A freshly initialised VAE, or a packed model of n_replicas VAEs if n_replicas > 0,
+    from the model pools if they are used, and the time taken to get it.
+    """
+    start = time.time()
+    build = (lambda: build_packed_vae(n_replicas)) if n_replicas > 0 else create_model
+    if not args.model_pool:
+        return build(), time.time() - start
+    if n_replicas not in model_pools:
+        model_pools[n_replicas] = ModelPool(build)
+    return model_pools[n_replicas].get(), model_pools[n_replicas].setup_time
+
+def release_model():
+    # Pooled models are kept for the next iteration, otherwise clear model and memory
+    if not args.model_pool:
+        import gc
+        packed_reconstructors.clear()
+        scorers.clear()
+        K.clear_session()
+        gc.collect()
+        print("Cleared session and memory")
+
+def train_packed_vaes(n_replicas, first_iteration):
+    """
+    Train n_replicas bootstrap VAEs at once as a packed model, each on its own
+    train/test split of the SM events, and store the reconstruction errors of
+    each replica's test events and of the cHW 0.005 events. Each replica is fed
+    its own batches of its training events, in its own shuffled order, so it
+    takes as many steps per epoch as a VAE trained alone. The weights of the
+    replicas are stored as the iterations from first_iteration on.
+    """
+    splits = [train_test_split(np.arange(len(vh_chw_zero)), test_size=0.3) for k in range(n_replicas)]
+    train_indices = np.stack([train for train, test in splits])
+    test_indices = np.stack([test for train, test in splits])
+
+    start = time.time()
+    vae, setup_time = get_model(n_replicas)
+    reconstructor = packed_reconstructors[n_replicas]
+    if base_weights is not None:
+        set_replica_weights(vae, [base_weights]*n_replicas)
+    timer = EpochTimer()
+    history = vae.fit(ReplicaBatches(vh_chw_zero, train_indices, batch_size=batch_size, shuffle=True, seed=np.random.randint(2**31)),
+            epochs=iteration_epochs,
+            validation_data=ReplicaBatches(vh_chw_zero, test_indices, batch_size=batch_size),
+            callbacks=[timer])
+    overheads.add(setup_time, timer, time.time() - start)
+    for k in range(n_replicas):
+        weight_store.write(first_iteration + k, replica_weights(vae, k))
+
+    # Reconstruction errors of all replicas for the SM and cHW 0.005 events in one predict
+    reconerror = packed_reconstruction_errors(reconstructor, np.concatenate((vh_chw_zero, vh_chw_zp005)))
+    sm_reconerror = reconerror[:len(vh_chw_zero)]
+    vh_chw_zp005_reconerror = reconerror[len(vh_chw_zero):]
+
+    for k in range(n_replicas):
+        error_store.write(first_iteration + k, 'SM', sm_reconerror[test_indices[k], k])
+        error_store.write(first_iteration + k, 'EFT', vh_chw_zp005_reconerror[:,k])
+
+    del vae, reconstructor
+    release_model()
 
 if model_option == "save":
-    n_iterations = 1000
+    # The weights of every VAE are kept so that the ensemble can be rerun over any dataset with ensemble_predict.py
+    n_iterations = args.n_iter
+    extension = '_' + str(n_iterations) + '_bootstraps'
+    cold_start_extension = extension
+    if args.warm_start:
+        extension += '_warmstart' + str(args.fine_tune_epochs)
+    # Packed runs are kept apart from the sequential ones, which their PDF spread is compared with
+    if args.pack_size > 1:
+        extension += '_packed'
+    n_params = create_model().count_params()
+    K.clear_session()
+    weight_store = WeightStore(model_dir, extension, n_iterations, n_params, scaler)
+
+    # The test errors of every iteration are written into their row of one preallocated array per dataset,
+    # named by the extension of the run so that runs of other sizes, warm-started or packed are saved alongside rather than over each other
+    # train_test_split rounds the test size up
+    n_test = int(np.ceil(0.3*len(vh_chw_zero)))
+    error_paths = error_files(output_dir, extension)
+    error_store = ErrorStore({'SM': (error_paths['SM'], n_test), 'EFT': (error_paths['EFT'], len(vh_chw_zp005))}, n_iterations)
+
+    # Warm-started VAEs are fine-tuned from one base VAE trained on a split of its own
+    base_weights = None
+    iteration_epochs = epochs
+    if args.warm_start:
+        print("Training base VAE for warm-started bootstraps")
+        x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3)
+        vae, _ = get_model()
+        vae.fit(x_train, shuffle=True, epochs=epochs, batch_size=batch_size, validation_data=(x_test, None))
+        base_weights = vae.get_weights()
+        del vae
+        release_model()
+        iteration_epochs = args.fine_tune_epochs
+
+if model_option == "save" and args.pack_size > 1:
+    n_done = 0
+    while n_done < n_iterations:
+        n_replicas = min(args.pack_size, n_iterations - n_done)
+        print("bootstrap iterations", n_done+1, "to", n_done+n_replicas, "/", n_iterations, "packed together")
+        train_packed_vaes(n_replicas, n_done)
+        n_done += n_replicas
+
+elif model_option == "save":
     for i in range(n_iterations):
 
         x_train, x_test = train_test_split(vh_chw_zero, test_size=0.3)
         x_test_vh_chw_zp005 = vh_chw_zp005
 
-        vae = create_model()
+        iteration_start = time.time()
+        vae, setup_time = get_model()
+        if base_weights is not None:
+            vae.set_weights(base_weights)
         print("bootstrap iteration", i+1, "/", n_iterations)
 
+        timer = EpochTimer()
         history = vae.fit(x_train,
                 shuffle=True,
-                epochs=epochs,
+                epochs=iteration_epochs,
                 batch_size=batch_size,
-                validation_data=(x_test, None))
+                validation_data=(x_test, None),
+                callbacks=[timer])
                 # The validation_data previously used x_test_vh_chw_zpz3 - why would the anomaly data be used for the validation data?
                 # We still seems to be able to train well using x_test as validation data but it works just slightly better with
                 # x_test_vh_chw_zpz3 - however how could we use it in practice if we are wanting to find anomalies?
+        overheads.add(setup_time, timer, time.time() - iteration_start)
+        weight_store.write(i, vae.get_weights())
 
         # Plot training losses
         #plt.figure()
@@ -213,21 +395,13 @@ if model_option == "save":
 
         #vae.save_weights(model_dir + 'chw_zero_trained_model2.h5')
 
-        x_train_reconerror = model_mse(x_train)
-        x_test_reconerror = model_mse(x_test)
-        x_test_vh_chw_zp005_reconerror = model_mse(x_test_vh_chw_zp005)
+        error_store.write(i, 'SM', model_mse(x_test))
+        error_store.write(i, 'EFT', model_mse(x_test_vh_chw_zp005))
 
-        x_train_reconerror_list.append(x_train_reconerror)
-        x_test_reconerror_list.append(x_test_reconerror)
-        x_test_vh_chw_zp005_reconerror_list.append(x_test_vh_chw_zp005_reconerror)
+        release_model()
 
-        # Clear model and memory
-        from keras import backend as K
-        import gc
-        del vae
-        K.clear_session()
-        gc.collect()
-        print("Cleared session and memory")
+if model_option == "save":
+    overheads.report("Model pool" if args.model_pool else "New model per iteration")
 
 if model_option == "load":
     from keras.models import load_model
@@ -249,30 +423,19 @@ plt.title("latent space")
 plt.savefig("Plots/latentSpace.png")
 """
 # ============================ Find reconstruction PDF =======================
-print("SM LIST")
-print(x_test_reconerror_list)
-print("EFT LIST")
-print(x_test_vh_chw_zp005_reconerror_list)
-
-x_test_reconerror_array = np.array([])
-for array in x_test_reconerror_list:
-    x_test_reconerror_array = np.append(x_test_reconerror_array, array)
-
-x_test_vh_chw_zp005_reconerror_array = np.array([])
-for array in x_test_vh_chw_zp005_reconerror_list:
-    x_test_vh_chw_zp005_reconerror_array = np.append(x_test_vh_chw_zp005_reconerror_array, array)
-
-
-print(x_test_reconerror_array)
-print(x_test_vh_chw_zp005_reconerror_array)
-
-print(len(x_test_reconerror_list[0]))
-print(len(x_test_vh_chw_zp005_reconerror_list[0]))
-print(len(x_test_reconerror_array))
-print(len(x_test_vh_chw_zp005_reconerror_array))
-
-np.savetxt("vae_outputs/vh_chw_zero_recons_zp005_cHW_normalised_13output_dim_1kbootstrap001.txt",x_test_reconerror_array)
-np.savetxt("vae_outputs/vh_chw_zp005_recons_zp005_cHW_normalised_13output_dim_1kbootstrap001.txt",x_test_vh_chw_zp005_reconerror_array)
+x_test_reconerror_arr = finished_rows(error_store.arrays['SM'])
+x_test_vh_chw_zp005_reconerror_arr = finished_rows(error_store.arrays['EFT'])
+
+print("SM reconstruction errors (iterations, events):", x_test_reconerror_arr.shape)
+print(x_test_reconerror_arr)
+print("EFT reconstruction errors (iterations, events):", x_test_vh_chw_zp005_reconerror_arr.shape)
+print(x_test_vh_chw_zp005_reconerror_arr)
+
+# Keep the spread of the reconstruction error PDFs over the bootstraps, and compare warm-started or packed VAEs with the sequential cold-started run of the same size
+pdf_bins = np.linspace(-6, 0, 61)
+save_and_compare('arrays/iteration_pdfs' + extension + '.npz', 'arrays/iteration_pdfs' + cold_start_extension + '.npz' if extension != cold_start_extension else None, pdf_bins,
+                 {'SM': iteration_pdfs([np.log10(errors) for errors in x_test_reconerror_arr], pdf_bins),
+                  'EFT': iteration_pdfs([np.log10(errors) for errors in x_test_vh_chw_zp005_reconerror_arr], pdf_bins)})
 
 
 
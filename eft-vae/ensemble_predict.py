@@ -0,0 +1,91 @@
+#Purpose: Run every stored bootstrap VAE over a dataset of EFT events
+import sys, os
+import numpy as np
+
+from keras import backend as K
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from vae_model import SCORING_MODES
+from packed_ensemble import create_packed_vae, packed_reconstruction_errors, set_replica_weights
+from weight_store import load_weight_store, unflatten_weights, read_events, scale_events
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--extension",
+                    type=str,
+                    default="_1000_bootstraps",
+                    help="str: The extension of the bootstrap run whose models are to be used. Default is '_1000_bootstraps'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    default="Data/vh_chw_zp005.dat",
+                    help="str: The .dat file (or .npy array of unnormalised features) of events to predict on. Default is 'Data/vh_chw_zp005.dat'.")
+
+parser.add_argument("--output",
+                    type=str,
+                    default="",
+                    help="str: The .npy file the (n_models, n_events) matrix of reconstruction errors is written to. Default is arrays/ensemble_predictions + extension + .npy.")
+
+parser.add_argument("--models_per_pass",
+                    type=int,
+                    default=100,
+                    help="int: The number of models packed together and run side by side over each batch of events. Default is 100.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=10000,
+                    help="int: The number of events in each batch. Default is 10000.")
+
+parser.add_argument("--scoring",
+                    type=str,
+                    default="sample",
+                    choices=SCORING_MODES,
+                    help="str: How events are scored: 'sample' reconstructs from one sampled latent point as in training, 'mean' from z_mean, which is reproducible, and 'draws' averages the errors of n_draws sampled latent points found in one predict. Default is 'sample'.")
+
+parser.add_argument("--n_draws",
+                    type=int,
+                    default=10,
+                    help="int: The number of latent points per event averaged over with scoring 'draws'. Default is 10.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+model_dir = 'models_bootstrap/'
+
+# The settings of the bootstrap VAE in eft_vae_predictions_bootstrap.py
+latent_dim = 2
+epsilon_std = 0.01
+output = args.output if args.output != "" else 'arrays/ensemble_predictions' + args.extension + '.npy'
+
+weights_arr, data_min, data_max = load_weight_store(model_dir, args.extension)
+
+# The events are read and normalised once, with the scaler the models were trained with
+x_data = scale_events(read_events(args.data), data_min, data_max)
+n_models, n_events = len(weights_arr), len(x_data)
+print("Predicting with", n_models, "bootstrap models on", n_events, "events")
+
+predictions_matrix = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32, shape=(n_models, n_events))
+
+for start in range(0, n_models, args.models_per_pass):
+    pass_weights = weights_arr[start:start+args.models_per_pass]
+    original_dim = x_data.shape[1]
+    vae, reconstructor = create_packed_vae(len(pass_weights), original_dim, original_dim, latent_dim, epsilon_std, args.scoring, args.n_draws)
+    # The weights are set through the VAE, which holds every layer the reconstructor shares with it
+    shapes = [w.shape[1:] for w in vae.get_weights()]
+    set_replica_weights(vae, [unflatten_weights(flat_weights, shapes) for flat_weights in pass_weights])
+
+    # Each batch of events goes through every model of the pass in one forward pass
+    reconerror = packed_reconstruction_errors(reconstructor, x_data, batch_size=args.batch_size)
+    predictions_matrix[start:start+len(pass_weights)] = reconerror.T
+    predictions_matrix.flush()
+    print("Models", start+1, "to", start+len(pass_weights), "/", n_models, "done")
+
+    del vae, reconstructor
+    K.clear_session()
+
+print("Saved predictions to " + output)
@@ -0,0 +1,56 @@
+"""
+    Storage of the reconstruction errors of every bootstrap VAE of a run. The
+    errors of each dataset are preallocated as one memory mapped .npy file of
+    shape (n_iterations, n_events) and each iteration is written into its own
+    row as soon as it finishes, so nothing is ever appended to or reallocated,
+    and the LLR scripts memory map the file rather than parsing text. Rows of
+    iterations not yet written hold NaN, so a run can be read while it is still
+    going.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+def error_files(output_dir, extension):
+    """
+    The paths of the SM and cHW = 0.005 error arrays of the bootstrap run with the
+    given extension, such as '_1000_bootstraps' or '_100_bootstraps_warmstart5'.
+    """
+    return {'SM': output_dir + "vh_chw_zero_recons_zp005_cHW_normalised_13output_dim" + extension + ".npy",
+            'EFT': output_dir + "vh_chw_zp005_recons_zp005_cHW_normalised_13output_dim" + extension + ".npy"}
+
+class ErrorStore:
+    """
+    The reconstruction errors of one run, with datasets a dict of the name of each
+    dataset to the path of its .npy file and its number of events per iteration.
+    """
+    def __init__(self, datasets, n_iterations):
+        self.arrays = {}
+        for name, (path, n_events) in datasets.items():
+            self.arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_iterations, n_events))
+            self.arrays[name][:] = np.nan
+            self.arrays[name].flush()
+
+    def write(self, i, name, errors):
+        self.arrays[name][i] = errors
+        self.arrays[name].flush()
+
+def finished_rows(errors):
+    """
+    The rows of a memory mapped error array of the iterations that are written, as a view if all of them are.
+    """
+    done = ~np.isnan(errors[:,0])
+    return errors if np.all(done) else errors[done]
+
+def load_errors(path):
+    """
+    The reconstruction errors saved at path, as one flat array. An .npy file from an
+    ErrorStore is memory mapped, and holds the errors of the finished iterations one
+    after another, as the .txt files of earlier runs do.
+    """
+    if not path.endswith('.npy'):
+        return np.loadtxt(path)
+    errors = np.load(path, mmap_mode='r')
+    if errors.ndim == 1:
+        return errors
+    return np.ravel(finished_rows(errors))
@@ -0,0 +1,78 @@
+#Purpose: Export a trained VAE to a NumPy weight bundle and check that its NumPy reconstructions match Keras
+import os
+import sys
+import time
+import numpy as np
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+from numpy_inference import export_model, NumpyModel
+from vae_model import create_vae, create_scorer, reconstruction_errors
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--weights",
+                    type=str,
+                    default="models/chw_zero_trained_model2.h5",
+                    help="str: The weights of the VAE trained by eft_vae_predictions.py. Default is 'models/chw_zero_trained_model2.h5'.")
+
+parser.add_argument("--scaler",
+                    type=str,
+                    default="models/chw_zero_trained_model2_scaler.npy",
+                    help="str: The scaler saved with the VAE. If it does not exist one is fitted to the SM and cHW = 0.005 events as in training. Default is 'models/chw_zero_trained_model2_scaler.npy'.")
+
+parser.add_argument("--epsilon_std",
+                    type=float,
+                    default=0.01,
+                    help="float: The standard deviation of the noise of the sampling of the VAE, as in training. Default is 0.01.")
+
+parser.add_argument("--n_check",
+                    type=int,
+                    default=10000,
+                    help="int: The number of events of each class the NumPy and Keras reconstructions are compared on. Default is 10000.")
+
+parser.add_argument("--tolerance",
+                    type=float,
+                    default=1e-5,
+                    help="float: The largest absolute difference allowed between the NumPy and Keras reconstructions. Default is 1e-5.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+data_dir = 'Data/'
+output = os.path.splitext(args.weights)[0] + '.npz'
+
+paths = [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat']
+scaler = load_or_fit_scaler(args.scaler, paths)
+vae = create_vae((len(scaler.data_min_),), epsilon_std=args.epsilon_std, summary=False)
+vae.load_weights(args.weights)
+export_model(vae, output, epsilon_std=args.epsilon_std)
+print("Exported", args.weights, "to", output)
+
+# The VAE samples its latent point, so the reconstructions from z_mean are compared
+vae_mean = create_scorer(vae, 'mean')
+
+# Drop signal column
+x_check = scaler.transform(np.concatenate([load_events(path)[:args.n_check,:-1] for path in paths]))
+numpy_vae = NumpyModel(output)
+start = time.time()
+keras_recon = vae_mean.predict(x_check, batch_size=1000, verbose=0)
+keras_time = time.time() - start
+start = time.time()
+numpy_recon = numpy_vae.predict(x_check, batch_size=1000)
+numpy_time = time.time() - start
+
+difference = np.max(np.abs(numpy_recon - keras_recon))
+print("Largest difference from Keras over", len(x_check), "events:", difference)
+print("Prediction time: Keras {:.3f} s, NumPy {:.3f} s".format(keras_time, numpy_time))
+print("Mean reconstruction error with sampling: Keras {:.6g}, NumPy {:.6g}".format(
+      np.mean(reconstruction_errors(vae, x_check, batch_size=1000)),
+      np.mean(numpy_vae.reconstruction_errors(x_check, rng=np.random.default_rng()))))
+if difference > args.tolerance:
+    raise SystemExit("The NumPy reconstructions differ from Keras by more than " + str(args.tolerance))
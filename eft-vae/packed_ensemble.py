@@ -0,0 +1,184 @@
+"""
+    Packed ensemble of the bootstrap VAE: n_replicas independent encoders and
+    decoders held side by side in one keras model, so that many bootstrap VAEs
+    are trained in a single fit and their reconstruction errors come out of a
+    single predict. Every layer holds a separate kernel per replica and each
+    replica has its own KL and reconstruction loss. In training each replica is
+    fed its own batches, drawn in its own shuffled order from its own bootstrap
+    split, so it takes the same number of steps as a VAE trained alone.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+import tensorflow as tf
+
+import keras
+from keras.layers import Layer, Input, Lambda
+from keras.models import Model
+from keras import activations, initializers
+from keras import backend as K
+
+class PackedDense(Layer):
+    """
+    n_replicas independent Dense layers applied side by side. Takes inputs of shape
+    (batch, ..., n_replicas, input_dim), or (batch, input_dim) for an input shared by
+    all replicas, and returns outputs of shape (batch, ..., n_replicas, units).
+    """
+    def __init__(self, units, n_replicas, activation=None, **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+        self.n_replicas = n_replicas
+        self.activation = activations.get(activation)
+
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+        # The same Glorot uniform initialisation each replica would get as a single Dense layer
+        limit = np.sqrt(6.0/(input_dim + self.units))
+        self.kernel_initializer = initializers.RandomUniform(-limit, limit)
+        self.bias_initializer = initializers.get('zeros')
+        self.kernel = self.add_weight(name='kernel', shape=(self.n_replicas, input_dim, self.units),
+                                      initializer=self.kernel_initializer, trainable=True)
+        self.bias = self.add_weight(name='bias', shape=(self.n_replicas, self.units), initializer=self.bias_initializer, trainable=True)
+        super().build(input_shape)
+
+    def call(self, inputs):
+        if len(inputs.shape) == 2:
+            outputs = tf.einsum('bi,kio->bko', inputs, self.kernel)
+        else:
+            outputs = tf.einsum('...ki,kio->...ko', inputs, self.kernel)
+        return self.activation(outputs + self.bias)
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:max(len(input_shape) - 2, 1)]) + (self.n_replicas, self.units)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'units': self.units, 'n_replicas': self.n_replicas, 'activation': activations.serialize(self.activation)})
+        return config
+
+def create_packed_vae(n_replicas, original_dim, final_dim, latent_dim, epsilon_std, scoring='sample', n_draws=10):
+    """
+    Build n_replicas copies of the bootstrap VAE of eft_vae_predictions_bootstrap.py
+    as one model. Returns the model to train, which takes a batch of events per
+    replica, of shape (batch, n_replicas, original_dim), and a (batch, n_replicas)
+    weight of each event in its replica's loss, and a model sharing its layers that
+    maps events to the (n_events, n_replicas, original_dim) reconstructions of every
+    replica. The reconstructions are from a sampled latent point as in training
+    ('sample'), from z_mean ('mean'), or from n_draws sampled latent points, as
+    (n_events, n_draws, n_replicas, original_dim) ('draws'), as for create_scorer()
+    of vae_model.py.
+    """
+    x = Input(shape=(n_replicas, original_dim))
+    weights = Input(shape=(n_replicas,))
+    # The reconstructor runs every replica over the same events
+    x_shared = Input(shape=(original_dim,))
+
+    encoder_h = PackedDense(final_dim, n_replicas, activation='relu')
+    encoder_mean = PackedDense(latent_dim, n_replicas)
+    encoder_log_var = PackedDense(latent_dim, n_replicas)
+
+    h = encoder_h(x)
+    z_mean = encoder_mean(h)
+    z_log_var = encoder_log_var(h)
+
+    def sampling(args):
+        z_mean, z_log_var = args
+        epsilon = K.random_normal(shape=(K.shape(z_mean)[0], n_replicas, latent_dim), mean=0.,
+                                  stddev=epsilon_std)
+        return z_mean + K.exp(z_log_var / 2) * epsilon
+
+    z = Lambda(sampling, output_shape=(n_replicas, latent_dim))([z_mean, z_log_var])
+
+    decoder_f = PackedDense(final_dim, n_replicas, activation='relu')
+    decoder_mean = PackedDense(original_dim, n_replicas, activation='sigmoid')
+
+    f_decoded = decoder_f(z)
+    x_decoded_mean = decoder_mean(f_decoded)
+
+    vae = Model([x, weights], x_decoded_mean)
+    h_shared = encoder_h(x_shared)
+    z_mean_shared = encoder_mean(h_shared)
+    z_log_var_shared = encoder_log_var(h_shared)
+    if scoring == 'sample':
+        z_shared = Lambda(sampling, output_shape=(n_replicas, latent_dim))([z_mean_shared, z_log_var_shared])
+        reconstructor = Model(x_shared, decoder_mean(decoder_f(z_shared)))
+    elif scoring == 'mean':
+        reconstructor = Model(x_shared, decoder_mean(decoder_f(z_mean_shared)))
+    elif scoring == 'draws':
+        def draw(args):
+            z_mean, z_log_var = args
+            epsilon = K.random_normal(shape=(K.shape(z_mean)[0], n_draws, n_replicas, latent_dim), mean=0.,
+                                      stddev=epsilon_std)
+            return K.expand_dims(z_mean, 1) + K.expand_dims(K.exp(z_log_var / 2), 1) * epsilon
+
+        z_draws = Lambda(draw, output_shape=(n_draws, n_replicas, latent_dim))([z_mean_shared, z_log_var_shared])
+        reconstructor = Model(x_shared, decoder_mean(decoder_f(z_draws)))
+    else:
+        raise ValueError("scoring must be 'sample', 'mean' or 'draws'")
+
+    # Compute the VAE loss of each replica, as in the single VAE, averaged over the events in its own batch
+    x_decoded_clipped = K.clip(x_decoded_mean, K.epsilon(), 1.0 - K.epsilon())
+    xent_loss = -K.sum(x*K.log(x_decoded_clipped) + (1.0 - x)*K.log(1.0 - x_decoded_clipped), axis=-1)
+    kl_loss = - 0.5 * K.sum(1 + z_log_var - K.square(z_mean) - K.exp(z_log_var), axis=-1)
+    replica_loss = K.sum(weights*(xent_loss + kl_loss), axis=0)/K.maximum(K.sum(weights, axis=0), 1.0)
+    vae_loss = K.sum(replica_loss)
+
+    vae.add_loss(vae_loss)
+    vae.compile(optimizer='rmsprop')
+    vae.summary()
+
+    return vae, reconstructor
+
+class ReplicaBatches(keras.utils.Sequence):
+    """
+    Batches for a packed VAE trained on a separate set of events per replica.
+    indices has shape (n_replicas, n_events) and holds the events of each replica,
+    of which each batch takes batch_size per replica, giving the inputs of shape
+    (batch_size, n_replicas, n_features) and their weights. With shuffle every
+    replica goes through its events in its own random order, redrawn at the end
+    of every epoch.
+    """
+    def __init__(self, x_data, indices, batch_size=256, shuffle=False, seed=None):
+        super().__init__()
+        self.x_data = x_data
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(self.indices))]
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(self.indices.shape[1]/self.batch_size))
+
+    def __getitem__(self, batch):
+        batch_indices = self.order[:, batch*self.batch_size:(batch+1)*self.batch_size].T
+        # The VAE computes its own loss, so there are only inputs
+        return ((np.asarray(self.x_data[batch_indices], dtype=np.float32), np.ones(batch_indices.shape, dtype=np.float32)),)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.order = np.stack([rng.permutation(replica_indices) for rng, replica_indices in zip(self.rngs, self.indices)])
+        else:
+            self.order = self.indices
+
+def packed_reconstruction_errors(reconstructor, x, batch_size=10000):
+    """
+    Mean squared reconstruction error of every event for every replica, of shape (n_events, n_replicas),
+    averaged over the draws of a 'draws' reconstructor.
+    """
+    x_decoded = reconstructor.predict(x, batch_size=batch_size)
+    if x_decoded.ndim == 4:
+        return np.mean(np.square(x[:,None,None,:] - x_decoded), axis=(1, 3))
+    return np.mean(np.square(x[:,None,:] - x_decoded), axis=-1)
+
+def replica_weights(packed_model, k):
+    """
+    The weights of replica k, in the order and shapes model.get_weights() gives for a single unpacked model.
+    """
+    return [w[k] for w in packed_model.get_weights()]
+
+def set_replica_weights(packed_model, weight_lists):
+    """
+    Set the weights of every replica from a list, one per replica, of the weights of a single unpacked model.
+    """
+    packed_model.set_weights([np.stack([weights[j] for weights in weight_lists]) for j in range(len(weight_lists[0]))])
@@ -0,0 +1,115 @@
+#Purpose: Stream a trained VAE over EFT event files of any size, saving the reconstruction error of every event and the pdfs
+import os
+import sys
+import numpy as np
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from event_cache import load_events
+from streaming_scaler import load_or_fit_scaler
+from streaming_inference import IncrementalHistogram, stream_predict
+from numpy_inference import NumpyModel
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--weights",
+                    type=str,
+                    default="models/chw_zero_trained_model2.h5",
+                    help="str: The weights of the VAE trained by eft_vae_predictions.py, or its NumPy export (.npz) from export_numpy.py to reconstruct without TensorFlow. Default is 'models/chw_zero_trained_model2.h5'.")
+
+parser.add_argument("--scaler",
+                    type=str,
+                    default="models/chw_zero_trained_model2_scaler.npy",
+                    help="str: The scaler saved with the VAE. If it does not exist one is fitted to the SM and cHW = 0.005 events as in training. Default is 'models/chw_zero_trained_model2_scaler.npy'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    nargs='+',
+                    default=['Data/vh_chw_zero_100k.dat', 'Data/vh_chw_zp005.dat'],
+                    help="str: The .dat files to find the reconstruction errors of, each with a pdf of its own. Default is 'Data/vh_chw_zero_100k.dat Data/vh_chw_zp005.dat'.")
+
+parser.add_argument("--output_dir",
+                    type=str,
+                    default="arrays/",
+                    help="str: The directory the reconstruction errors and pdfs are saved to. Default is 'arrays/'.")
+
+parser.add_argument("--chunk_size",
+                    type=int,
+                    default=1000000,
+                    help="int: The number of events read and reconstructed at a time. Default is 1000000.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=0,
+                    help="int: The batch size of predict. Default is 0, which tunes it on the first chunk.")
+
+parser.add_argument("--n_bins",
+                    type=int,
+                    default=60,
+                    help="int: The number of bins of the pdfs, evenly spaced in log10 of the reconstruction error. Default is 60.")
+
+parser.add_argument("--log_range",
+                    type=float,
+                    nargs=2,
+                    default=[-6, 0],
+                    help="float: The range of log10 of the reconstruction error covered by the bins. Default is -6 0.")
+
+parser.add_argument("--scoring",
+                    type=str,
+                    default="sample",
+                    choices=['sample', 'mean', 'draws'],
+                    help="str: How events are scored: 'sample' reconstructs from one sampled latent point as in training, 'mean' from z_mean, which is reproducible, and 'draws' averages the errors of n_draws sampled latent points found in one predict. Default is 'sample'.")
+
+parser.add_argument("--n_draws",
+                    type=int,
+                    default=10,
+                    help="int: The number of latent points per event averaged over with scoring 'draws'. Default is 10.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+data_dir = 'Data/'
+os.makedirs(args.output_dir, exist_ok=True)
+tag = os.path.splitext(os.path.basename(args.weights))[0]
+if args.scoring != 'sample':
+    tag += '_' + args.scoring
+pdf_file = args.output_dir + 'stream_pdfs_' + tag + '.npz'
+
+scaler = load_or_fit_scaler(args.scaler, [data_dir + 'vh_chw_zero_100k.dat', data_dir + 'vh_chw_zp005.dat'])
+if args.weights.endswith('.npz'):
+    vae = NumpyModel(args.weights)
+    # NumpyModel reconstructs from z_mean unless given a generator to sample with
+    rng = None if args.scoring == 'mean' else np.random.default_rng()
+    n_draws = args.n_draws if args.scoring == 'draws' else 0
+else:
+    from vae_model import create_vae, create_scorer, reconstruction_errors
+    vae = create_vae((len(scaler.data_min_),), summary=False)
+    vae.load_weights(args.weights)
+    vae = create_scorer(vae, args.scoring, args.n_draws)
+
+class_names = [os.path.splitext(os.path.basename(path))[0] for path in args.data]
+histogram = IncrementalHistogram(np.linspace(args.log_range[0], args.log_range[1], args.n_bins + 1), n_classes=len(args.data), log=True)
+
+def predict_errors(x, batch_size):
+    if isinstance(vae, NumpyModel):
+        return vae.reconstruction_errors(x, batch_size, rng=rng, n_draws=n_draws)
+    return reconstruction_errors(vae, x, batch_size)
+
+batch_size = args.batch_size
+for label, path in enumerate(args.data):
+    # Drop signal column
+    events = load_events(path)[:,:-1]
+    output = args.output_dir + 'stream_reconerror_' + class_names[label] + '_' + tag + '.npy'
+    print("Reconstructing", len(events), "events of", path)
+    # The batch size tuned on the first file is kept for the rest
+    _, batch_size = stream_predict(predict_errors, events, output, chunk_size=args.chunk_size, batch_size=batch_size,
+                                   transform=scaler.transform, histogram=histogram, labels=label)
+    print("Saved reconstruction errors to", output)
+
+histogram.save(pdf_file, class_names)
+print("Saved pdfs to", pdf_file)
+print("Events outside the bins (below, above):", list(zip(class_names, histogram.underflow.tolist(), histogram.overflow.tolist())))
@@ -0,0 +1,111 @@
+"""
+    The VAE of eft_vae_predictions.py, built by a function so that a trained
+    VAE can be rebuilt and have its saved weights loaded by other scripts, and
+    the models used to score events with a trained VAE. The VAE samples its
+    latent point afresh on every predict, so besides scoring with the VAE
+    itself ('sample') events can be scored by decoding z_mean ('mean'), which
+    is reproducible and skips the noise, or by averaging the errors of n_draws
+    sampled latent points found in one predict ('draws').
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+from keras.layers import Input, Dense, Lambda, Reshape
+from keras.models import Model
+from keras import backend as K
+from keras import metrics
+
+from numpy_inference import vae_sections
+
+SCORING_MODES = ('sample', 'mean', 'draws')
+
+def create_vae(original_shape, latent_dim=2, intermediate_dim=10, final_dim=5, epsilon_std=0.01, summary=True):
+    """
+    The compiled VAE for inputs of the given shape.
+    """
+    original_dim = int(np.prod(original_shape))
+
+    # Build model
+    x = Input(shape=(original_dim,))
+
+    h = Dense(intermediate_dim, activation='relu')(x)
+    h = Dense(final_dim, activation = 'relu')(h)
+
+    z_mean = Dense(latent_dim)(h)
+    z_log_var = Dense(latent_dim)(h)
+
+    def sampling(args):
+        z_mean, z_log_var = args
+        epsilon = K.random_normal(shape=(K.shape(z_mean)[0], latent_dim), mean=0.,
+                                  stddev=epsilon_std)
+        return z_mean + K.exp(z_log_var / 2) * epsilon
+
+    # Note that "output_shape" isn't necessary with the TensorFlow backend
+    z = Lambda(sampling, output_shape=(latent_dim,))([z_mean, z_log_var])
+
+    # We instantiate these layers separately so as to reuse them later
+    decoder_f = Dense(final_dim, activation='relu')
+    decoder_h = Dense(intermediate_dim, activation='relu')
+    decoder_mean = Dense(original_dim, activation='sigmoid')
+
+    f_decoded = decoder_f(z)
+    h_decoded = decoder_h(f_decoded)
+    x_decoded_mean = decoder_mean(h_decoded)
+    x_decoded_img = Reshape(original_shape)(x_decoded_mean)
+
+
+    # Instantiate VAE model
+    vae = Model(x, x_decoded_img)
+
+
+    # Compute VAE loss
+    xent_loss = original_dim * metrics.binary_crossentropy(x, x_decoded_mean) # is using original_dim an arbitrary choice?
+    kl_loss = - 0.5 * K.sum(1 + z_log_var - K.square(z_mean) - K.exp(z_log_var), axis=-1)
+    vae_loss = K.mean(xent_loss + kl_loss)
+
+    vae.add_loss(vae_loss)
+    vae.compile(optimizer='rmsprop')
+    if summary:
+        vae.summary()
+
+    return vae
+
+def create_scorer(vae, scoring='sample', n_draws=10, epsilon_std=0.01):
+    """
+    The model, sharing its layers with the trained vae, whose reconstructions are scored.
+    With 'draws' it gives the (n_events, n_draws, original_dim) reconstructions of
+    n_draws latent points per event.
+    """
+    if scoring not in SCORING_MODES:
+        raise ValueError("scoring must be one of " + ", ".join(SCORING_MODES))
+    if scoring == 'sample':
+        return vae
+    sections = vae_sections(vae)
+    z = vae.layers[sections['z_mean'][0]].output
+    if scoring == 'draws':
+        z_log_var = vae.layers[sections['z_log_var'][0]].output
+        latent_dim = int(z.shape[-1])
+
+        def sampling(args):
+            z_mean, z_log_var = args
+            epsilon = K.random_normal(shape=(K.shape(z_mean)[0], n_draws, latent_dim), mean=0.,
+                                      stddev=epsilon_std)
+            return K.expand_dims(z_mean, 1) + K.expand_dims(K.exp(z_log_var / 2), 1) * epsilon
+
+        z = Lambda(sampling, output_shape=(n_draws, latent_dim))([z, z_log_var])
+    for i in sections['decoder']:
+        # The Reshape to the (flat) input shape would fold the draws together, and is not needed for scoring
+        if vae.layers[i].__class__.__name__ == 'Dense':
+            z = vae.layers[i](z)
+    return Model(vae.input, z)
+
+def reconstruction_errors(vae, x, batch_size=256):
+    """
+    The mean squared error of the reconstruction of each event, by the VAE or a model
+    from create_scorer(), averaged over the draws of a 'draws' scorer.
+    """
+    x_decoded = vae.predict(x, batch_size=batch_size, verbose=0)
+    if x_decoded.ndim == 3:
+        return np.mean(np.square(x[:,None,:] - x_decoded), axis=(1, 2))
+    return np.mean(np.square(x - x_decoded), axis=1)
@@ -4,14 +4,21 @@
 #Original Source: Taken from https://gist.github.com/ilmonteux
 #Modified By: Charanjit K. Khosa, University of Genova, Italy, Michael Soughton, University of Sussex, UK
 #Date: 09.02.2021
-import sys, os
+import sys, os, time
 import numpy as np
 from numpy import expand_dims
 
 import keras
-from keras.models import Sequential
-from keras.layers import Dense, Flatten, Dropout, Activation, Conv2D, MaxPooling2D
-from sklearn.model_selection import train_test_split
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from smearing import SmearedSequence, get_smear_mask
+from smear_cache import get_smeared_data
+from cnn_ensemble import create_model, flatten_weights, unflatten_weights
+from bootstrap_callbacks import ConvergenceMonitor
+from model_pool import ModelPool, EpochTimer, OverheadReport
+from bootstrap_store import BootstrapStore, bootstrap_split, validation_split, load_bootstrap_arrays, stored_settings
+from shared_data import load_shared, source_key
 
 data_dir = 'Data/'
 # =========================== Take in arguments ================================
@@ -37,7 +44,92 @@ parser.add_argument("--n_iter",
 parser.add_argument("--n_epoch",
                     type=int,
                     default=18,
-                    help="int: The number of training iterations. Default is 18.")
+                    help="int: The maximum number of training iterations. Default is 18.")
+
+parser.add_argument("--patience",
+                    type=int,
+                    default=3,
+                    help="int: Stop training once the validation loss has not improved for this many epochs, keeping the weights of the best epoch. 0 trains for all n_epoch epochs. Default is 3.")
+
+parser.add_argument("--abort_score",
+                    type=float,
+                    default=0.88,
+                    help="float: Abort an iteration once its validation accuracy can no longer be expected to reach this, the score bootstrap_analysis.py requires of an iteration. 0 never aborts. Default is 0.88.")
+
+parser.add_argument("--validation_fraction",
+                    type=float,
+                    default=0.1,
+                    help="float: The fraction of each iteration's training split held out to stop or abort training on, so that the test split is only used once training is over. Only held out if patience or abort_score is non-zero. Default is 0.1.")
+
+parser.add_argument("--abort_grace",
+                    type=int,
+                    default=3,
+                    help="int: The number of epochs every iteration is trained for before it can be aborted. Default is 3.")
+
+parser.add_argument("--data_workers",
+                    type=int,
+                    default=4,
+                    help="int: The number of threads preparing (and smearing) batches ahead of training. Default is 4.")
+
+parser.add_argument("--smear_cache",
+                    type=str,
+                    default="smear_cache/",
+                    help="str: Directory of the cache of smeared datasets, reused across iterations and runs. Pass '' to smear batch by batch instead. Default is 'smear_cache/'.")
+
+parser.add_argument("--cache_budget",
+                    type=float,
+                    default=20,
+                    help="float: The disk budget of the smeared dataset cache in GB, least recently used datasets are removed beyond it. Default is 20.")
+
+parser.add_argument("--n_workers",
+                    type=int,
+                    default=1,
+                    help="int: The number of worker processes the bootstrap iterations are shared between. Default is 1.")
+
+parser.add_argument("--intra_op_threads",
+                    type=int,
+                    default=0,
+                    help="int: The number of threads TensorFlow uses within each op in each worker. Default is 0, which is the number of cores divided by n_workers with more than one worker and the TensorFlow default otherwise.")
+
+parser.add_argument("--inter_op_threads",
+                    type=int,
+                    default=0,
+                    help="int: The number of ops TensorFlow runs in parallel in each worker. Default is 0, which is 1 with more than one worker and the TensorFlow default otherwise.")
+
+parser.add_argument("--seed",
+                    type=int,
+                    default=None,
+                    help="int: The seed that the random number stream of each bootstrap iteration is derived from. Default is None, which is a random seed.")
+
+parser.add_argument("--warm_start",
+                    type=int,
+                    default=0,
+                    help="int: If 1, train one base model for n_epoch epochs and fine-tune every bootstrap replica from it for fine_tune_epochs epochs, rather than training each replica from scratch (0). Default is 0.")
+
+parser.add_argument("--fine_tune_epochs",
+                    type=int,
+                    default=3,
+                    help="int: The maximum number of epochs each replica is fine-tuned for with warm_start. Default is 3.")
+
+parser.add_argument("--model_pool",
+                    type=int,
+                    default=1,
+                    help="int: If 1, build and compile the CNN once per process and reinitialise its weights and optimiser for each iteration, rather than building a new one each time (0). Default is 1.")
+
+parser.add_argument("--save_weights",
+                    type=int,
+                    default=1,
+                    help="int: Whether to store the weights of every bootstrap model (1) so that they can be rerun over any dataset with ensemble_predict.py, or not (0). Default is 1.")
+
+parser.add_argument("--shared_data",
+                    type=int,
+                    default=1,
+                    help="int: If 1, load the prepared data into shared memory once and have every job and worker on the node attach to it, rather than each loading its own copy (0). Default is 1.")
+
+parser.add_argument("--worker_id",
+                    type=int,
+                    default=-1,
+                    help="int: Set by the scheduler for the worker processes it launches, not to be set by hand.")
 
 args = parser.parse_args()
 
@@ -46,6 +138,34 @@ n_iterations = args.n_iter
 n_epochs = args.n_epoch
 print("Smear target = " + str(args.smear_target) + " sigma = " + str(smearing) + " n iterations = " + str(n_iterations))
 
+array_dir = 'bootstrap_arrays/'
+extension = str(args.smear_target) + '_' + str(smearing) + 'smeared_' + str(n_iterations) + '_bootstraps'
+if args.warm_start:
+    extension += '_warmstart' + str(args.fine_tune_epochs)
+os.makedirs(array_dir, exist_ok=True)
+
+# Each iteration gets its own random number stream derived from the seed, so results do not depend on how iterations are shared between workers.
+# A restarted run without --seed carries on with the seed it was started with
+if args.seed is None:
+    previous_settings = stored_settings(array_dir, extension)
+    if previous_settings is not None:
+        args.seed = previous_settings['seed']
+    else:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+# There is no point in having more workers than iterations
+args.n_workers = max(1, min(args.n_workers, n_iterations))
+
+# Pin the TensorFlow thread pools before any op is run. With several workers the cores are shared out between them
+if args.n_workers > 1:
+    if args.intra_op_threads == 0:
+        args.intra_op_threads = max(1, os.cpu_count()//args.n_workers)
+    if args.inter_op_threads == 0:
+        args.inter_op_threads = 1
+import tensorflow as tf
+tf.config.threading.set_intra_op_parallelism_threads(args.intra_op_threads)
+tf.config.threading.set_inter_op_parallelism_threads(args.inter_op_threads)
+
 # ==============================================================================
 
 def pad_image(image, max_size = (25,25)):
@@ -68,18 +188,6 @@ def normalize(histo, multi=255):
     """
     return (histo/np.max(histo)*multi).astype(int)
 
-from skimage import filters
-def blur_images_at_indices(images, indices, sigma):
-    images_copy = np.stack(list(images))
-    for idx,image in enumerate(images_copy):
-        if idx in indices:
-            blurred_image = filters.gaussian(image, sigma=(sigma,sigma), truncate=3.5, multichannel=True)
-            #print("blurring image",idx)
-            images_copy[idx,:,:,:] = blurred_image
-            # Renormalise blurred images
-            images_copy[idx,:,:,:] = images_copy[idx,:,:,:]/np.max(images_copy[idx,:,:,:])
-    return images_copy
-
 # Preparing the data is very memory intensive and won't run on the sussex cluster in a batch so prepare it beforehand
 prep_data = "load"
 if prep_data == "prepare":
@@ -139,8 +247,11 @@ if prep_data == "prepare":
 
 if prep_data == "load":
     print("Loading data")
-    x_data = np.load("prepped_x_data.npy")
-    y_data = np.load("prepped_y_data.npy")
+    # Every job and worker on the node attaches to one copy of the prepared data in shared memory
+    prepped_files = ["prepped_x_data.npy", "prepped_y_data.npy"]
+    prepped = load_shared('jet_cnn_' + source_key(prepped_files),
+                          lambda: {'x_data': np.load(prepped_files[0]), 'y_data': np.load(prepped_files[1])}, enabled=args.shared_data)
+    x_data, y_data = prepped['x_data'], prepped['y_data']
 
 print(x_data.shape)
 print(y_data.shape)
@@ -162,104 +273,184 @@ test_size = 1/3
 #print("y_test",y_test)
 
 
-def create_model():
-    model_cnn = Sequential()
-    #This is a first ConV layer, with 3 by 3 filter
-    model_cnn.add(Conv2D(30, (3, 3), input_shape=(25, 25, 1), activation='relu'))
-    #Second layer
-    model_cnn.add(Conv2D(30, (3, 3), activation='relu'))
-    model_cnn.add(MaxPooling2D(pool_size=(2, 2)))
-    model_cnn.add(Dropout(0.25))
-    #third layer
-    model_cnn.add(Conv2D(40, (3, 3), padding='same', activation='relu'))
-    model_cnn.add(Conv2D(40, (3, 3), padding='same', activation='relu'))
-    model_cnn.add(MaxPooling2D(pool_size=(2, 2)))
-    model_cnn.add(Dropout(0.3))
+def iteration_seed(i):
+    return int(np.random.SeedSequence(args.seed, spawn_key=(i,)).generate_state(1)[0])
 
-    model_cnn.add(Flatten())
-    #flatten layer with 300 nuerons
-    model_cnn.add(Dense(300, activation='relu'))
-    #model_cnn.add(Dropout(0.3))
-    model_cnn.add(Dense(2, activation='softmax'))
+def worker_log_file(worker_id):
+    return array_dir + 'worker' + str(worker_id) + '_' + extension + '.log'
 
-    # Compile model
-    model_cnn.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
-    return model_cnn
+def run_workers(n_workers):
+    """
+    Run the bootstrap iterations in n_workers copies of this script, each with its
+    own thread pool, writing its iterations straight into the shared bootstrap
+    store, and wait for them all to finish.
+    """
+    import subprocess
+    workers = []
+    for worker_id in range(n_workers):
+        command = [sys.executable] + sys.argv + ['--worker_id', str(worker_id), '--seed', str(args.seed),
+                                                 '--intra_op_threads', str(args.intra_op_threads), '--inter_op_threads', str(args.inter_op_threads)]
+        env = dict(os.environ, OMP_NUM_THREADS=str(args.intra_op_threads))
+        log_file = open(worker_log_file(worker_id), 'w')
+        print("Launching worker", worker_id, "log in", log_file.name)
+        workers.append((subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+    failed = []
+    for worker_id, (worker, log_file) in enumerate(workers):
+        if worker.wait() != 0:
+            failed.append(worker_id)
+        log_file.close()
+    if failed:
+        raise RuntimeError("Bootstrap workers " + str(failed) + " failed, see their logs in " + array_dir)
+
+pool = None
+overheads = OverheadReport()
+
+def get_model():
+    """
+    A freshly initialised CNN, from the model pool if it is used, and the time taken to get it.
+    """
+    global pool
+    start = time.time()
+    if not args.model_pool:
+        return create_model(), time.time() - start
+    if pool is None:
+        pool = ModelPool(create_model)
+    model_cnn = pool.get()
+    return model_cnn, pool.setup_time
+
+def release_model(model_cnn):
+    # The pooled model is kept for the next iteration, otherwise clear model and memory
+    if not args.model_pool:
+        from keras import backend as K
+        import gc
+        del model_cnn
+        K.clear_session()
+        gc.collect()
+        print("Cleared session and memory")
+
+def fit_model(seed, epochs, initial_weights=None, abort_score=0.0):
+    """
+    Train a CNN on the bootstrap split given by seed for at most the given number of
+    epochs, starting from initial_weights if given and from scratch otherwise.
+    """
+    start = time.time()
+    np.random.seed(seed % 2**32)
+    tf.random.set_seed(seed)
+    model_cnn, setup_time = get_model()
+    if initial_weights is not None:
+        model_cnn.set_weights(unflatten_weights(initial_weights, [w.shape for w in model_cnn.get_weights()]))
+    # Split the indices rather than the data so that x_data is never copied. Only the seed is stored,
+    # the split and y_test are rebuilt from it when the results are analysed
+    train_indices, test_indices = bootstrap_split(len(x_data), n_test, seed)
+    # Early stopping and aborting are decided on the last events of the training split, never on the test events they are scored on
+    validation_sequence = None
+    if args.patience > 0 or abort_score > 0:
+        train_indices, validation_indices = validation_split(train_indices, args.validation_fraction)
+        validation_sequence = SmearedSequence(x_source, y_data, validation_indices, smear_mask, smearing, batch_size=100)
+
+    train_sequence = SmearedSequence(x_source, y_data, train_indices, smear_mask, smearing, batch_size=100, shuffle=True, seed=seed)
+    test_sequence = SmearedSequence(x_source, y_data, test_indices, smear_mask, smearing, batch_size=100)
+
+    monitor = ConvergenceMonitor(epochs, patience=args.patience, abort_score=abort_score, abort_grace=args.abort_grace)
+    timer = EpochTimer()
+    history = model_cnn.fit(train_sequence, validation_data=validation_sequence, epochs=epochs, verbose=1, callbacks=[monitor, timer],
+                            workers=args.data_workers, use_multiprocessing=False, max_queue_size=2*args.data_workers)
+    overheads.add(setup_time, timer, time.time() - start)
+    print("Trained for", monitor.epochs_used, "/", epochs, "epochs" + (", aborted as it cannot reach a score of " + str(abort_score) if monitor.aborted else ""))
+    return model_cnn, monitor, test_indices, test_sequence
+
+def get_base_weights():
+    """
+    The weights of the base model that warm-started replicas are fine-tuned from. It is
+    trained once, on a split of its own, and saved for the workers and later restarts.
+    """
+    base_file = array_dir + 'base_weights' + extension + '.npy'
+    if os.path.exists(base_file):
+        return np.load(base_file)
+    print("Training base model for warm-started replicas")
+    # The stream after those of all the iterations
+    model_cnn, _, _, _ = fit_model(iteration_seed(n_iterations), n_epochs)
+    base_weights = flatten_weights(model_cnn)
+    np.save(base_file, base_weights)
+    release_model(model_cnn)
+    return base_weights
 
 
 # Do the bootstrap
 from sklearn.metrics import accuracy_score
 
-y_test_list = []
-predictions_list = []
-score_list = []
-for i in range(n_iterations):
-    model_cnn = create_model()
+# Each iteration is written to disk as soon as it is done, so a crashed or killed run can be restarted
+# with the same arguments and only the missing iterations are trained. The test set size is the same
+# for every iteration, as in train_test_split
+n_test = int(np.ceil(test_size*len(y_data)))
+n_params = 0
+if args.save_weights:
+    from keras import backend as K
+    n_params = create_model().count_params()
+    K.clear_session()
+# The settings that change the iterations but are not in the extension, which a restarted run must match
+settings = {'seed': args.seed, 'n_epoch': n_epochs, 'patience': args.patience, 'abort_score': args.abort_score, 'abort_grace': args.abort_grace,
+            'validation_fraction': args.validation_fraction}
+store = BootstrapStore(array_dir, extension, n_iterations, n_test, y_data.shape[1], n_params, settings)
+# The images to smear are fixed by their labels, the smearing itself is done batch by batch during training
+smear_mask = get_smear_mask(y_data, args.smear_target)
+if args.smear_target == "neither":
+    print("Not smearing either")
+else:
+    print("Smearing " + str(args.smear_target) + " with sigma = " + str(smearing))
+
+# With the cache each smeared variant of the dataset is made once and memory mapped, so there is nothing left to smear per batch
+x_source = x_data
+if args.smear_target != "neither" and smearing > 0 and args.smear_cache != "":
+    x_source = get_smeared_data(x_data, y_data, args.smear_target, smearing, cache_dir=args.smear_cache, disk_budget_gb=args.cache_budget)
+    smear_mask = None
+
+# Warm-started replicas are fine-tuned from one base model, trained here before any worker starts
+base_weights = None
+iteration_epochs = n_epochs
+if args.warm_start:
+    base_weights = get_base_weights()
+    iteration_epochs = args.fine_tune_epochs
+
+if args.n_workers > 1 and args.worker_id < 0:
+    # This process only schedules the workers, which write their results into the store themselves
+    del x_data, x_source
+    run_workers(args.n_workers)
+    print(store.n_done(), "/", n_iterations, "bootstrap iterations done by", args.n_workers, "workers")
+    store.report_training(iteration_epochs)
+    sys.exit(0)
+
+if args.worker_id >= 0:
+    iterations = list(range(args.worker_id, n_iterations, args.n_workers))
+else:
+    iterations = list(range(n_iterations))
+
+for i in iterations:
+    if store.is_done(i):
+        continue
+    seed = iteration_seed(i)
     print("bootstrap iteration", i+1)
-    x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=test_size)
-
-    qcd_train_indices = np.where(y_train[:,0]==1)[0]
-    top_train_indices = np.where(y_train[:,1]==1)[0]
-    both_train_indices = np.where(y_train[:,0]>=0)[0]
-
-    qcd_test_indices = np.where(y_test[:,0]==1)[0]
-    top_test_indices = np.where(y_test[:,1]==1)[0]
-    both_test_indices = np.where(y_test[:,0]>=0)[0]
-
-    # If jet type to smear is qcd, top or both, smear them appropriately
-    if args.smear_target != "neither":
-        if args.smear_target == "qcd":
-            train_indices = qcd_train_indices
-            test_indices = qcd_test_indices
-            print("Smearing QCD")
-        elif args.smear_target == "top":
-            train_indices = top_train_indices
-            test_indices = top_test_indices
-            print("Smearing Top")
-        elif args.smear_target == "both":
-            train_indices = both_train_indices
-            test_indices = both_test_indices
-            print("Smearing both")
-        x_train = blur_images_at_indices(x_train, train_indices, smearing)
-        x_test = blur_images_at_indices(x_test, test_indices, smearing)
-    elif args.smear_target == "neither":
-        print("Not smearing either")
-
-
-
-    history = model_cnn.fit(x_train, y_train, validation_data=(x_test,y_test), epochs=n_epochs, batch_size=100, shuffle=True, verbose=1)
-    predictions_cnn = model_cnn.predict(x_test)
-    y_test_list.append(y_test)
-    predictions_list.append(predictions_cnn)
+    model_cnn, monitor, test_indices, test_sequence = fit_model(seed, iteration_epochs, base_weights, args.abort_score)
+    y_test = y_data[test_indices]
+    predictions_cnn = model_cnn.predict(test_sequence, workers=args.data_workers, use_multiprocessing=False)
 
     score = accuracy_score(y_test, np.round(predictions_cnn))
-    score_list.append(score)
+    store.write(i, seed, predictions_cnn, score, flatten_weights(model_cnn) if args.save_weights else None,
+                epochs=monitor.epochs_used, aborted=monitor.aborted)
 
-    # Clear model and memory
-    from keras import backend as K
-    import gc
-    del model_cnn
-    K.clear_session()
-    gc.collect()
-    print("Cleared session and memory")
+    release_model(model_cnn)
 
 
-y_test_arr = np.stack((y_test_list))
-predictions_arr = np.stack((predictions_list))
-score_arr = np.stack((score_list))
+overheads.report("Model pool" if args.model_pool else "New model per iteration")
 
-array_dir = 'bootstrap_arrays/'
-extension = str(args.smear_target) + '_' + str(smearing) + 'smeared_' + str(n_iterations) + '_bootstraps'
-os.makedirs(array_dir, exist_ok=True)
+if args.worker_id >= 0:
+    sys.exit(0)
 
-np.save(array_dir + 'y_test_arr' + extension, y_test_arr)
-np.save(array_dir + 'predictions_arr' + extension, predictions_arr)
-np.save(array_dir + 'score_arr' + extension, score_arr)
+print(store.n_done(), "/", n_iterations, "bootstrap iterations done")
+store.report_training(iteration_epochs)
 
 # To load
-y_test_arr = np.load(array_dir + 'y_test_arr' + extension + '.npy')
-predictions_arr = np.load(array_dir + 'predictions_arr' + extension + '.npy')
-score_arr = np.load(array_dir + 'score_arr' + extension + '.npy')
+y_test_arr, predictions_arr, score_arr, done = load_bootstrap_arrays(array_dir, extension, y_data)
 
 """
 import matplotlib.pyplot as plt
@@ -1,26 +1,54 @@
 
 import sys, os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import pyplot
-import seaborn as sns; sns.set(style="white", color_codes=True)
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from bootstrap_store import load_bootstrap_arrays
+from bootstrap_pdfs import bootstrap_pdf_bands
+from pdf_spread import compare_pdf_spread
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--extension",
+                    type=str,
+                    default="_1000_bootstraps",
+                    help="str: The extension of the bootstrap arrays to analyse. Default is '_1000_bootstraps'.")
+
+parser.add_argument("--score_cut",
+                    type=float,
+                    default=0.88,
+                    help="float: Bootstrap iterations with an accuracy score at or below this are discarded as bad training. Default is 0.88.")
+
+parser.add_argument("--compare_extension",
+                    type=str,
+                    default="",
+                    help="str: The extension of a second run, such as the cold-start run matching a warm-start one, whose PDF spread is compared to this run's. Default is '', no comparison.")
+
+parser.add_argument("--plot",
+                    type=int,
+                    default=1,
+                    help="int: Whether to plot the score distribution and the bootstrap PDFs (1) or only print the results (0). Default is 1.")
+
+args = parser.parse_args()
+
+# ==============================================================================
 
 data_dir = 'Data/'
 array_dir = 'bootstrap_arrays/'
 
 
-extension = '_1000_bootstraps'
+extension = args.extension
 
-# To load
-y_test_arr = np.load(array_dir + 'y_test_arr' + extension + '.npy')
-predictions_arr = np.load(array_dir + 'predictions_arr' + extension + '.npy')
-score_arr = np.load(array_dir + 'score_arr' + extension + '.npy')
+# The labels of the dataset the CNN was trained on, from which the test labels of each iteration are rebuilt
+y_data = np.load("prepped_y_data.npy", mmap_mode='r')
 
-# Plot score distribution because it looks nice
-plt.close("all")
-plt.figure()
-plt.hist(score_arr, bins=40)
+# To load. Only the iterations done so far are read, so this can be run while training is still going
+y_test_arr, predictions_arr, all_scores, done = load_bootstrap_arrays(array_dir, extension, y_data)
+score_arr = np.asarray(all_scores)[done]
 
 # confidence intervals
 alpha = 0.95
@@ -30,113 +58,57 @@ p = (alpha+((1.0-alpha)/2.0)) * 100
 upper = min(1.0, np.percentile(score_arr, p))
 print('%.1f confidence interval %.1f%% and %.1f%%' % (alpha*100, lower*100, upper*100))
 
-# Get the top probs
-top_probs_list = []
-qcd_probs_list = []
-for i, (predictions, y_test) in enumerate(zip(predictions_arr, y_test_arr)):
-    #print("i",i)
-    y_top=predictions[:,1]
-
-    #print("y_top",y_top)
-    #print("y_test",y_test)
-
-    #ytestnew= y_test.flatten()
-
-    ytestone = np.argmax(y_test, axis=1)
-    #print("ytestone",ytestone)
-    #print("y_top.shape",y_top.shape)
-
-    top_probs = y_top[np.where(ytestone == 1)]
-    qcd_probs = y_top[np.where(ytestone == 0)]
-
-    top_probs_list.append(top_probs)
-    qcd_probs_list.append(qcd_probs)
-
-    #top_probs_arr[i,:] = top_probs
-
-    #np.savetxt("bootstrapped_top_probs001.txt",top_probs)
-    #np.savetxt("bootstrapped_qcd_probs001.txt",qcd_probs)
-
-
-# Plot PDFs
+# The bins run up to the smaller of the largest QCD and top probabilities of the last iteration done
 nbins = 100
-min_bin = min(np.min(qcd_probs), np.min(top_probs))
-max_bin = min(np.max(qcd_probs), np.max(top_probs))
-
-
-fig, ax = plt.subplots(1,1, figsize = (8,8))
-for i, (qcd_probs, top_probs) in enumerate(zip(qcd_probs_list, top_probs_list)):
-    print(i)
-    ax.hist(qcd_probs, bins = np.linspace(0, max_bin, nbins), label = 'QCD', density = True, alpha = 0.5)
-    ax.hist(top_probs, bins = np.linspace(0, max_bin, nbins), label = 'Top', density = True, alpha = 0.5)
-    #ax.hist(mixed_prob_values, bins = np.linspace(0, max_bin, nbins), label = 'Mixed', density = True, alpha = 0.5)
-    #ax.legend()
+last = np.flatnonzero(done)[-1]
+last_top_probs = predictions_arr[last][:,1]
+last_labels = np.argmax(y_test_arr[last], axis=1)
+max_bin = min(np.max(last_top_probs[last_labels == 0]), np.max(last_top_probs[last_labels == 1]))
+bins = np.linspace(0, max_bin, nbins)
+
+# Find the average PDF and its spread over the iterations that trained well, binning all predictions without plotting them
+pdf_bands = bootstrap_pdf_bands(predictions_arr, y_test_arr, all_scores, bins, score_cut=args.score_cut, done=done)
+print("Using", pdf_bands['n_used'], "/", pdf_bands['n_total'], "bootstrap iterations with a score above", args.score_cut)
+average_qcd_pdf, average_top_pdf = pdf_bands['mean']
+std_qcd_pdf, std_top_pdf = pdf_bands['std']
+qcd_bins_centered = pdf_bands['centers']
+top_bins_centered = pdf_bands['centers']
+
+# Compare the spread of the PDFs with that of another run, binned the same way
+if args.compare_extension != "":
+    reference_y_test_arr, reference_predictions_arr, reference_score_arr, reference_done = load_bootstrap_arrays(array_dir, args.compare_extension, y_data)
+    reference_pdf_bands = bootstrap_pdf_bands(reference_predictions_arr, reference_y_test_arr, reference_score_arr, bins, score_cut=args.score_cut, done=reference_done)
+    print("Compared to " + args.compare_extension + " (" + str(reference_pdf_bands['n_used']) + " iterations used):")
+    compare_pdf_spread(pdf_bands, reference_pdf_bands, bins, ('QCD', 'Top'))
+
+if args.plot:
+    import matplotlib.pyplot as plt
+    from matplotlib import pyplot
+    import seaborn as sns; sns.set(style="white", color_codes=True)
+
+    # Plot score distribution because it looks nice
+    plt.close("all")
+    plt.figure()
+    plt.hist(score_arr, bins=40)
+
+    # Plot the percentile bands of the pdfs over the bootstrap iterations
+    levels = list(pdf_bands['percentile_levels'])
+    fig, ax = plt.subplots(1,1, figsize = (8,8))
+    for c, label in enumerate(['QCD', 'Top']):
+        ax.fill_between(qcd_bins_centered, pdf_bands['percentiles'][0,c], pdf_bands['percentiles'][-1,c], step='mid', alpha=0.3,
+                        label = label + ' ' + str(levels[0]) + '-' + str(levels[-1]) + '%')
+        ax.step(qcd_bins_centered, pdf_bands['percentiles'][levels.index(50),c], where='mid', label = label + ' median')
+    ax.legend()
     ax.set_xlabel('P(Top Jet)')
     ax.set_title("QCD vs Top")
-    ax.set_xlim()
-
-
-# Same as above but not only for good scores
-qcd_pdf_list = []
-top_pdf_list = []
-score_list = score_arr.tolist()
-fig, ax = plt.subplots(1,1, figsize = (8,8))
-for i, (qcd_probs, top_probs, score) in enumerate(zip(qcd_probs_list, top_probs_list, score_list)):
-    # Discard bad training
-    if score > 0.88:
-        print(i)
-        qcd_pdf,qcd_bins,_ = ax.hist(qcd_probs, bins = np.linspace(0, max_bin, nbins), label = 'QCD', density = True, alpha = 0.5)
-        top_pdf,top_bins,_ = ax.hist(top_probs, bins = np.linspace(0, max_bin, nbins), label = 'Top', density = True, alpha = 0.5)
-        #ax.hist(mixed_prob_values, bins = np.linspace(0, max_bin, nbins), label = 'Mixed', density = True, alpha = 0.5)
-        #ax.legend()
-        ax.set_xlabel('P(Top Jet)')
-        ax.set_title("QCD vs Top")
-        ax.set_xlim()
-        qcd_pdf_list.append(qcd_pdf)
-        top_pdf_list.append(top_pdf)
-
-# Find average PDF
-qcd_pdf_arr = np.stack((qcd_pdf_list))
-top_pdf_arr = np.stack((top_pdf_list))
-average_qcd_pdf_list = []
-std_qcd_pdf_list = []
-average_top_pdf_list = []
-std_top_pdf_list = []
-for i in range(qcd_pdf_arr.shape[1]):
-    average_qcd_pdf = np.average(qcd_pdf_arr[:,i])
-    average_qcd_pdf_list.append(average_qcd_pdf)
-    std_qcd_pdf = np.sqrt(np.var(qcd_pdf_arr[:,i]))
-    std_qcd_pdf_list.append(std_qcd_pdf)
-
-    average_top_pdf = np.average(top_pdf_arr[:,i])
-    average_top_pdf_list.append(average_top_pdf)
-    std_top_pdf = np.sqrt(np.var(top_pdf_arr[:,i]))
-    std_top_pdf_list.append(std_top_pdf)
-
-average_qcd_pdf = np.stack((average_qcd_pdf_list))
-average_top_pdf = np.stack((average_top_pdf_list))
-std_qcd_pdf = np.stack((std_qcd_pdf_list))
-std_top_pdf = np.stack((std_top_pdf_list))
-
-# Center bins
-qcd_bins_centered = np.zeros(len(qcd_bins) - 1)
-for i in range(len(qcd_bins) - 1):
-    qcd_bins_centered[i] = (qcd_bins[i] + qcd_bins[i+1])/2
-
-top_bins_centered = np.zeros(len(top_bins) - 1)
-for i in range(len(top_bins) - 1):
-    top_bins_centered[i] = (top_bins[i] + top_bins[i+1])/2
-
-# Plot averaged pdfs
-fig, ax = plt.subplots(1,1, figsize = (8,8))
-#ax.hist(qcd_reference_pdf_cut, bins = np.linspace(0, max_bin, nbins), label = 'QCD', density = True, alpha = 0.5)
-#ax.hist(mixed_reference_pdf_cut, bins = np.linspace(0, max_bin, nbins), label = 'Mixed', density = True, alpha = 0.5)
-ax.bar(qcd_bins_centered, average_qcd_pdf, yerr=std_qcd_pdf, width=np.diff(qcd_bins_centered)[0], label = 'Average QCD PDF', alpha = 0.7)
-ax.bar(top_bins_centered, average_top_pdf, yerr=std_top_pdf, width=np.diff(qcd_bins_centered)[0], label = 'Average Top PDF', alpha = 0.7)
-ax.legend()
 
-# Hack the values back into prob values - I do this because the matplotlib bar chart looks a lot worse than the hist plot
-# Actually never mind it looks nice now
+    # Plot averaged pdfs
+    fig, ax = plt.subplots(1,1, figsize = (8,8))
+    #ax.hist(qcd_reference_pdf_cut, bins = np.linspace(0, max_bin, nbins), label = 'QCD', density = True, alpha = 0.5)
+    #ax.hist(mixed_reference_pdf_cut, bins = np.linspace(0, max_bin, nbins), label = 'Mixed', density = True, alpha = 0.5)
+    ax.bar(qcd_bins_centered, average_qcd_pdf, yerr=std_qcd_pdf, width=np.diff(qcd_bins_centered)[0], label = 'Average QCD PDF', alpha = 0.7)
+    ax.bar(top_bins_centered, average_top_pdf, yerr=std_top_pdf, width=np.diff(qcd_bins_centered)[0], label = 'Average Top PDF', alpha = 0.7)
+    ax.legend()
 
 
 # ============================== The same again but for smeared data ===========
@@ -279,5 +251,6 @@ np.savetxt("qcd_bins_centered_both_zp5smeared_1000bootstraps_" + str(nbins) + "b
 np.savetxt("top_bins_centered_both_zp5smeared_1000bootstraps_" + str(nbins) + "bins001.txt",smeared_top_bins_centered)
 """
 
-plt.ion()
-plt.show()
+if args.plot:
+    plt.ion()
+    plt.show()
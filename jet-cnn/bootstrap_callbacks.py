@@ -0,0 +1,68 @@
+"""
+    Keras callback that ends a bootstrap iteration as soon as its training has
+    converged, or as soon as it is clear that it will never reach the accuracy
+    score that bootstrap_analysis.py requires of an iteration to use it.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+import keras
+
+class ConvergenceMonitor(keras.callbacks.Callback):
+    """
+    Early stopping on the validation loss, with the weights of the epoch with the
+    lowest validation loss restored at the end of training however it ends.
+
+    With abort_score > 0 training is also aborted once abort_grace epochs have
+    passed if the best validation accuracy so far, plus its recent rate of
+    improvement carried on over all remaining epochs, still falls short of
+    abort_score. epochs_used and aborted are set once training ends.
+
+    The validation data must be held out of the training split rather than be the
+    test events, or the stored predictions and scores are chosen on the events
+    they are found on.
+    """
+    def __init__(self, n_epochs, patience=3, abort_score=0.88, abort_grace=3, window=3):
+        super().__init__()
+        self.n_epochs = n_epochs
+        self.patience = patience
+        self.abort_score = abort_score
+        self.abort_grace = abort_grace
+        self.window = window
+
+    def on_train_begin(self, logs=None):
+        self.best_loss = np.inf
+        self.best_weights = None
+        self.wait = 0
+        self.val_accuracies = []
+        self.epochs_used = 0
+        self.aborted = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        self.epochs_used = epoch + 1
+        val_loss = logs.get('val_loss')
+        if val_loss is not None and val_loss < self.best_loss:
+            self.best_loss = val_loss
+            self.best_weights = self.model.get_weights()
+            self.wait = 0
+        else:
+            self.wait += 1
+            if self.patience > 0 and self.wait >= self.patience:
+                self.model.stop_training = True
+
+        val_accuracy = logs.get('val_accuracy')
+        if self.abort_score > 0 and val_accuracy is not None:
+            self.val_accuracies.append(val_accuracy)
+            if self.epochs_used >= self.abort_grace:
+                window = min(self.window, len(self.val_accuracies) - 1)
+                rate = max(0.0, (self.val_accuracies[-1] - self.val_accuracies[-1-window])/window) if window > 0 else 0.0
+                reachable = max(self.val_accuracies) + rate*(self.n_epochs - self.epochs_used)
+                if reachable < self.abort_score:
+                    self.aborted = True
+                    self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
@@ -0,0 +1,89 @@
+"""
+    Bootstrap PDFs of the CNN predictions without matplotlib. The predictions of
+    many bootstrap iterations are binned at once with a single bincount per
+    chunk of iterations, streaming over the (possibly memory mapped)
+    predictions, and the per-bin mean and standard deviation of the PDFs are
+    accumulated with Welford's algorithm alongside per-bin percentile bands.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+class WelfordAccumulator:
+    """
+    Running mean and variance of rows of equal shape, updated a chunk of rows at a
+    time with the parallel form of Welford's algorithm.
+    """
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, rows):
+        if len(rows) == 0:
+            return
+        n = len(rows)
+        rows_mean = np.mean(rows, axis=0)
+        rows_m2 = np.sum(np.square(rows - rows_mean), axis=0)
+        delta = rows_mean - self.mean
+        total = self.count + n
+        self.mean = self.mean + delta*n/total
+        self.m2 = self.m2 + rows_m2 + np.square(delta)*self.count*n/total
+        self.count = total
+
+    def std(self):
+        # Population standard deviation, as np.var gives
+        return np.sqrt(self.m2/max(self.count, 1))
+
+def binned_pdfs(probs, labels, bins, n_classes=2):
+    """
+    PDFs of probs separately for each class, for many iterations at once. probs and
+    labels have shape (n_iterations, n_events) and the result has shape
+    (n_iterations, n_classes, len(bins) - 1). These are the same as the bar heights
+    of ax.hist(probs[i][labels[i] == c], bins=bins, density=True).
+    """
+    n_iterations = len(probs)
+    n_bins = len(bins) - 1
+    bin_indices = np.searchsorted(bins, probs, side='right') - 1
+    # As in np.histogram the last bin includes its right edge
+    bin_indices[probs == bins[-1]] = n_bins - 1
+    in_range = (bin_indices >= 0) & (bin_indices < n_bins)
+    flat_indices = (np.arange(n_iterations)[:,None]*n_classes + labels)*n_bins + bin_indices
+    counts = np.bincount(flat_indices[in_range], minlength=n_iterations*n_classes*n_bins)
+    counts = counts.reshape(n_iterations, n_classes, n_bins).astype(float)
+    totals = np.sum(counts, axis=-1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return counts/totals/np.diff(bins)
+
+def bootstrap_pdf_bands(predictions_arr, y_test_arr, score_arr, bins, score_cut=0.88, percentiles=(2.5, 16, 50, 84, 97.5), chunk_size=50, done=None):
+    """
+    Bin the top probabilities of every bootstrap iteration with a score above score_cut,
+    skipping those not marked in done if it is given, separately for QCD (label 0) and top (label 1) jets, reading chunk_size iterations
+    at a time. Returns a dictionary with the per-bin 'mean' and 'std' of the PDFs, the
+    per-bin 'percentiles' of the PDFs, all of shape (n_classes, n_bins) or
+    (n_percentiles, n_classes, n_bins), the bin 'centers' and the number of iterations
+    'n_used' and 'n_total' (of those done).
+    """
+    n_bins = len(bins) - 1
+    done = np.ones(len(score_arr), dtype=bool) if done is None else np.asarray(done, dtype=bool)
+    # Discard bad training, and the iterations not written yet
+    good_iterations = np.flatnonzero((np.asarray(score_arr) > score_cut) & done)
+    accumulator = WelfordAccumulator((2, n_bins))
+    # The PDFs themselves are small, so they are kept for the percentiles
+    pdf_list = []
+    for start in range(0, len(good_iterations), chunk_size):
+        chunk = good_iterations[start:start+chunk_size]
+        top_probs = np.stack([predictions_arr[i][:,1] for i in chunk])
+        labels = np.stack([np.argmax(y_test_arr[i], axis=1) for i in chunk])
+        pdfs = binned_pdfs(top_probs, labels, bins)
+        accumulator.update(pdfs)
+        pdf_list.append(pdfs)
+
+    if pdf_list:
+        pdf_percentiles = np.percentile(np.concatenate(pdf_list), percentiles, axis=0)
+    else:
+        pdf_percentiles = np.full((len(percentiles), 2, n_bins), np.nan)
+
+    return {'mean': accumulator.mean, 'std': accumulator.std(), 'percentiles': pdf_percentiles,
+            'percentile_levels': np.array(percentiles), 'centers': (bins[:-1] + bins[1:])/2,
+            'n_used': len(good_iterations), 'n_total': int(np.sum(done))}
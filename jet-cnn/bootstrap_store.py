@@ -0,0 +1,175 @@
+"""
+    Crash-safe storage of the bootstrap arrays. The predictions and score arrays
+    of a run are preallocated as memory mapped .npy files and each iteration is
+    written into its own row as soon as it finishes, followed by its flag in a
+    completion bitmap. A restarted run skips the iterations that are already
+    done, and the arrays can be read while training is still going. The
+    training settings of the run are kept in a sidecar .json file, and a run is
+    only resumed with the same settings. The test
+    set of each iteration is stored as the seed of its split, from which the
+    test indices and labels are rebuilt when needed.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import os
+import json
+import numpy as np
+
+def bootstrap_split(n_events, n_test, seed):
+    """
+    Split the event indices into train and test indices, with the test indices sorted.
+    This draws the same permutation as train_test_split with random_state=seed, but
+    from the legacy numpy generator directly, whose stream is fixed across numpy
+    versions, so a split can always be rebuilt from its seed.
+    """
+    permutation = np.random.RandomState(seed % 2**32).permutation(n_events)
+    return permutation[n_test:], np.sort(permutation[:n_test])
+
+def validation_split(train_indices, fraction):
+    """
+    Hold out the last fraction of the training indices of a split, which are in the
+    order of its seeded permutation, for validation. Returns the remaining training
+    indices and the validation indices.
+    """
+    n_validation = int(np.ceil(fraction*len(train_indices)))
+    return train_indices[:len(train_indices)-n_validation], train_indices[len(train_indices)-n_validation:]
+
+class BootstrapLabels:
+    """
+    The y_test of every bootstrap iteration, gathered from the dataset labels
+    y_data by the split seed of each iteration only when it is asked for.
+    """
+    def __init__(self, seed_arr, y_data, n_test):
+        self.seed_arr = seed_arr
+        self.y_data = y_data
+        self.n_test = n_test
+
+    def __len__(self):
+        return len(self.seed_arr)
+
+    def __getitem__(self, i):
+        _, test_indices = bootstrap_split(len(self.y_data), self.n_test, int(self.seed_arr[i]))
+        return self.y_data[test_indices]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def settings_path(array_dir, extension):
+    return array_dir + 'settings' + extension + '.json'
+
+def stored_settings(array_dir, extension):
+    """
+    The training settings a run was started with, or None if it has not been started.
+    """
+    path = settings_path(array_dir, extension)
+    if not os.path.exists(path):
+        return None
+    with open(path) as settings_file:
+        return json.load(settings_file)
+
+class BootstrapStore:
+    """
+    The bootstrap arrays of one run, stored in array_dir as 'seed_arr',
+    'predictions_arr', 'score_arr', 'epochs_arr', 'aborted_arr' and 'done_arr'
+    + extension + '.npy'. With
+    n_params > 0 the flattened float32 weights of the model trained in each
+    iteration are also kept, in 'weights_arr' + extension + '.npy'. settings are
+    the training settings not already in the extension, such as the seed and the
+    early stopping, saved in 'settings' + extension + '.json' together with n_iterations
+    and n_params. An interrupted run is resumed only if they are the same and its
+    arrays have the shapes of this run, and a ValueError is raised if not.
+    """
+    def __init__(self, array_dir, extension, n_iterations, n_test, n_classes=2, n_params=0, settings=None):
+        names = ['seed_arr', 'predictions_arr', 'score_arr', 'epochs_arr', 'aborted_arr', 'done_arr'] + (['weights_arr'] if n_params > 0 else [])
+        self.paths = {name: array_dir + name + extension + '.npy' for name in names}
+        shapes = {'seed_arr': (n_iterations,),
+                  'predictions_arr': (n_iterations, n_test, n_classes),
+                  'score_arr': (n_iterations,),
+                  'epochs_arr': (n_iterations,),
+                  'aborted_arr': (n_iterations,),
+                  'done_arr': (n_iterations,),
+                  'weights_arr': (n_iterations, n_params)}
+        dtypes = {'seed_arr': np.int64, 'predictions_arr': np.float32, 'score_arr': np.float64, 'epochs_arr': np.int32, 'aborted_arr': np.uint8, 'done_arr': np.uint8, 'weights_arr': np.float32}
+
+        # The number of iterations and of weights fix the shapes of the arrays, so they are part of the settings of the run
+        settings = dict(settings or {}, n_iterations=n_iterations, n_params=n_params)
+        # Reuse the arrays of an interrupted run, which must match this one, otherwise start from scratch
+        resume = os.path.exists(self.paths['done_arr'])
+        if resume:
+            # Iterations trained with different settings must not be mixed into one run
+            previous = stored_settings(array_dir, extension)
+            if previous != settings:
+                raise ValueError("The bootstrap run " + extension + " in " + array_dir + " was started with the settings " + str(previous)
+                                 + ", not " + str(settings) + ". Rerun with the same settings, or remove its arrays to start it again.")
+            for name, path in self.paths.items():
+                if not os.path.exists(path) or np.load(path, mmap_mode='r').shape != shapes[name]:
+                    raise ValueError("The bootstrap run " + extension + " in " + array_dir + " has no " + name + " of shape " + str(shapes[name])
+                                     + ". Remove its arrays to start it again.")
+        self.arrays = {}
+        for name, path in self.paths.items():
+            if resume:
+                self.arrays[name] = np.load(path, mmap_mode='r+')
+            else:
+                self.arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=dtypes[name], shape=shapes[name])
+        if resume:
+            print("Resuming bootstrap run,", int(np.sum(self.arrays['done_arr'])), "/", n_iterations, "iterations already done")
+        else:
+            with open(settings_path(array_dir, extension), 'w') as settings_file:
+                json.dump(settings, settings_file)
+
+    def is_done(self, i):
+        return bool(self.arrays['done_arr'][i])
+
+    def n_done(self):
+        return int(np.sum(self.arrays['done_arr']))
+
+    def report_training(self, n_epochs):
+        """
+        Print the epochs used and the number of aborted iterations over the iterations done so far.
+        """
+        done = self.arrays['done_arr'][:].astype(bool)
+        epochs_used = int(np.sum(self.arrays['epochs_arr'][done]))
+        n_aborted = int(np.sum(self.arrays['aborted_arr'][done]))
+        epochs_max = n_epochs*int(np.sum(done))
+        print("Trained", int(np.sum(done)), "iterations for", epochs_used, "/", epochs_max, "epochs (" + str(round(100*(1 - epochs_used/max(epochs_max, 1)), 1)) + "% saved),", n_aborted, "aborted")
+
+    def write(self, i, seed, predictions, score, weights=None, epochs=0, aborted=False):
+        """
+        Write iteration i, trained with the split given by seed for the given number of
+        epochs, and only then mark it as done, so that a crash part way through never
+        leaves a half written iteration flagged as complete.
+        """
+        self.arrays['seed_arr'][i] = seed
+        self.arrays['predictions_arr'][i] = predictions
+        self.arrays['score_arr'][i] = score
+        self.arrays['epochs_arr'][i] = epochs
+        self.arrays['aborted_arr'][i] = aborted
+        if 'weights_arr' in self.arrays:
+            self.arrays['weights_arr'][i] = weights
+        for name in self.arrays:
+            if name != 'done_arr':
+                self.arrays[name].flush()
+        self.arrays['done_arr'][i] = 1
+        self.arrays['done_arr'].flush()
+
+def load_bootstrap_arrays(array_dir, extension, y_data):
+    """
+    Memory map the bootstrap arrays of a run and return the y_test, predictions and
+    score of each iteration, with a boolean mask of the iterations done so far. The
+    arrays are not copied, so the iterations that are not done must be skipped using
+    the mask. y_data are the labels of the dataset the run was trained on, from which
+    y_test is rebuilt. Runs saved with a y_test_arr and without a completion bitmap,
+    from before the splits were stored as seeds, are done in full.
+    """
+    predictions_arr = np.load(array_dir + 'predictions_arr' + extension + '.npy', mmap_mode='r')
+    score_arr = np.load(array_dir + 'score_arr' + extension + '.npy', mmap_mode='r')
+    y_test_path = array_dir + 'y_test_arr' + extension + '.npy'
+    if os.path.exists(y_test_path):
+        return np.load(y_test_path, mmap_mode='r'), predictions_arr, score_arr, np.ones(len(score_arr), dtype=bool)
+
+    done = np.load(array_dir + 'done_arr' + extension + '.npy').astype(bool)
+    print(int(np.sum(done)), "/", len(done), "bootstrap iterations done")
+    seed_arr = np.load(array_dir + 'seed_arr' + extension + '.npy', mmap_mode='r')
+    y_tests = BootstrapLabels(seed_arr, y_data, predictions_arr.shape[1])
+    return y_tests, predictions_arr, score_arr, done
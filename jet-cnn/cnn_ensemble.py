@@ -0,0 +1,62 @@
+"""
+    The bootstrap CNN and an ensemble of copies of it sharing one input, so that
+    every stored bootstrap model can be run over a dataset with each batch of
+    images read once for many models. The weights of each model are stored as
+    one flat float32 vector, in the order of model.get_weights().
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+
+from keras.models import Sequential, Model
+from keras.layers import Input, Dense, Flatten, Dropout, Conv2D, MaxPooling2D
+
+def create_model():
+    model_cnn = Sequential()
+    #This is a first ConV layer, with 3 by 3 filter
+    model_cnn.add(Conv2D(30, (3, 3), input_shape=(25, 25, 1), activation='relu'))
+    #Second layer
+    model_cnn.add(Conv2D(30, (3, 3), activation='relu'))
+    model_cnn.add(MaxPooling2D(pool_size=(2, 2)))
+    model_cnn.add(Dropout(0.25))
+    #third layer
+    model_cnn.add(Conv2D(40, (3, 3), padding='same', activation='relu'))
+    model_cnn.add(Conv2D(40, (3, 3), padding='same', activation='relu'))
+    model_cnn.add(MaxPooling2D(pool_size=(2, 2)))
+    model_cnn.add(Dropout(0.3))
+
+    model_cnn.add(Flatten())
+    #flatten layer with 300 nuerons
+    model_cnn.add(Dense(300, activation='relu'))
+    #model_cnn.add(Dropout(0.3))
+    model_cnn.add(Dense(2, activation='softmax'))
+
+    # Compile model
+    model_cnn.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+    return model_cnn
+
+def flatten_weights(model):
+    return np.concatenate([np.ravel(w) for w in model.get_weights()]).astype(np.float32)
+
+def unflatten_weights(flat_weights, shapes):
+    """
+    Split a flat weight vector back into arrays of the given shapes, for model.set_weights().
+    """
+    weights = []
+    start = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        weights.append(np.reshape(flat_weights[start:start+size], shape))
+        start += size
+    return weights
+
+def create_ensemble(n_models):
+    """
+    n_models copies of the CNN applied to the same input. Returns the ensemble,
+    whose predict gives a list of the (n_events, 2) predictions of each copy,
+    and the copies themselves to set the weights of.
+    """
+    x = Input(shape=(25, 25, 1))
+    models = [create_model() for _ in range(n_models)]
+    ensemble = Model(x, [model(x) for model in models])
+    return ensemble, models
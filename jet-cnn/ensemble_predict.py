@@ -0,0 +1,89 @@
+#Purpose: Run every stored bootstrap CNN over a dataset of jet images
+import sys, os
+import numpy as np
+
+from keras import backend as K
+
+from cnn_ensemble import create_ensemble, unflatten_weights
+from bootstrap_store import bootstrap_split
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--extension",
+                    type=str,
+                    default="neither_0.0smeared_1000_bootstraps",
+                    help="str: The extension of the bootstrap run whose models are to be used. Default is 'neither_0.0smeared_1000_bootstraps'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    default="prepped_x_data.npy",
+                    help="str: The .npy file of jet images of shape (n_events, 25, 25, 1) to predict on. Default is 'prepped_x_data.npy'.")
+
+parser.add_argument("--output",
+                    type=str,
+                    default="",
+                    help="str: The .npy file the (n_models, n_events) matrix of top probabilities is written to. Default is bootstrap_arrays/ensemble_predictions_ + extension + .npy.")
+
+parser.add_argument("--models_per_pass",
+                    type=int,
+                    default=20,
+                    help="int: The number of models run side by side over each batch of images. Default is 20.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=1000,
+                    help="int: The number of images in each batch. Default is 1000.")
+
+parser.add_argument("--out_of_bag",
+                    type=int,
+                    default=0,
+                    help="int: If 1, the data is the dataset the models were trained on and each model's predictions for its own training events are set to NaN, leaving only out-of-bag predictions. Default is 0.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+array_dir = 'bootstrap_arrays/'
+extension = args.extension
+output = args.output if args.output != "" else array_dir + 'ensemble_predictions_' + extension + '.npy'
+
+# Only the models of completed iterations are used
+done = np.load(array_dir + 'done_arr' + extension + '.npy').astype(bool)
+model_indices = np.flatnonzero(done)
+weights_arr = np.load(array_dir + 'weights_arr' + extension + '.npy', mmap_mode='r')
+seed_arr = np.load(array_dir + 'seed_arr' + extension + '.npy')
+n_test = np.load(array_dir + 'predictions_arr' + extension + '.npy', mmap_mode='r').shape[1]
+
+x_data = np.load(args.data, mmap_mode='r')
+n_models, n_events = len(model_indices), len(x_data)
+print("Predicting with", n_models, "bootstrap models on", n_events, "events")
+
+predictions_matrix = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32, shape=(n_models, n_events))
+
+for start in range(0, n_models, args.models_per_pass):
+    pass_indices = model_indices[start:start+args.models_per_pass]
+    ensemble, models = create_ensemble(len(pass_indices))
+    shapes = [w.shape for w in models[0].get_weights()]
+    for model, i in zip(models, pass_indices):
+        model.set_weights(unflatten_weights(weights_arr[i], shapes))
+
+    # Each batch of images is read once and run through every model of the pass
+    for batch_start in range(0, n_events, args.batch_size):
+        x_batch = np.array(x_data[batch_start:batch_start+args.batch_size], dtype=float)
+        predictions = ensemble.predict_on_batch(x_batch)
+        predictions_matrix[start:start+len(pass_indices), batch_start:batch_start+len(x_batch)] = np.stack([np.asarray(p)[:,1] for p in predictions])
+
+    if args.out_of_bag:
+        for row, i in enumerate(pass_indices):
+            train_indices, _ = bootstrap_split(n_events, n_test, int(seed_arr[i]))
+            predictions_matrix[start+row, train_indices] = np.nan
+
+    predictions_matrix.flush()
+    print("Models", start+1, "to", start+len(pass_indices), "/", n_models, "done")
+    del ensemble, models
+    K.clear_session()
+
+print("Saved predictions to " + output)
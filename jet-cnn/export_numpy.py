@@ -0,0 +1,60 @@
+#Purpose: Export a trained CNN to a NumPy weight bundle and check that its NumPy predictions match Keras
+import os
+import sys
+import time
+import numpy as np
+
+import keras
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from numpy_inference import export_model, NumpyModel
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--model",
+                    type=str,
+                    default="model_cnn/cnn005.h5",
+                    help="str: The trained CNN. Default is 'model_cnn/cnn005.h5'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    default="prepped_x_data.npy",
+                    help="str: The .npy array of prepared jet images the predictions are compared on. Default is 'prepped_x_data.npy'.")
+
+parser.add_argument("--n_check",
+                    type=int,
+                    default=10000,
+                    help="int: The number of jets the NumPy and Keras predictions are compared on. Default is 10000.")
+
+parser.add_argument("--tolerance",
+                    type=float,
+                    default=1e-4,
+                    help="float: The largest absolute difference allowed between the NumPy and Keras predictions. Default is 1e-4.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+output = os.path.splitext(args.model)[0] + '.npz'
+
+model_cnn = keras.models.load_model(args.model)
+export_model(model_cnn, output)
+print("Exported", args.model, "to", output)
+
+x_check = np.asarray(np.load(args.data, mmap_mode='r')[:args.n_check], dtype=np.float32)
+start = time.time()
+keras_pred = model_cnn.predict(x_check, batch_size=1000, verbose=0)
+keras_time = time.time() - start
+start = time.time()
+numpy_pred = NumpyModel(output).predict(x_check, batch_size=1000)
+numpy_time = time.time() - start
+
+difference = np.max(np.abs(numpy_pred - keras_pred))
+print("Largest difference from Keras over", len(x_check), "jets:", difference)
+print("Prediction time: Keras {:.3f} s, NumPy {:.3f} s".format(keras_time, numpy_time))
+if difference > args.tolerance:
+    raise SystemExit("The NumPy predictions differ from Keras by more than " + str(args.tolerance))
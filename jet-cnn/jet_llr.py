@@ -16,6 +16,7 @@ from scipy.stats import norm
 from scipy import integrate
 import random
 import os
+import sys
 from keras.layers import Input, Dense, Lambda, Flatten, Reshape
 from keras.models import Model
 from keras import backend as K
@@ -23,6 +24,10 @@ from keras import metrics
 
 import seaborn as sns; sns.set(style="white", color_codes=True)
 
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from llr_engine import mixture_pdfs, rate_scan, multi_hypothesis_test
+
 # =========================== Take in arguments ================================
 import argparse
 
@@ -43,6 +48,29 @@ parser.add_argument("--ext_num",
                     default=999,
                     help="str: The extension number for the output files. Should take the form of 00x, 0xy, xyz.")
 
+parser.add_argument("--scan_cross_sections",
+                    type=float,
+                    nargs=3,
+                    default=None,
+                    help="float: The first and last top cross section and number of top cross sections to find the significance of at --scan_luminosity, all from one set of toys, with the QCD cross section kept. Default is None, which skips the scan.")
+
+parser.add_argument("--alternatives",
+                    type=str,
+                    nargs='+',
+                    default=None,
+                    help="str: Files of the pdfs of other signal samples, over the same bins as the top pdf in cnn_outputs, each tested mixed with QCD at its cross section in --alternative_cross_sections alongside top, all against one set of QCD toys at --scan_luminosity. Default is None.")
+
+parser.add_argument("--alternative_cross_sections",
+                    type=float,
+                    nargs='+',
+                    default=[],
+                    help="float: The cross section of each file of --alternatives, in the units of the top cross section. Default is none.")
+
+parser.add_argument("--scan_luminosity",
+                    type=float,
+                    default=2.0,
+                    help="float: The luminosity of the scan of top cross sections and of the test of --alternatives. Default is 2.0.")
+
 args = parser.parse_args()
 
 print("Pcut = " + str(args.pcut) + "ntoys = " + str(args.ntoys) + ", extension number = " + str(args.ext_num))
@@ -916,6 +944,50 @@ else:
     #plt.ylim(0,10)
 """
 
+# =========================== Z vs top cross section ==============================
+
+# Changing the top cross section only changes how the pdfs are mixed, so every cross section is tested with the same toys
+if args.scan_cross_sections:
+    scan_cross_section_arr = np.linspace(args.scan_cross_sections[0], args.scan_cross_sections[1], int(args.scan_cross_sections[2]))
+    qcd_bin_edges = np.append(qcd_bins_centered - qcd_bin_width/2, qcd_bins_centered[-1] + qcd_bin_width/2)
+    mu_qcd = args.scan_luminosity*detector_efficiency*qcd_cross_section
+    scan_mixed_pdfs, mu_mixed = mixture_pdfs(qcd_reference_pdf, top_reference_pdf, mu_qcd, args.scan_luminosity*detector_efficiency*scan_cross_section_arr)
+    _, nstdevs_scan_arr, effective_n_toys = rate_scan(qcd_reference_pdf, scan_mixed_pdfs, mu_qcd, mu_mixed, qcd_bin_edges, N_toys, np.random.default_rng())
+    print("Effective number of toys of each top cross section:", effective_n_toys)
+
+    extension_scan = str(args.scan_luminosity) + 'L_' + extension
+    np.savetxt(array_dir + 'top_cross_sectionZvsxsec_arr' + extension_scan + '.txt', scan_cross_section_arr)
+    np.savetxt(array_dir + 'nstdevsZvsxsec_arr' + extension_scan + '.txt', nstdevs_scan_arr)
+
+    plt.figure()
+    plt.plot(scan_cross_section_arr, nstdevs_scan_arr, label = r'$L = %s$' % args.scan_luminosity)
+    plt.legend()
+    plt.xlabel(r'$\sigma_{top}$')
+    plt.ylabel(r'Significance $Z$')
+
+# =========================== Z of several signal models ==========================
+
+# Top and the other signal models are all tested against the same QCD toys
+if args.alternatives:
+    if len(args.alternative_cross_sections) != len(args.alternatives):
+        raise ValueError("Give one cross section per file of --alternatives")
+    signal_names = ['top'] + [os.path.splitext(os.path.basename(path))[0] for path in args.alternatives]
+    signal_pdfs = [top_reference_pdf] + [np.loadtxt(path, unpack=True) for path in args.alternatives]
+    signal_cross_sections = np.array([top_cross_section] + args.alternative_cross_sections)
+    qcd_bin_edges = np.append(qcd_bins_centered - qcd_bin_width/2, qcd_bins_centered[-1] + qcd_bin_width/2)
+    alternative_pdfs = np.stack([qcd_reference_pdf*qcd_cross_section/(qcd_cross_section + xs) + pdf*xs/(qcd_cross_section + xs)
+                                 for pdf, xs in zip(signal_pdfs, signal_cross_sections)])
+    mu_qcd = args.scan_luminosity*detector_efficiency*qcd_cross_section
+    mu_mixed = args.scan_luminosity*detector_efficiency*(qcd_cross_section + signal_cross_sections)
+    alpha_models, nstdevs_models, _, _ = multi_hypothesis_test(qcd_reference_pdf, alternative_pdfs, mu_qcd, mu_mixed, qcd_bin_edges, N_toys, np.random.default_rng())
+
+    print("\nSignal model, cross section, alpha, nstdevs at L =", args.scan_luminosity)
+    for name, xs, alpha, nstdevs in zip(signal_names, signal_cross_sections, alpha_models, nstdevs_models):
+        print("{:>40} {:12.4f} {:12.4g} {:8.3f}".format(name, xs, alpha, nstdevs))
+    extension_models = str(args.scan_luminosity) + 'L_' + extension
+    np.savetxt(array_dir + 'alphaModels_arr' + extension_models + '.txt', alpha_models)
+    np.savetxt(array_dir + 'nstdevsModels_arr' + extension_models + '.txt', nstdevs_models)
+
 # Run for specific values only for LLR plotting purposes
 #luminosity = 2.0
 #prob_threshold = 0
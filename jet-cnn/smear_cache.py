@@ -0,0 +1,107 @@
+"""
+    Disk cache of smeared jet image datasets for smearing studies. Each smeared
+    variant of the prepared dataset is blurred once, stored as a float32 .npy
+    file and memory mapped by every bootstrap iteration and every later run
+    with the same sigma, smear target and source data. The least recently used
+    variants are deleted when the cache grows beyond its disk budget.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import os
+import glob
+import hashlib
+import numpy as np
+
+from smearing import blur_images, get_smear_mask
+
+def dataset_hash(x_data, y_data, chunk_size=10000):
+    """
+    Hash of the contents of the dataset, read in chunks so that memory mapped
+    data is not loaded in full.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(str(x_data.shape).encode())
+    for start in range(0, len(x_data), chunk_size):
+        hasher.update(np.ascontiguousarray(x_data[start:start+chunk_size]).tobytes())
+    hasher.update(np.ascontiguousarray(y_data).tobytes())
+    return hasher.hexdigest()[:16]
+
+def cache_file_name(smear_target, sigma, data_hash):
+    return 'smeared_' + str(smear_target) + '_' + str(sigma) + 'sigma_' + data_hash + '.npy'
+
+def file_size(path):
+    """
+    Size of a cache file, or 0 if another run has already evicted it.
+    """
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def evict_lru(cache_dir, bytes_needed, disk_budget):
+    """
+    Delete the least recently used cache files until bytes_needed more fit in disk_budget bytes.
+    """
+    # Files still being written by other runs are not counted or evicted
+    cached_files = [f for f in glob.glob(os.path.join(cache_dir, 'smeared_*.npy')) if '.tmp' not in f]
+    cached_files = sorted([(os.path.getmtime(f), f) for f in cached_files if os.path.exists(f)])
+    cached_files = [f for _, f in cached_files]
+    used = sum(file_size(f) for f in cached_files)
+    while cached_files and used + bytes_needed > disk_budget:
+        oldest = cached_files.pop(0)
+        used -= file_size(oldest)
+        try:
+            os.remove(oldest)
+        except FileNotFoundError:
+            continue
+        print("Evicted smeared dataset " + oldest + " from cache")
+
+def smear_into(smeared, x_data, smear_mask, sigma, chunk_size):
+    """
+    Fill smeared with x_data, blurring the images selected by smear_mask chunk by chunk.
+    """
+    for start in range(0, len(x_data), chunk_size):
+        x_chunk = np.array(x_data[start:start+chunk_size], dtype=float)
+        to_smear = smear_mask[start:start+chunk_size]
+        if np.any(to_smear):
+            x_chunk[to_smear] = blur_images(x_chunk[to_smear], sigma)
+        smeared[start:start+chunk_size] = x_chunk
+    return smeared
+
+def get_smeared_data(x_data, y_data, smear_target, sigma, cache_dir='smear_cache/', disk_budget_gb=20, chunk_size=5000):
+    """
+    Return a read-only memory map of x_data with the images selected by smear_target
+    blurred with the given sigma, making and caching it first if it is not already cached.
+    A dataset larger than the whole disk budget is smeared in memory and not cached.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, cache_file_name(smear_target, sigma, dataset_hash(x_data, y_data)))
+    smear_mask = get_smear_mask(y_data, smear_target)
+
+    try:
+        # Mark as recently used
+        os.utime(path)
+        print("Loading smeared dataset from cache " + path)
+        return np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        # Not cached yet, or evicted by another run in the meantime
+        pass
+
+    bytes_needed = x_data.size*np.dtype(np.float32).itemsize
+    disk_budget = disk_budget_gb*1024**3
+    if bytes_needed > disk_budget:
+        print("Smeared dataset of " + str(round(bytes_needed/1024**3, 2)) + " GB is larger than the cache budget, smearing it in memory instead")
+        return smear_into(np.empty(x_data.shape, dtype=np.float32), x_data, smear_mask, sigma, chunk_size)
+    evict_lru(cache_dir, bytes_needed, disk_budget)
+
+    print("Smearing dataset and saving to cache " + path)
+    # Write to a temporary file first so that an interrupted run never leaves a partial cache entry
+    tmp_path = path[:-len('.npy')] + '.tmp' + str(os.getpid()) + '.npy'
+    smeared = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=x_data.shape)
+    smear_into(smeared, x_data, smear_mask, sigma, chunk_size)
+    smeared.flush()
+    del smeared
+    # Mapped before it is renamed, so an eviction by another run only unlinks the name and not the data
+    smeared = np.load(tmp_path, mmap_mode='r')
+    os.replace(tmp_path, path)
+    return smeared
@@ -0,0 +1,85 @@
+"""
+    Gaussian smearing of jet images and a keras Sequence that applies the
+    smearing batch by batch while the data is fed to the network, so that no
+    smeared copy of the full dataset has to be held in memory.
+    __author__ = "Michael Soughton", "Charanjit Kaur Khosa", "Veronica Sanz"
+    __email__ =
+"""
+import numpy as np
+from scipy import ndimage
+
+import keras
+
+# The truncation used for the Gaussian kernel everywhere in the jet-cnn code
+truncate = 3.5
+
+def get_smear_mask(y_data, smear_target):
+    """
+    Boolean mask over events selecting the jet images that are to be smeared.
+    y_data are the one-hot labels with column 0 for QCD and column 1 for top.
+    """
+    if smear_target == "neither":
+        return np.zeros(len(y_data), dtype=bool)
+    elif smear_target == "qcd":
+        return y_data[:,0] == 1
+    elif smear_target == "top":
+        return y_data[:,1] == 1
+    elif smear_target == "both":
+        return np.ones(len(y_data), dtype=bool)
+    raise ValueError("smear_target must be one of 'neither', 'top', 'qcd', 'both', got " + str(smear_target))
+
+def blur_images(images, sigma):
+    """
+    Blur a batch of images of shape (n_images, xpixels, ypixels, 1) and renormalise
+    each blurred image to a maximum of 1. This is the same as applying
+    filters.gaussian(image, sigma=(sigma,sigma), truncate=3.5, multichannel=True)
+    to each image in turn, but done in one call over the whole batch.
+    """
+    # No smearing across images or channels, only across the pixels
+    blurred_images = ndimage.gaussian_filter(np.asarray(images, dtype=float), sigma=(0, sigma, sigma, 0), mode='nearest', truncate=truncate)
+    # Renormalise blurred images
+    max_values = np.max(blurred_images, axis=(1,2,3), keepdims=True)
+    max_values[max_values == 0] = 1.0
+    return blurred_images/max_values
+
+class SmearedSequence(keras.utils.Sequence):
+    """
+    Feeds batches of x_data[indices], y_data[indices] to a keras model, smearing
+    the images selected by smear_mask as each batch is produced. Only the
+    indices are held by the sequence, the images themselves are gathered from
+    x_data (which may be a memory map) one batch at a time.
+    """
+    def __init__(self, x_data, y_data, indices, smear_mask=None, sigma=0, batch_size=100, shuffle=False, seed=None):
+        super().__init__()
+        self.x_data = x_data
+        self.y_data = y_data
+        self.indices = np.asarray(indices)
+        self.smear_mask = smear_mask
+        self.sigma = sigma
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(self.indices))
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices)/self.batch_size))
+
+    def batch_indices(self, batch):
+        # Sorted so that reading from a memory map is sequential within a batch. Pass
+        # sorted indices without shuffling to get predictions in the order of indices
+        return np.sort(self.indices[self.order[batch*self.batch_size:(batch+1)*self.batch_size]])
+
+    def __getitem__(self, batch):
+        idx = self.batch_indices(batch)
+        x_batch = np.array(self.x_data[idx], dtype=float)
+        if self.smear_mask is not None and self.sigma > 0:
+            to_smear = self.smear_mask[idx]
+            if np.any(to_smear):
+                x_batch[to_smear] = blur_images(x_batch[to_smear], self.sigma)
+        return x_batch, self.y_data[idx]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
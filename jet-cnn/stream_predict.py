@@ -0,0 +1,81 @@
+#Purpose: Stream a trained CNN over a dataset of jet images of any size, saving P(top) of every jet and the pdfs
+import os
+import sys
+import numpy as np
+
+# The modules shared by the CNN, DNN and VAE code are in common/ at the top of the repository
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from numpy_inference import NumpyModel
+from streaming_inference import IncrementalHistogram, stream_predict
+
+# =========================== Take in arguments ================================
+import argparse
+
+parser = argparse.ArgumentParser(description='These are the arguments that will be passed to the script')
+
+parser.add_argument("--model",
+                    type=str,
+                    default="model_cnn/cnn005.h5",
+                    help="str: The trained CNN, or its NumPy export (.npz) from export_numpy.py to predict without TensorFlow. Default is 'model_cnn/cnn005.h5'.")
+
+parser.add_argument("--data",
+                    type=str,
+                    default="prepped_x_data.npy",
+                    help="str: The .npy array of prepared jet images, read a chunk at a time. Default is 'prepped_x_data.npy'.")
+
+parser.add_argument("--labels",
+                    type=str,
+                    default="prepped_y_data.npy",
+                    help="str: The .npy array of the (one-hot) labels of the jets, which the pdfs are split by. Pass '' for unlabelled jets. Default is 'prepped_y_data.npy'.")
+
+parser.add_argument("--output_dir",
+                    type=str,
+                    default="arrays/",
+                    help="str: The directory the predictions and pdfs are saved to. Default is 'arrays/'.")
+
+parser.add_argument("--chunk_size",
+                    type=int,
+                    default=100000,
+                    help="int: The number of jets read and predicted at a time. Default is 100000.")
+
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=0,
+                    help="int: The batch size of predict. Default is 0, which tunes it on the first chunk.")
+
+parser.add_argument("--n_bins",
+                    type=int,
+                    default=100,
+                    help="int: The number of bins of the pdfs of P(top), between 0 and 1. Default is 100.")
+
+args = parser.parse_args()
+
+# ==============================================================================
+
+os.makedirs(args.output_dir, exist_ok=True)
+tag = os.path.splitext(os.path.basename(args.model))[0]
+output = args.output_dir + 'stream_predictions_' + tag + '.npy'
+pdf_file = args.output_dir + 'stream_pdfs_' + tag + '.npz'
+
+if args.model.endswith('.npz'):
+    model_cnn = NumpyModel(args.model)
+else:
+    import keras
+    model_cnn = keras.models.load_model(args.model)
+x_data = np.load(args.data, mmap_mode='r')
+print("Predicting on", len(x_data), "jets")
+
+if args.labels != "":
+    labels = np.load(args.labels, mmap_mode='r')
+    class_names = ['QCD', 'Top']
+else:
+    labels = 0
+    class_names = ['All']
+histogram = IncrementalHistogram(np.linspace(0, 1, args.n_bins + 1), n_classes=len(class_names))
+
+def predict_top(x, batch_size):
+    return model_cnn.predict(x, batch_size=batch_size, verbose=0)[:,1]
+
+stream_predict(predict_top, x_data, output, chunk_size=args.chunk_size, batch_size=args.batch_size, histogram=histogram, labels=labels)
+histogram.save(pdf_file, class_names)
+print("Saved predictions to", output, "and pdfs to", pdf_file)